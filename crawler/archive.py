@@ -0,0 +1,100 @@
+# crawler/archive.py
+import gzip
+import json
+import time
+import threading
+from pathlib import Path
+
+from config import RAW_ARCHIVE_DIR, RAW_SEGMENT_BYTES
+
+# 原始响应归档（RAW_ARCHIVE=True 时由 main 写入，reparse.py 离线读取）：
+# - raw/seg-000001.gz ...：每条响应是一个独立的 gzip member，直接拼接（gzip -dc 也能整段解开）
+# - raw/index.jsonl：每条一行 {"kind": "list"|"detail", "key": ..., "seg": ..., "off": ..., "len": ..., "ts": ...}
+#   同一 (kind, key) 以最后一行为准
+# 先写段文件再写索引：崩溃时最多留下没有索引指向的字节，不会有指向半条数据的索引
+INDEX_NAME = "index.jsonl"
+
+
+def segment_name(n: int) -> str:
+    return f"seg-{n:06d}.gz"
+
+
+def load_index(root: Path = RAW_ARCHIVE_DIR) -> dict:
+    """ {(kind, key): entry}，同 key 取最后一条 """
+    out = {}
+    path = Path(root) / INDEX_NAME
+    if not path.exists():
+        return out
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            out[(entry["kind"], entry["key"])] = entry
+    return out
+
+
+def read_entry(entry: dict, root: Path = RAW_ARCHIVE_DIR) -> str:
+    with (Path(root) / entry["seg"]).open("rb") as f:
+        f.seek(entry["off"])
+        blob = f.read(entry["len"])
+    return gzip.decompress(blob).decode("utf-8")
+
+
+class RawArchive:
+    """ 线程安全：抓取线程池里并发 put；压缩在锁外做，锁内只追加字节和索引行 """
+
+    def __init__(self, root: Path = RAW_ARCHIVE_DIR, segment_bytes: int = RAW_SEGMENT_BYTES):
+        self.root = Path(root)
+        self.root.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = max(1, int(segment_bytes))
+        self._lock = threading.Lock()
+
+        existing = sorted(self.root.glob("seg-*.gz"))
+        self._seg_no = int(existing[-1].name[4:10]) if existing else 1
+        self._seg = None
+        self._index = (self.root / INDEX_NAME).open("a", encoding="utf-8")
+        self._open_segment()
+
+    def _open_segment(self) -> None:
+        if self._seg is not None:
+            self._seg.close()
+        self._seg = (self.root / segment_name(self._seg_no)).open("ab")
+
+    def put(self, kind: str, key, text: str) -> None:
+        blob = gzip.compress(text.encode("utf-8"), compresslevel=6)
+        with self._lock:
+            if self._seg.tell() > 0 and self._seg.tell() + len(blob) > self.segment_bytes:
+                self._seg_no += 1
+                self._open_segment()
+
+            off = self._seg.tell()
+            self._seg.write(blob)
+            self._seg.flush()
+
+            self._index.write(json.dumps({
+                "kind": kind,
+                "key": str(key),
+                "seg": segment_name(self._seg_no),
+                "off": off,
+                "len": len(blob),
+                "ts": int(time.time()),
+            }, ensure_ascii=False) + "\n")
+            self._index.flush()
+
+    def put_list(self, page: int, data: dict) -> None:
+        self.put("list", page, json.dumps(data, ensure_ascii=False))
+
+    def put_detail(self, msg_id: str, html_text: str) -> None:
+        self.put("detail", msg_id, html_text)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._seg is not None:
+                self._seg.close()
+                self._seg = None
+            self._index.close()
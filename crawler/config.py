@@ -17,6 +17,42 @@ ATTACH_DIR = BASE_DIR / "attachments"
 
 DB_FILE = DATA_DIR / "qa_db.json"
 STATE_FILE = DATA_DIR / "crawl_state.json"
+# 已下载完成附件的清单（size / sha256），用于校验本地文件是否完整
+ATTACH_MANIFEST_FILE = DATA_DIR / "attachments_manifest.jsonl"
+# 内容寻址的附件实体：_blobs/<sha256[:2]>/<sha256[2:4]>/<sha256>；
+# attachments/<msg_id>/<fileId><ext> 是指向它的硬链接，同一份文件只下载、只存一次
+ATTACH_BLOB_DIR = ATTACH_DIR / "_blobs"
+
+# 存储后端："json"（qa_db.json + crawl_state.json）或 "sqlite"（单文件，WAL）
+STORAGE_BACKEND = "json"
+SQLITE_FILE = DATA_DIR / "crawl.sqlite3"
+
+# 原始响应归档：列表 JSON / 详情 HTML 按 gzip 分段存到 data/raw/，解析逻辑改了之后用
+# python crawler/reparse.py 离线重建 qa_db，不用重新抓
+RAW_ARCHIVE = False
+RAW_ARCHIVE_DIR = DATA_DIR / "raw"
+RAW_SEGMENT_BYTES = 256 * 1024 * 1024
+
+# 进度事件（crawler/events.py）：翻页 / 新问答 / 403 / 冷却 / 失败项，一行一个追加到 EVENTS_FILE，
+# Viewer 的 /api/events 读增量用 SSE 推给页面；None = 不写。超过 EVENTS_MAX_BYTES 轮转成 .1（只留一份）
+EVENTS_FILE = DATA_DIR / "crawl_events.jsonl"
+EVENTS_MAX_BYTES = 16 * 1024 * 1024
+
+# qa_db 追加日志（qa_db.log.jsonl）超过该大小时，后台压缩进 qa_db.json 快照
+DB_LOG_COMPACT_BYTES = 64 * 1024 * 1024
+
+# ===================== 批量落盘（组提交） =====================
+# 记录 / 失败项 / 断点先进内存缓冲，由后台线程 flush，满足任一条件即 flush：
+# - 缓冲写入数 >= FLUSH_EVERY_RECORDS
+# - 距上次 flush >= FLUSH_INTERVAL_SECONDS
+# - 一页处理完（FLUSH_ON_PAGE=True）
+# 即：崩溃（kill -9 / 断电）最多丢失「当前这一页 / 最近 FLUSH_INTERVAL_SECONDS 秒 / FLUSH_EVERY_RECORDS 条」中先到者；
+# Ctrl-C / SIGTERM / 正常退出都会先写完缓冲。丢失的部分下次运行会从 next_page 重新抓取。
+FLUSH_EVERY_RECORDS = 50
+FLUSH_INTERVAL_SECONDS = 30
+FLUSH_ON_PAGE = True
+# flush 时 fsync（掉电也不丢已 flush 的数据；略慢）
+FLUSH_FSYNC = True
 
 # 自动创建目录
 DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -28,10 +64,46 @@ DOWNLOAD_ATTACHMENTS = True
 START_PAGE = 1
 END_PAGE = 5000
 
+# 增量模式（python crawler/main.py --incremental）：从第 1 页往后，只抓库里没有的 id；
+# 连续 INCREMENTAL_STOP_PAGES 页没有新 id，或整页都早于库里最新的 留言时间，即停止
+INCREMENTAL_STOP_PAGES = 3
+
 # 全局限速：30 req/min ~= 2s/req（列表/详情/附件都算）
 TARGET_RPM = 30
+# 令牌桶容量：空闲之后允许连发的请求数（1 = 严格匀速）
+RATE_BURST = 2
+# 各类请求的子预算（rpm），同时受全局速率约束；None/0 = 不单独限制
+ENDPOINT_RPM = {
+    "list": 30,
+    "detail": 30,
+    "attachment": 20,
+}
+
+# 自适应限速（AIMD）：被拦（403/html-block）时立刻减半，之后干净时慢慢加速，最多回到 TARGET_RPM
+ADAPTIVE_RPM = True
+MIN_RPM = 6
+RPM_INCREASE_STEP = 1       # 每 RPM_INCREASE_EVERY 次连续成功 +1 rpm
+RPM_INCREASE_EVERY = 20
+RPM_DECREASE_FACTOR = 0.5
+
+# 并发抓取：最多同时在途的请求数（详情/附件/预取列表），共享上面的全局 RPM 预算
+# 1 = 完全串行（旧行为）；调大只会掩盖单请求延迟，不会超过 TARGET_RPM
+CONCURRENCY = 4
+
+# 调度引擎（crawler/engine.py）：
+# - 最多 LIST_LOOKAHEAD 个列表页同时在处理（当前页的详情 + 预取下一页）
+# - 失败项（本次新失败的、上次留下的）进 retry 队列，与新工作按 RETRY_RATIO 穿插：0.25 = 每 4 次调度有 1 次给重试
+# - 本次新失败的项至少等 RETRY_DELAY_SECONDS 再重试；每项本次最多执行 RETRY_MAX_ATTEMPTS 次，仍失败留给下次运行
+LIST_LOOKAHEAD = 2
+RETRY_RATIO = 0.25
+RETRY_DELAY_SECONDS = 60
+RETRY_MAX_ATTEMPTS = 2
+
+# 详情解析（lxml）放到子进程：PARSE_WORKERS 个进程；0 = 在抓取线程里直接解析
+# 抓取线程等解析结果，在途解析数受 CONCURRENCY 约束
+PARSE_WORKERS = 2
 
-# 403：连续阈值与冷却
+# 403：连续阈值与冷却（ADAPTIVE_RPM=True 时只有降到 MIN_RPM 仍被拦才会整体冷却）
 CONSEC_403_THRESHOLD = 6
 COOLDOWN_SECONDS = 20 * 60
 
@@ -0,0 +1,101 @@
+# crawler/dblog.py
+"""
+qa_db 的记录更新与追加日志回放。不依赖 config：viewer/backend 回放日志也用这里（crawler.dblog），
+两边对同一段日志得到同样的结果。
+
+日志每行一个 op：
+- {"op": "put", "record": {...}}                          整条记录覆盖写
+- {"op": "att", "id": ..., "url": ..., "local_path": ...}  回填附件 local_path
+回放是幂等的：同一段日志在快照上重复回放，结果不变。
+"""
+import json
+
+
+def empty_meta() -> dict:
+    return {
+        "count": 0,
+        "max_question_length": 0,
+        "max_question_id": "",
+    }
+
+
+def upsert_record(db: dict, record: dict) -> None:
+    rid = record["id"]
+    record["status"] = "ok"
+    is_new = rid not in db["records"]
+    db["records"][rid] = record
+    update_meta(db["meta"], record, is_new)
+
+
+def update_meta(meta: dict, record: dict, is_new: bool) -> None:
+    if is_new:
+        meta["count"] += 1
+
+    # 更新 max_question_length
+    q = record.get("问题内容") or ""
+    q_len = len(q)
+    if q_len > meta.get("max_question_length", 0):
+        meta["max_question_length"] = q_len
+        meta["max_question_id"] = record["id"]
+
+    # 最新的 留言时间（增量模式的截止线）；格式统一为 YYYY-MM-DD...，直接按字符串比较
+    leave_time = record.get("留言时间") or ""
+    if leave_time > (meta.get("newest_leave_time") or ""):
+        meta["newest_leave_time"] = leave_time
+
+
+def update_attachment_local_path(db: dict, msg_id: str, url: str, local_path: str) -> bool:
+    """
+    在 db.records[msg_id]["附件"] 里按 url/fileId 找到对应附件，写入 local_path。
+    找不到也不算致命，返回 False。
+    """
+    rec = db["records"].get(msg_id)
+    if not rec:
+        return False
+
+    atts = rec.get("附件") or []
+    if not isinstance(atts, list):
+        return False
+
+    # 优先用 url 精确匹配
+    for att in atts:
+        if isinstance(att, dict) and att.get("url") == url:
+            att["local_path"] = local_path
+            return True
+
+    # 兜底：按 fileId 匹配
+    fid = ""
+    if "fileId=" in url:
+        fid = url.split("fileId=")[-1].split("&")[0]
+
+    if fid:
+        for att in atts:
+            if isinstance(att, dict) and (att.get("fileId") == fid or att.get("id") == fid):
+                att["local_path"] = local_path
+                return True
+
+    return False
+
+
+def parse_db_log_line(line):
+    """ 一行日志 → op；空行、崩溃时写了一半的行返回 None """
+    line = line.strip()
+    if not line:
+        return None
+    try:
+        op = json.loads(line)
+    except ValueError:
+        return None
+    return op if isinstance(op, dict) else None
+
+
+def apply_db_op(db: dict, op: dict) -> bool:
+    """ 把一个 op 应用到 {"meta", "records"} 上；不认识的 op 返回 False """
+    kind = op.get("op")
+    if kind == "put" and isinstance(op.get("record"), dict):
+        upsert_record(db, op["record"])
+    elif kind == "att":
+        update_attachment_local_path(db, op.get("id", ""), op.get("url", ""), op.get("local_path", ""))
+    else:
+        return False
+    return True
@@ -1,13 +1,33 @@
 # crawler/download.py
+import os
 import re
+import json
+import time
+import shutil
+import hashlib
+import threading
+from contextlib import contextmanager
 from pathlib import Path
 
-from config import ATTACH_DIR, ATTACH_TIMEOUT, MAX_RETRIES
-from net import build_attachment_headers, request_with_retry_plain
+import requests
+
+try:
+    import fcntl
+except ImportError:  # Windows：只有进程内互斥
+    fcntl = None
+
+from config import ATTACH_DIR, ATTACH_BLOB_DIR, ATTACH_TIMEOUT, ATTACH_MANIFEST_FILE, MAX_RETRIES
+from net import build_attachment_headers, request_with_retry_plain, backoff_sleep
+
+PART_SUFFIX = ".part"
 
 
 def is_permanent_attachment_error(resp) -> bool:
     """ 判断是否为“参数缺失/业务错误”导致的附件不可下载（不应重试/不应计入风控）。 """
+    # 二进制附件不读 body：否则 stream=True 的整个文件会在这里一次性读进内存，断流也无法续传
+    ct = (resp.headers.get("Content-Type") or "").lower()
+    if ("text" not in ct) and ("json" not in ct):
+        return False
     try:
         text = (resp.text or "")[:2000]
     except Exception:
@@ -15,7 +35,215 @@ def is_permanent_attachment_error(resp) -> bool:
     return "oid can not be null" in text
 
 
-def download_one_attachment(page_session, rate, state, msg_id: str, att: dict) -> str:
+# ===================== 附件清单（manifest） =====================
+# data/attachments_manifest.jsonl：每下载完成一个文件追加一行
+# {"path": "<msg_id>/<fileId>.pdf", "msg_id", "fileId", "url", "size", "sha256", "ts"}
+# 同一 path 以最后一行为准；用来校验已存在的文件是否完整，
+# 同时按 fileId 索引到 blob：已知 fileId 的附件直接链接，不再走网络
+_manifest_lock = threading.Lock()
+_manifest = None
+_by_file_id = None
+
+
+def load_manifest(path: Path = ATTACH_MANIFEST_FILE) -> dict:
+    out = {}
+    if not path.exists():
+        return out
+    with path.open("r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                # 崩溃时写了一半的最后一行
+                continue
+            if entry.get("path"):
+                out[entry["path"]] = entry
+    return out
+
+
+@contextmanager
+def _manifest_write_lock(path: Path):
+    """
+    追加与重写清单互斥：进程内用 _manifest_lock；main.py 和 manifest.py 同时跑时
+    再对旁边的 .lock 文件加 flock（清单本身会被替换，锁它没用）
+    """
+    with _manifest_lock:
+        if fcntl is None:
+            yield
+            return
+        with path.with_name(path.name + ".lock").open("a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            yield
+
+
+def _ensure_manifest() -> None:
+    # 调用方持有 _manifest_lock
+    global _manifest, _by_file_id
+    if _manifest is None:
+        _manifest = load_manifest()
+        _by_file_id = {}
+        for entry in _manifest.values():
+            if entry.get("fileId") and entry.get("sha256"):
+                _by_file_id[entry["fileId"]] = entry
+
+
+def manifest_entry(rel_path: str):
+    with _manifest_lock:
+        _ensure_manifest()
+        return _manifest.get(rel_path)
+
+
+def manifest_entry_by_file_id(file_id: str):
+    with _manifest_lock:
+        _ensure_manifest()
+        return _by_file_id.get(file_id)
+
+
+def record_manifest(entry: dict) -> None:
+    line = json.dumps(entry, ensure_ascii=False) + "\n"
+    with _manifest_write_lock(ATTACH_MANIFEST_FILE):
+        _ensure_manifest()
+        with ATTACH_MANIFEST_FILE.open("a", encoding="utf-8") as f:
+            f.write(line)
+        _manifest[entry["path"]] = entry
+        if entry.get("fileId") and entry.get("sha256"):
+            _by_file_id[entry["fileId"]] = entry
+
+
+def rebuild_manifest(root: Path = ATTACH_DIR, path: Path = ATTACH_MANIFEST_FILE) -> dict:
+    """
+    按 attachments/<msg_id>/ 下实际的文件整体重写清单（python crawler/manifest.py）：
+    - 已记录的行原样保留（size 与文件不符的也保留：下载时会据此判定不完整、重新下载）
+    - 清单之前下载的旧文件补一行，只有 size、没有 sha256（不参与按 fileId 链接）
+    - 文件已经不在的行去掉；同一 path 的多行合成一行
+    先写 .tmp 再原子替换；扫描期间爬虫追加的行原样接在最后
+    """
+    global _manifest, _by_file_id
+    start = path.stat().st_size if path.exists() else 0
+    old = load_manifest(path)
+    stats = {"kept": 0, "added": 0, "mismatch": 0, "dropped": 0}
+
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open("w", encoding="utf-8") as out:
+        for d in sorted(os.scandir(root), key=lambda e: e.name):
+            if not d.is_dir() or Path(d.path) == Path(ATTACH_BLOB_DIR):
+                continue
+            for f in sorted(os.scandir(d.path), key=lambda e: e.name):
+                if not f.is_file() or f.name.endswith((PART_SUFFIX, ".link")):
+                    continue
+                rel_path = f"{d.name}/{f.name}"
+                st = f.stat()
+                entry = old.pop(rel_path, None)
+                if entry is None:
+                    entry = {"path": rel_path, "msg_id": d.name, "fileId": Path(f.name).stem,
+                             "size": st.st_size, "ts": int(st.st_mtime)}
+                    stats["added"] += 1
+                elif entry.get("size") != st.st_size:
+                    stats["mismatch"] += 1
+                else:
+                    stats["kept"] += 1
+                out.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    stats["dropped"] = len(old)
+
+    with _manifest_write_lock(path):
+        # 扫描期间追加的行（本进程的、同时在跑的爬虫的）：从扫描开始时的位置接上；同一 path 后写的为准。
+        # 持锁期间没有人能再追加，接上之后才替换
+        if path.exists():
+            with path.open("rb") as src, tmp.open("ab") as out:
+                src.seek(start)
+                shutil.copyfileobj(src, out)
+        os.replace(tmp, path)
+        _manifest = _by_file_id = None
+    return stats
+
+
+def file_sha256(path: Path) -> str:
+    h = hashlib.sha256()
+    with path.open("rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+# ===================== 内容寻址存储（blob） =====================
+def blob_path(digest: str) -> Path:
+    return Path(ATTACH_BLOB_DIR) / digest[:2] / digest[2:4] / digest
+
+
+def link_blob(blob: Path, dest: Path) -> None:
+    """ dest 原子地指向 blob：优先硬链接（不占额外空间），文件系统不支持时退回复制 """
+    tmp = dest.with_name(dest.name + ".link")
+    tmp.unlink(missing_ok=True)
+    try:
+        os.link(blob, tmp)
+    except OSError:
+        shutil.copyfile(blob, tmp)
+    os.replace(tmp, dest)
+
+
+def store_blob(part_path: Path, digest: str) -> Path:
+    """ 把下载完的 .part 收进 blob 库；内容已存在（别的 fileId、同样字节）就丢掉这份 """
+    blob = blob_path(digest)
+    # 已有的 blob 要先验一遍：硬链接的另一端被改写过时，用新下载的这份换掉
+    if blob.exists() and file_sha256(blob) == digest:
+        part_path.unlink(missing_ok=True)
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(part_path, blob)
+    return blob
+
+
+def link_known_file_id(file_id: str, msg_id: str, save_path: Path, rel_path: str, url: str) -> bool:
+    """ fileId 已经下载过（任意问答下）且 blob 完好：直接链接到本问答目录，返回 True """
+    entry = manifest_entry_by_file_id(file_id)
+    if entry is None:
+        return False
+    blob = blob_path(entry["sha256"])
+    if not blob.exists() or blob.stat().st_size != entry.get("size"):
+        return False
+
+    link_blob(blob, save_path)
+    record_manifest({**entry, "path": rel_path, "msg_id": msg_id, "url": url, "ts": int(time.time())})
+    return True
+
+
+# ===================== 断点续传 =====================
+def parse_content_range(value: str):
+    """ "bytes 100-199/1000" → (100, 1000)；"bytes */1000" → (None, 1000)；total 为 * 时是 None """
+    m = re.match(r"bytes\s+(?:(\d+)-\d+|\*)/(\d+|\*)", (value or "").strip())
+    if not m:
+        return None, None
+    start = int(m.group(1)) if m.group(1) is not None else None
+    total = int(m.group(2)) if m.group(2) != "*" else None
+    return start, total
+
+
+def expected_total(resp, offset: int):
+    """ 本次下载完成后文件应有的总大小；拿不到（或内容被压缩）返回 None，不做校验 """
+    if (resp.headers.get("Content-Encoding") or "identity").lower() != "identity":
+        return None
+    if resp.status_code == 206:
+        _, total = parse_content_range(resp.headers.get("Content-Range"))
+        return total
+    cl = resp.headers.get("Content-Length")
+    if cl and cl.isdigit():
+        return offset + int(cl)
+    return None
+
+
+def download_one_attachment(page_session, rate, state, msg_id: str, att: dict, att_session=None) -> str:
+    """
+    page_session 只用来取 UA 等头信息；真正的下载走 att_session（build_attachment_session()），
+    不传则每次新建连接。
+
+    先写 <fileId>.<ext>.part，断流后下次用 Range 从已有字节续传（服务端不支持则从头来）；
+    大小与 Content-Length / Content-Range 一致后按 sha256 收进 blob 库，
+    <msg_id>/<fileId><ext> 硬链接到 blob，并在 manifest 记录 size / sha256。
+    同一 fileId 之前下载过（其它问答里的同一份文件）则直接链接，不发请求。
+    """
     url = att.get("url", "")
     title = att.get("标题", "") or "file"
     fid = att.get("fileId") or (url.split("fileId=")[-1].split("&")[0] if "fileId=" in url else "unknown")
@@ -29,42 +257,136 @@ def download_one_attachment(page_session, rate, state, msg_id: str, att: dict) -
     save_dir.mkdir(parents=True, exist_ok=True)
 
     save_path = save_dir / f"{fid}{ext}"
+    part_path = save_dir / f"{fid}{ext}{PART_SUFFIX}"
+    rel_path = f"{msg_id}/{save_path.name}"
+
+    if save_path.exists():
+        entry = manifest_entry(rel_path)
+        size = save_path.stat().st_size
+        if entry is not None:
+            if entry.get("size") == size:
+                return str(save_path)
+            print(f"[附件不完整] {rel_path} size={size} 期望={entry.get('size')}，重新下载")
+        elif size > 1024:
+            # manifest 之前下载的旧文件：无从校验，沿用原规则
+            return str(save_path)
 
-    if save_path.exists() and save_path.stat().st_size > 1024:
+    # fileId 只在真实存在时可信（"unknown" 会撞到别的附件）
+    if fid != "unknown" and link_known_file_id(fid, msg_id, save_path, rel_path, url):
         return str(save_path)
 
     headers = build_attachment_headers(page_session, msg_id)
+    # 不要压缩：Range / Content-Length 才是文件本身的字节数
+    headers["Accept-Encoding"] = "identity"
 
-    resp = request_with_retry_plain(
-        rate, state,
-        "GET", url,
-        headers=headers,
-        timeout=ATTACH_TIMEOUT,
-        max_retries=MAX_RETRIES,
-        stream=True,
-        allow_redirects=True,
-        block_if_html=True,
-        is_permanent_attachment_error=is_permanent_attachment_error,
-        # cookies=page_session.cookies.get_dict(),  # 如需尝试再打开
-    )
-
-    # 永久失败：直接跳过（不保存文件）
-    if is_permanent_attachment_error(resp):
-        raise Exception("attachment permanent invalid: oid can not be null")
+    # 一个附件最多 MAX_RETRIES 次请求：每次单发，失败后的续传和退避都在这一层
+    last_exc = None
+    backoff = False
+    for attempt in range(1, MAX_RETRIES + 1):
+        if backoff:
+            backoff_sleep(attempt - 1)
+        backoff = True
 
-    ct = (resp.headers.get("Content-Type") or "").lower()
-    if "text/html" in ct:
-        raise Exception(f"attachment blocked: content-type={ct}")
+        offset = part_path.stat().st_size if part_path.exists() else 0
+        req_headers = dict(headers)
+        if offset > 0:
+            req_headers["Range"] = f"bytes={offset}-"
+
+        try:
+            resp = request_with_retry_plain(
+                rate, state,
+                "GET", url,
+                headers=req_headers,
+                timeout=ATTACH_TIMEOUT,
+                max_retries=1,
+                stream=True,
+                allow_redirects=True,
+                block_if_html=True,
+                # 416：.part 已经 >= 文件大小，不走重试，下面自己处理
+                is_permanent_attachment_error=lambda r: r.status_code == 416 or is_permanent_attachment_error(r),
+                endpoint="attachment",
+                session=att_session,
+                # cookies=page_session.cookies.get_dict(),  # 如需尝试再打开
+            )
+        except (requests.exceptions.RequestException, RuntimeError) as e:
+            # 超时 / 5xx / 403 / html-block：已在 net 里打印、计入 403 统计
+            last_exc = e
+            continue
+
+        # with：无论成功还是抛异常，连接都归还给 att_session 的连接池
+        with resp:
+            # 永久失败：直接跳过（不保存文件）
+            if is_permanent_attachment_error(resp):
+                raise Exception("attachment permanent invalid: oid can not be null")
 
-    size = 0
-    with save_path.open("wb") as f:
-        for chunk in resp.iter_content(chunk_size=1024 * 64):
-            if not chunk:
+            if resp.status_code == 416:
+                _, total = parse_content_range(resp.headers.get("Content-Range"))
+                if total is not None and total == offset:
+                    # 上次其实已经下完，只差 rename
+                    break
+                print(f"[附件续传] {rel_path} 416 offset={offset} total={total}，从头下载")
+                part_path.unlink(missing_ok=True)
+                backoff = False
                 continue
-            f.write(chunk)
-            size += len(chunk)
 
+            ct = (resp.headers.get("Content-Type") or "").lower()
+            if "text/html" in ct:
+                raise Exception(f"attachment blocked: content-type={ct}")
+
+            if resp.status_code == 206:
+                start, _ = parse_content_range(resp.headers.get("Content-Range"))
+                if start != offset:
+                    print(f"[附件续传] {rel_path} Content-Range 起点={start} offset={offset}，从头下载")
+                    part_path.unlink(missing_ok=True)
+                    backoff = False
+                    continue
+            else:
+                # 200：服务端不支持 Range（或没带 Range），整份重来
+                offset = 0
+
+            total = expected_total(resp, offset)
+
+            try:
+                with part_path.open("ab" if offset else "wb") as f:
+                    for chunk in resp.iter_content(chunk_size=1024 * 64):
+                        if not chunk:
+                            continue
+                        f.write(chunk)
+            except Exception as e:
+                # 断流：已写入 .part 的字节保留，下一轮从这里续传
+                last_exc = e
+                got = part_path.stat().st_size if part_path.exists() else 0
+                print(f"[附件断流] attempt={attempt} {rel_path} 已有 {got}/{total or '?'} bytes "
+                      f"err={type(e).__name__}: {e}")
+                continue
+
+        size = part_path.stat().st_size
+        if total is not None and size != total:
+            last_exc = Exception(f"attachment size mismatch: {size} != {total}")
+            print(f"[附件不完整] attempt={attempt} {rel_path} {size}/{total} bytes")
+            if size > total:
+                part_path.unlink(missing_ok=True)
+            continue
+        break
+    else:
+        raise last_exc or Exception(f"attachment download failed after {MAX_RETRIES} attempts: {url}")
+
+    size = part_path.stat().st_size
     if size < 100:
+        part_path.unlink(missing_ok=True)
         raise Exception(f"attachment too small: {size} bytes")
 
+    digest = file_sha256(part_path)
+    blob = store_blob(part_path, digest)
+    link_blob(blob, save_path)
+    record_manifest({
+        "path": rel_path,
+        "msg_id": msg_id,
+        "fileId": fid,
+        "url": url,
+        "size": size,
+        "sha256": digest,
+        "ts": int(time.time()),
+    })
+
     return str(save_path)
@@ -0,0 +1,257 @@
+# crawler/engine.py
+"""
+统一抓取引擎：列表页 / 详情 / 附件都是 work item，由一个调度循环执行。
+
+- 两条队列：fresh（本次新产生的工作，按类型优先级：详情 > 附件 > 列表页）
+  和 retry（失败项，带最早可执行时间）；两边都有活时按 RETRY_RATIO 穿插重试，不再等到最后统一 backfill
+- Stage 可插拔：stages[type(item)] 负责该类 item
+  - run(item)：在线程池里跑（网络 + 解析），不碰 store
+  - commit(engine, work, outcome)：在调度线程里入库，并通过 engine.push / fail / resolve 产生后续工作
+- Source 提供新工作（forward / 增量），并在一页全部处理完后收到 page_done()，断点 / 停止条件都在 Source 里
+- 失败项一失败就写入 store 的 failed_*（崩溃不丢），重试成功再 discard；本次用完 max_attempts 次仍失败的留给下次运行
+- 页完成、失败项的记入 / 移出同时写进度事件（crawler/events.py）
+"""
+import time
+import heapq
+import itertools
+from collections import Counter
+from concurrent.futures import wait, FIRST_COMPLETED
+from typing import NamedTuple, Optional
+
+from config import CONCURRENCY, RETRY_RATIO, RETRY_MAX_ATTEMPTS, RETRY_DELAY_SECONDS
+from net import maybe_cooldown
+import events
+
+
+# ===================== Work items =====================
+class ListPage(NamedTuple):
+    page: int
+
+
+class Detail(NamedTuple):
+    msg_id: str
+    page: Optional[int] = None  # 来自哪个 fresh 列表页（页完成判定用）；补抓的为 None
+
+
+class Attachment(NamedTuple):
+    msg_id: str
+    url: str
+    title: str = ""
+    file_id: str = ""
+
+    def failed_item(self) -> dict:
+        """ state.failed_attachments 里的格式 """
+        return {"id": self.msg_id, "url": self.url, "标题": self.title, "fileId": self.file_id}
+
+
+# fresh 队列里的先后：先把已经列出来的详情做完，再翻下一页
+PRIORITY = {Detail: 0, Attachment: 1, ListPage: 2}
+
+
+class Work:
+    __slots__ = ("item", "attempt", "retry")
+
+    def __init__(self, item, attempt: int = 1, retry: bool = False):
+        self.item = item
+        self.attempt = attempt
+        self.retry = retry
+
+
+class Stage:
+    """ 某一类 work item 的处理逻辑 """
+
+    def run(self, item):
+        raise NotImplementedError
+
+    def commit(self, engine: "Engine", work: Work, outcome) -> None:
+        raise NotImplementedError
+
+
+class Source:
+    """ 新工作的来源；默认什么都不产生 """
+    name = "source"
+
+    def next_item(self, engine: "Engine"):
+        return None
+
+    @property
+    def finished(self) -> bool:
+        return True
+
+    def page_opened(self, engine: "Engine", page: int, data: dict) -> bool:
+        """ fresh 列表页取回时调用；返回 False 表示不再需要这一页（已停止） """
+        return True
+
+    def page_done(self, engine: "Engine", page: int, info: Optional[dict]) -> None:
+        """ fresh 列表页的所有详情都已入库 / 记入失败；info=None 表示列表本身失败 """
+
+
+# ===================== Engine =====================
+class Engine:
+    def __init__(self, store, pool, stages: dict, source: Source,
+                 concurrency: int = CONCURRENCY,
+                 retry_ratio: float = RETRY_RATIO,
+                 max_attempts: int = RETRY_MAX_ATTEMPTS,
+                 retry_delay: float = RETRY_DELAY_SECONDS):
+        self.store = store
+        self.state = store.state
+        self.pool = pool
+        self.stages = stages
+        self.source = source
+        self.concurrency = max(1, int(concurrency))
+        self.max_attempts = max(1, int(max_attempts))
+        self.retry_delay = max(0.0, float(retry_delay))
+        # 每 retry_every 次调度里有一次优先给重试；ratio<=0 只在没有 fresh 工作时才重试
+        self.retry_every = max(1, round(1 / retry_ratio)) if retry_ratio > 0 else 0
+
+        self._seq = itertools.count()
+        self._fresh = []   # (priority, seq, Work)
+        self._retry = []   # (ready_at, seq, Work)
+        self._picks = 0
+        self._inflight = {}  # future -> Work
+
+        self.active_ids = set()  # 已排队 / 在途的详情 id，防止相邻两页里重复的 id 被抓两次
+        self.retry_ids = set()   # 在 retry 队列里等着的详情 id
+        self.pages = {}          # fresh 页 -> {"page_set", "new", "remaining"}
+        self.metrics = {"done": Counter(), "failed": Counter(), "retried": Counter()}
+
+    # ---------- 入队 ----------
+    def push(self, item) -> None:
+        if isinstance(item, Detail):
+            self.active_ids.add(item.msg_id)
+        heapq.heappush(self._fresh, (PRIORITY.get(type(item), 9), next(self._seq), Work(item)))
+
+    def push_retry(self, item, attempt: int = 1, delay: float = 0.0) -> None:
+        if isinstance(item, Detail):
+            self.active_ids.add(item.msg_id)
+            self.retry_ids.add(item.msg_id)
+        heapq.heappush(self._retry, (time.monotonic() + delay, next(self._seq), Work(item, attempt, retry=True)))
+
+    # ---------- stage 回调 ----------
+    def fail(self, work: Work, kind: str, failed_item, error=None) -> None:
+        """ 记入 failed_*（立即进缓冲，随下次 flush 落盘）；本次还有次数就延迟重试 """
+        self.store.add_failed(kind, failed_item)
+        self.store.save_state()
+        self.metrics["failed"][type(work.item).__name__] += 1
+        retry = work.attempt < self.max_attempts
+        if retry:
+            item = work.item
+            if isinstance(item, Detail):
+                # 这次失败已经在 detail_done 里给页面计过数，重试不再属于页面
+                item = item._replace(page=None)
+            self.push_retry(item, work.attempt + 1, self.retry_delay)
+        # 重试的项（本次的、上次留下的）本来就在 failed_* 里
+        events.emit("failed", kind=kind, item=failed_item, attempt=work.attempt, added=not work.retry,
+                    retry=retry, error=None if error is None else str(error))
+
+    def resolve(self, work: Work, kind: str, failed_item) -> None:
+        """ 成功：如果这是失败项的重试，从 failed_* 里去掉 """
+        self.metrics["done"][type(work.item).__name__] += 1
+        if work.retry:
+            self.store.discard_failed(kind, failed_item)
+            events.emit("resolved", kind=kind, item=failed_item)
+
+    def open_page(self, page: int, data: dict, msg_ids: list) -> None:
+        """ fresh 列表页取回：排入它的详情，等全部完成后通知 source.page_done """
+        if not self.source.page_opened(self, page, data):
+            return
+        self.pages[page] = {"page_set": data.get("pageSet") or [], "new": len(msg_ids), "remaining": len(msg_ids)}
+        for msg_id in msg_ids:
+            self.push(Detail(msg_id, page))
+        if not msg_ids:
+            self._close_page(page)
+
+    def page_failed(self, page: int) -> None:
+        self.source.page_done(self, page, None)
+        events.emit("page", page=page, ok=False, new=0, next_page=self.state.get("next_page"))
+
+    def detail_done(self, item: Detail) -> None:
+        # 失败后已排进 retry 队列的还算在途，重试完成时再移出
+        if item.msg_id not in self.retry_ids:
+            self.active_ids.discard(item.msg_id)
+        if item.page is None or item.page not in self.pages:
+            return
+        info = self.pages[item.page]
+        info["remaining"] -= 1
+        if info["remaining"] <= 0:
+            self._close_page(item.page)
+
+    def _close_page(self, page: int) -> None:
+        info = self.pages.pop(page)
+        self.source.page_done(self, page, info)
+        events.emit("page", page=page, ok=True, new=info["new"], next_page=self.state.get("next_page"))
+
+    # ---------- 调度 ----------
+    def _pull_source(self) -> None:
+        while True:
+            item = self.source.next_item(self)
+            if item is None:
+                return
+            self.push(item)
+
+    def _next_work(self):
+        now = time.monotonic()
+        retry_ready = bool(self._retry) and self._retry[0][0] <= now
+        self._picks += 1
+
+        take_retry = retry_ready and (
+            not self._fresh or (self.retry_every and self._picks % self.retry_every == 0)
+        )
+        if take_retry:
+            work = heapq.heappop(self._retry)[2]
+            if isinstance(work.item, Detail):
+                self.retry_ids.discard(work.item.msg_id)
+            self.metrics["retried"][type(work.item).__name__] += 1
+            return work
+        if self._fresh:
+            return heapq.heappop(self._fresh)[2]
+        return None
+
+    def _submit(self, work: Work) -> None:
+        stage = self.stages[type(work.item)]
+        self._inflight[self.pool.submit(stage.run, work.item)] = work
+
+    def _commit(self, future, work: Work) -> None:
+        try:
+            outcome = future.result()
+        except Exception as e:
+            outcome = e
+        self.stages[type(work.item)].commit(self, work, outcome)
+
+    def run(self) -> None:
+        while True:
+            self._pull_source()
+
+            while len(self._inflight) < self.concurrency:
+                work = self._next_work()
+                if work is None:
+                    break
+                maybe_cooldown(self.state)
+                self._submit(work)
+                self._pull_source()
+
+            if not self._inflight:
+                if self._fresh:
+                    continue
+                if self._retry:
+                    # 只剩还没到时间的重试
+                    time.sleep(max(0.0, min(1.0, self._retry[0][0] - time.monotonic())))
+                    continue
+                if self.source.finished:
+                    return
+                # source 还没结束但暂时没有新工作（等 page_done），不会发生在空闲时；防御性退出
+                return
+
+            done, _ = wait(list(self._inflight), return_when=FIRST_COMPLETED)
+            for future in done:
+                self._commit(future, self._inflight.pop(future))
+
+    def stats(self) -> dict:
+        return {
+            "fresh": len(self._fresh),
+            "retry": len(self._retry),
+            "inflight": len(self._inflight),
+            "done": dict(self.metrics["done"]),
+            "failed": dict(self.metrics["failed"]),
+            "retried": dict(self.metrics["retried"]),
+        }
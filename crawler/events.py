@@ -0,0 +1,66 @@
+# crawler/events.py
+"""
+爬虫进度事件：一行一个 JSON 追加到 data/crawl_events.jsonl，Viewer 的 /api/events 读新增的行转成 SSE，
+页面不用再轮询 crawl_state.json / qa_db。
+
+    {"ts": 1760000000.1, "type": "record", "id": "...", "标题": "...", "留言时间": "..."}
+
+type：
+- start / end：一次运行开始、结束（含中断）；页面收到后重新取一次概览
+- page：列表页的详情全部处理完（ok=False 表示列表本身失败），带当前断点 next_page
+- record：新问答入库
+- blocked / unblocked：403 / html-block（consec_403、当前 rpm），之后第一次成功时 unblocked
+- cooldown：达到阈值进入整体冷却（cooldown_until）
+- failed / resolved：记入 / 移出 failed_pages / failed_ids / failed_attachments；added=False 表示已在失败列表里
+
+写失败（磁盘满等）丢掉这一条、只打印一次，不影响抓取。
+"""
+import json
+import os
+import threading
+import time
+
+from config import EVENTS_FILE, EVENTS_MAX_BYTES
+
+_lock = threading.Lock()
+_file = None
+_broken = False
+
+
+def _open():
+    global _file
+    if _file is None:
+        EVENTS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        _file = EVENTS_FILE.open("a", encoding="utf-8")
+    elif _file.tell() >= EVENTS_MAX_BYTES:
+        # Viewer 按 inode 跟踪：换名后还会把 .1 剩下的行读完
+        _file.close()
+        os.replace(EVENTS_FILE, EVENTS_FILE.with_name(EVENTS_FILE.name + ".1"))
+        _file = EVENTS_FILE.open("a", encoding="utf-8")
+    return _file
+
+
+def emit(event_type: str, /, **fields) -> None:
+    """ 追加一条事件；每条直接 write（不 fsync），读者最多看到写到一半的最后一行 """
+    global _file, _broken
+    if EVENTS_FILE is None:
+        return
+    line = json.dumps({"ts": round(time.time(), 3), "type": event_type, **fields}, ensure_ascii=False, default=str) + "\n"
+    with _lock:
+        try:
+            f = _open()
+            f.write(line)
+            f.flush()
+        except OSError as e:
+            if not _broken:
+                _broken = True
+                print(f"[events] 写入 {EVENTS_FILE} 失败，丢弃事件（之后不再提示） err={e}")
+            _file = None
+
+
+def close() -> None:
+    global _file
+    with _lock:
+        if _file is not None:
+            _file.close()
+            _file = None
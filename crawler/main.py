@@ -1,329 +1,297 @@
 # crawler/main.py
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+
 from config import (
-    BASE_URL_DETAIL,
-    DB_FILE, STATE_FILE,
+    DB_FILE, STATE_FILE, SQLITE_FILE, STORAGE_BACKEND,
     DOWNLOAD_ATTACHMENTS,
     START_PAGE, END_PAGE,
-    TARGET_RPM,
-)
-from storage import (
-    load_db, save_db_atomic, upsert_record,
-    load_state, save_state_atomic,
-    dedup_list, add_unique, normalize_failed_attachment_item,
-    update_attachment_local_path,
+    TARGET_RPM, CONCURRENCY,
+    RAW_ARCHIVE,
+    INCREMENTAL_STOP_PAGES,
+    LIST_LOOKAHEAD,
 )
+from storage import open_store
 from net import (
-    build_session, RateLimiter,
-    fetch_page, fetch_detail_html,
-    detect_end_page_from_first,
-    maybe_cooldown,
+    build_session, build_attachment_session, RateLimiter,
+    detect_end_page_from_first, request_stop,
 )
-from parse import parse_detail
-from download import download_one_attachment
-
-
-def main():
+from parse_pool import ParsePool
+from archive import RawArchive
+from engine import Engine, Source, ListPage, Detail, Attachment
+from stages import ListStage, DetailStage, AttachmentStage
+from persist import PersistWriter, install_signal_handlers
+import events
+
+
+def parse_args(argv=None):
+    ap = argparse.ArgumentParser(description="12366 纳税咨询问答爬虫")
+    ap.add_argument("--incremental", action="store_true",
+                    help="增量模式：从第 1 页开始只抓新问答，遇到旧数据即停止（适合 cron 定时跑）")
+    ap.add_argument("--stop-pages", type=int, default=INCREMENTAL_STOP_PAGES,
+                    help="增量模式：连续多少页没有新问答就停止")
+    return ap.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    install_signal_handlers()
+
+    store = open_store()
+    writer = PersistWriter(store).start()
+    try:
+        crawl(store, writer, incremental=args.incremental, stop_pages=args.stop_pages)
+    finally:
+        # Ctrl-C / SIGTERM / 异常都会走到这里：先把缓冲写完
+        writer.close()
+        store.close()
+        # 放在落盘之后：页面收到 end 重新取概览时已是最终数据
+        events.emit("end")
+        events.close()
+
+
+def crawl(store, writer: PersistWriter, incremental: bool = False, stop_pages: int = INCREMENTAL_STOP_PAGES):
     session = build_session()
+    att_session = build_attachment_session()
     rate = RateLimiter(TARGET_RPM)
+    state = store.state
+
+    count_before = store.meta["count"]
+    print(f"DB已有记录：{count_before}")
+
+    pool = ThreadPoolExecutor(max_workers=max(1, CONCURRENCY), thread_name_prefix="crawl")
+    parser = ParsePool()
+    archive = RawArchive() if RAW_ARCHIVE else None
+    try:
+        if incremental:
+            # 增量：不动 next_page / end_page 断点，不补上次的失败项（留给完整运行）
+            source = IncrementalSource(store, writer, stop_pages)
+        else:
+            source = ForwardSource(store, writer, detect_end_page(store, session, rate))
+
+        stages = {
+            ListPage: ListStage(session, rate, state, archive, parser),
+            Detail: DetailStage(session, att_session, parser, archive, rate, state),
+            Attachment: AttachmentStage(session, att_session, rate, state, store),
+        }
+        engine = Engine(store, pool, stages, source)
+        if not incremental:
+            seed_retries(engine, store)
+
+        events.emit("start", mode=source.name, next_page=state.get("next_page"), end_page=state.get("end_page"))
+
+        engine.run()
+    finally:
+        # 中断时丢弃排队中的任务；已在途的请求结果不会入库，下次从 next_page 重抓。
+        # 正在限速 / 退避 / 冷却里等待的线程立即结束（正在收发的请求最多等到 TIMEOUT）
+        request_stop()
+        pool.shutdown(wait=True, cancel_futures=True)
+        parser.close()
+        att_session.close()
+        if archive is not None:
+            archive.close()
+
+    print("\n=== 结束 ===" if not incremental else "\n=== 增量结束 ===")
+    print(f"新增问答：{store.meta['count'] - count_before}")
+    print(f"DB记录数：{store.meta['count']}")
+    print(f"引擎统计：{engine.stats()}")
+    print(f"限速统计：{rate.stats()}")
+    print(f"仍失败 pages：{store.failed_count('failed_pages')}")
+    print(f"仍失败 ids：{store.failed_count('failed_ids')}")
+    print(f"仍失败 attachments：{store.failed_count('failed_attachments')}")
+    if STORAGE_BACKEND == "sqlite":
+        print(f"SQLITE文件：{SQLITE_FILE}")
+    else:
+        print(f"DB文件：{DB_FILE}")
+        print(f"STATE文件：{STATE_FILE}")
 
-    db = load_db(DB_FILE)
-    state = load_state(STATE_FILE)
 
-    # ---------- 自动写入 end_page（来自 maxPage） ----------
+def detect_end_page(store, session, rate) -> int:
+    """ 自动写入 end_page（来自 maxPage） """
+    state = store.state
     if not state.get("end_page"):
         try:
             end_page = detect_end_page_from_first(session, rate, state)
             state["end_page"] = int(end_page)
-            save_state_atomic(STATE_FILE, state)
+            store.save_state()
             print(f"[state] 已从 maxPage 写入 end_page={state['end_page']}")
         except Exception as e:
             state["end_page"] = END_PAGE
-            save_state_atomic(STATE_FILE, state)
+            store.save_state()
             print(f"[state] 读取 maxPage 失败，回退到手动 END_PAGE={END_PAGE}, err={e}")
     else:
         print(f"[state] 使用已保存的 end_page={state['end_page']}")
 
-    end_page = int(state.get("end_page", END_PAGE))
-
-    # 去重防膨胀
-    state["failed_pages"] = dedup_list(state.get("failed_pages", []))
-    state["failed_ids"] = dedup_list(state.get("failed_ids", []))
-
-    # failed_attachments 兼容旧格式并去重
-    fa_norm = []
-    for x in state.get("failed_attachments", []):
-        it = normalize_failed_attachment_item(x)
-        if it:
-            fa_norm.append(it)
-    state["failed_attachments"] = dedup_list(fa_norm)
-
-    save_state_atomic(STATE_FILE, state)
-
-    print(f"DB已有记录：{len(db['records'])}")
-    print(f"从 next_page={state.get('next_page', START_PAGE)} forward 到 {end_page}")
-
-    # ---------- Forward ----------
-    page = max(int(state.get("next_page", START_PAGE)), START_PAGE)
-    do_forward = page <= end_page
-
-    if not do_forward:
-        print("[resume] forward 已完成，直接 backfill 剩余失败项")
-
-    if do_forward:
-        while page <= end_page:
-            maybe_cooldown(state)
-
-            try:
-                data = fetch_page(session, rate, state, page)
-            except Exception as e:
-                print(f"[列表失败] page={page} err={e}")
-                add_unique(state["failed_pages"], page)
-                state["next_page"] = page + 1
-                save_state_atomic(STATE_FILE, state)
-                page += 1
-                continue
-
-            page_set = data.get("pageSet") or []
-            print(f"[forward] page={page} items={len(page_set)} consec_403={state.get('consec_403', 0)}")
-
-            if not page_set:
-                state["next_page"] = page + 1
-                save_state_atomic(STATE_FILE, state)
-                page += 1
-                continue
-
-            for raw in page_set:
-                msg_id = raw.get("id")
-                if not msg_id:
-                    continue
-                if msg_id in db["records"]:
-                    continue
-
-                try:
-                    html_text = fetch_detail_html(session, rate, state, msg_id)
-                    detail = parse_detail(html_text)
-                except Exception as e:
-                    print(f"[详情失败] id={msg_id} err={e}")
-                    add_unique(state["failed_ids"], msg_id)
-                    continue
-
-                skip_whole_msg = False
-
-                if DOWNLOAD_ATTACHMENTS:
-                    for att in (detail.get("附件") or []):
-                        try:
-                            local_path = download_one_attachment(session, rate, state, msg_id, att)
-                            att["local_path"] = local_path
-                        except Exception as e:
-                            em = (str(e) or "").lower()
-
-                            # ✅ 命中 null：记录“问答 id”，然后跳过整个问答
-                            if ("oid can not be null" in em) or ("permanent invalid" in em) or ("permanentalid" in em):
-                                add_unique(state["null_msg_ids"], msg_id)
-                                save_state_atomic(STATE_FILE, state)
-                                print(f"[问答跳过-null附件] id={msg_id} 因附件oid-null，已记录到 state.null_msg_ids")
-                                skip_whole_msg = True
-                                break
-
-                            item = {
-                                "id": msg_id,
-                                "url": att.get("url", ""),
-                                "标题": att.get("标题", ""),
-                                "fileId": att.get("fileId", ""),
-                            }
-                            add_unique(state["failed_attachments"], item)
-                            print(f"[附件失败] {msg_id} {att.get('url','')} err={e}")
-
-                if skip_whole_msg:
-                    continue
-
-                record = {"id": msg_id, **detail, "url": f"{BASE_URL_DETAIL}?id={msg_id}"}
-                upsert_record(db, record)
-                save_db_atomic(DB_FILE, db)
-
-            state["next_page"] = page + 1
-            save_state_atomic(STATE_FILE, state)
-            page += 1
-
-    print("\n=== forward 完成，开始 backfill（最后一次性补） ===")
-
-    # ---------- Backfill pages ----------
-    failed_pages = sorted(dedup_list(state.get("failed_pages", [])))
-    state["failed_pages"] = []
-    save_state_atomic(STATE_FILE, state)
-
-    for p in failed_pages:
-        maybe_cooldown(state)
-        try:
-            data = fetch_page(session, rate, state, p)
-        except Exception as e:
-            print(f"[backfill 列表仍失败] page={p} err={e}")
-            add_unique(state["failed_pages"], p)
-            save_state_atomic(STATE_FILE, state)
-            continue
-
-        page_set = data.get("pageSet") or []
-        print(f"[backfill pages] page={p} items={len(page_set)}")
-
-        for raw in page_set:
-            msg_id = raw.get("id")
-            if not msg_id or msg_id in db["records"]:
-                continue
-
-            try:
-                html_text = fetch_detail_html(session, rate, state, msg_id)
-                detail = parse_detail(html_text)
-            except Exception as e:
-                print(f"[backfill 详情失败] id={msg_id} err={e}")
-                add_unique(state["failed_ids"], msg_id)
-                continue
-
-            skip_whole_msg = False
-
-            if DOWNLOAD_ATTACHMENTS:
-                for att in (detail.get("附件") or []):
-                    try:
-                        local_path = download_one_attachment(session, rate, state, msg_id, att)
-                        att["local_path"] = local_path
-                    except Exception as e:
-                        em = (str(e) or "").lower()
-
-                        if ("oid can not be null" in em) or ("permanent invalid" in em) or ("permanentalid" in em):
-                            add_unique(state["null_msg_ids"], msg_id)
-                            save_state_atomic(STATE_FILE, state)
-                            print(f"[问答跳过-null附件] id={msg_id} 因附件oid-null，已记录到 state.null_msg_ids")
-                            skip_whole_msg = True
-                            break
-
-                        item = {
-                            "id": msg_id,
-                            "url": att.get("url", ""),
-                            "标题": att.get("标题", ""),
-                            "fileId": att.get("fileId", ""),
-                        }
-                        add_unique(state["failed_attachments"], item)
-                        print(f"[backfill 附件失败] {msg_id} {att.get('url','')} err={e}")
-
-            if skip_whole_msg:
-                continue
-
-            record = {"id": msg_id, **detail, "url": f"{BASE_URL_DETAIL}?id={msg_id}"}
-            upsert_record(db, record)
-            save_db_atomic(DB_FILE, db)
-
-        save_state_atomic(STATE_FILE, state)
-
-    # ---------- Backfill ids ----------
-    failed_ids = dedup_list(state.get("failed_ids", []))
-    state["failed_ids"] = []
-    save_state_atomic(STATE_FILE, state)
-
-    for msg_id in failed_ids:
-        if msg_id in db["records"]:
-            continue
-        maybe_cooldown(state)
+    store.save_state()
+    return int(state.get("end_page", END_PAGE))
 
-        try:
-            html_text = fetch_detail_html(session, rate, state, msg_id)
-            detail = parse_detail(html_text)
-        except Exception as e:
-            print(f"[backfill 详情仍失败] id={msg_id} err={e}")
-            add_unique(state["failed_ids"], msg_id)
-            save_state_atomic(STATE_FILE, state)
-            continue
-
-        skip_whole_msg = False
-
-        if DOWNLOAD_ATTACHMENTS:
-            for att in (detail.get("附件") or []):
-                try:
-                    local_path = download_one_attachment(session, rate, state, msg_id, att)
-                    att["local_path"] = local_path
-                except Exception as e:
-                    em = (str(e) or "").lower()
-
-                    if ("oid can not be null" in em) or ("permanent invalid" in em) or ("permanentalid" in em):
-                        add_unique(state["null_msg_ids"], msg_id)
-                        save_state_atomic(STATE_FILE, state)
-                        print(f"[问答跳过-null附件] id={msg_id} 因附件oid-null，已记录到 state.null_msg_ids")
-                        skip_whole_msg = True
-                        break
-
-                    item = {
-                        "id": msg_id,
-                        "url": att.get("url", ""),
-                        "标题": att.get("标题", ""),
-                        "fileId": att.get("fileId", ""),
-                    }
-                    add_unique(state["failed_attachments"], item)
-                    print(f"[backfill 附件失败] {msg_id} {att.get('url','')} err={e}")
-
-        if skip_whole_msg:
-            continue
-
-        record = {"id": msg_id, **detail, "url": f"{BASE_URL_DETAIL}?id={msg_id}"}
-        upsert_record(db, record)
-        save_db_atomic(DB_FILE, db)
-        save_state_atomic(STATE_FILE, state)
-
-    # ---------- Backfill attachments（末尾统一补） ----------
+
+def seed_retries(engine: Engine, store) -> None:
+    """ 上次运行留下的失败项排进 retry 队列，与 forward 穿插执行（原来是 forward 完成后统一 backfill） """
+    pages = sorted(int(p) for p in store.list_failed("failed_pages"))
+    for p in pages:
+        engine.push_retry(ListPage(p))
+
+    ids = []
+    for msg_id in store.list_failed("failed_ids"):
+        if store.has_record(msg_id):
+            store.discard_failed("failed_ids", msg_id)
+        else:
+            ids.append(msg_id)
+            engine.push_retry(Detail(msg_id))
+
+    atts = []
     if DOWNLOAD_ATTACHMENTS:
-        print("\n=== backfill attachments（末尾统一补） ===")
-
-        fa_norm = []
-        for x in state.get("failed_attachments", []):
-            it = normalize_failed_attachment_item(x)
-            if it and it.get("id") and it.get("url"):
-                fa_norm.append(it)
-        fa_norm = dedup_list(fa_norm)
-
-        state["failed_attachments"] = []
-        save_state_atomic(STATE_FILE, state)
-
-        still_failed = []
-
-        for item in fa_norm:
-            msg_id = item["id"]
-            url = item["url"]
-            title = item.get("标题", "")
-            fid = item.get("fileId", "")
-
-            if msg_id not in db["records"]:
-                still_failed.append(item)
-                continue
-
-            att = {"url": url, "标题": title, "fileId": fid}
-
-            try:
-                local_path = download_one_attachment(session, rate, state, msg_id, att)
-                ok = update_attachment_local_path(db, msg_id, url, local_path)
-                if not ok:
-                    item["local_path"] = local_path
-                save_db_atomic(DB_FILE, db)
-            except Exception as e:
-                print(f"[backfill 附件仍失败] {msg_id} {url} err={e}")
-                still_failed.append(item)
-
-            if len(still_failed) % 50 == 0:
-                state["failed_attachments"] = still_failed[:]
-                save_state_atomic(STATE_FILE, state)
-
-        state["failed_attachments"] = still_failed
-        save_state_atomic(STATE_FILE, state)
-
-    # 收尾去重
-    state["failed_pages"] = dedup_list(state.get("failed_pages", []))
-    state["failed_ids"] = dedup_list(state.get("failed_ids", []))
-    state["failed_attachments"] = dedup_list(state.get("failed_attachments", []))
-    save_state_atomic(STATE_FILE, state)
-
-    print("\n=== 结束 ===")
-    print(f"DB记录数：{db['meta']['count']}")
-    print(f"仍失败 pages：{len(state['failed_pages'])}")
-    print(f"仍失败 ids：{len(state['failed_ids'])}")
-    print(f"仍失败 attachments：{len(state['failed_attachments'])}")
-    print(f"DB文件：{DB_FILE}")
-    print(f"STATE文件：{STATE_FILE}")
+        atts = [it for it in store.list_failed("failed_attachments") if it.get("id") and it.get("url")]
+        for it in atts:
+            engine.push_retry(Attachment(it["id"], it["url"], it.get("标题", ""), it.get("fileId", "")))
+
+    store.save_state()
+    print(f"[backfill] 待补 pages={len(pages)} ids={len(ids)} attachments={len(atts)}（与 forward 穿插执行）")
+
+
+# ===================== Forward =====================
+class ForwardSource(Source):
+    """
+    从断点 next_page 往后翻到 end_page，最多 lookahead 页同时在处理（预取下一页列表）。
+    某页的详情全部入库（或记入失败）后才算完成；next_page 只推进到连续完成的最后一页之后。
+    """
+    name = "forward"
+
+    def __init__(self, store, writer: PersistWriter, end_page: int, lookahead: int = LIST_LOOKAHEAD):
+        self.store = store
+        self.writer = writer
+        self.state = store.state
+        self.end_page = end_page
+        self.lookahead = max(1, int(lookahead))
+
+        self.cursor = max(int(self.state.get("next_page", START_PAGE)), START_PAGE)
+        self.next_page = self.cursor
+        self.open = 0
+        self.done_pages = set()
+
+        if self.cursor > end_page:
+            print("[resume] forward 已完成，只补剩余失败项")
+        else:
+            print(f"从 next_page={self.cursor} forward 到 {end_page}")
+
+    def next_item(self, engine: Engine):
+        if self.open >= self.lookahead or self.next_page > self.end_page:
+            return None
+        self.open += 1
+        self.next_page += 1
+        return ListPage(self.next_page - 1)
+
+    @property
+    def finished(self) -> bool:
+        return self.next_page > self.end_page and self.open == 0
+
+    def page_done(self, engine: Engine, page: int, info) -> None:
+        self.open -= 1
+        self.done_pages.add(page)
+        while self.cursor in self.done_pages:
+            self.done_pages.remove(self.cursor)
+            self.cursor += 1
+
+        self.state["next_page"] = self.cursor
+        self.store.save_state()
+        self.writer.page_done()
+
+
+# ===================== Incremental =====================
+class IncrementalSource(Source):
+    """
+    从 START_PAGE 往后翻（列表按时间倒序），只抓库里没有的 id。按页序判断停止条件（先到者）：
+    - 连续 stop_pages 页没有新 id
+    - 整页问答的 留言时间 都早于本次开始时库里最新的 留言时间（后面只会更旧）
+    - 到达 maxPage
+    """
+    name = "incremental"
+
+    def __init__(self, store, writer: PersistWriter, stop_pages: int, lookahead: int = LIST_LOOKAHEAD):
+        self.store = store
+        self.writer = writer
+        self.stop_pages = max(1, int(stop_pages))
+        self.lookahead = max(1, int(lookahead))
+        self.watermark = store.meta.get("newest_leave_time") or ""
+
+        self.next_page = START_PAGE
+        self.last_page = None   # 第一页取回后按 maxPage 确定
+        self.open = 0
+        self.stopped = False
+        self.results = {}       # 已完成、还没按页序判断的页
+        self.cursor = START_PAGE
+        self.empty_pages = 0
+
+        print(f"[incremental] 从 page={START_PAGE} 开始；连续 {self.stop_pages} 页无新问答"
+              f"或整页早于 留言时间={self.watermark or '-'} 即停止")
+
+    def next_item(self, engine: Engine):
+        if self.stopped:
+            return None
+        # maxPage 未知前只发第一页
+        if self.open >= (self.lookahead if self.last_page is not None else 1):
+            return None
+        if self.last_page is not None and self.next_page > self.last_page:
+            return None
+        self.open += 1
+        self.next_page += 1
+        return ListPage(self.next_page - 1)
+
+    @property
+    def finished(self) -> bool:
+        exhausted = self.stopped or (self.last_page is not None and self.next_page > self.last_page)
+        return exhausted and self.open == 0
+
+    def _set_last_page(self, data) -> None:
+        if self.last_page is None:
+            max_page = (data or {}).get("maxPage")
+            if isinstance(max_page, int) and max_page > 0:
+                self.last_page = max_page
+            else:
+                self.last_page = int(self.store.state.get("end_page") or END_PAGE)
+
+    def page_opened(self, engine: Engine, page: int, data: dict) -> bool:
+        self._set_last_page(data)
+        if self.stopped:
+            # 停止前已预取的页：不再抓它的详情
+            self.open -= 1
+            return False
+        return True
+
+    def page_done(self, engine: Engine, page: int, info) -> None:
+        self.open -= 1
+        self._set_last_page(None)
+        self.store.save_state()
+        self.writer.page_done()
+        if self.stopped:
+            return
+
+        self.results[page] = info
+        while self.cursor in self.results and not self.stopped:
+            self._judge(self.cursor, self.results.pop(self.cursor))
+            self.cursor += 1
+
+    def _judge(self, page: int, info) -> None:
+        if info is None:
+            # 列表失败不算“空页”
+            return
+
+        # 本页已入库问答里最新的 留言时间
+        page_newest = max((self.store.leave_time(raw["id"]) for raw in info["page_set"] if raw.get("id")), default="")
+
+        self.empty_pages = 0 if info["new"] else self.empty_pages + 1
+        print(f"[incremental] page={page} 完成 new={info['new']} page_newest={page_newest or '-'} "
+              f"empty_pages={self.empty_pages}")
+
+        if self.empty_pages >= self.stop_pages:
+            print(f"[incremental] 连续 {self.empty_pages} 页没有新问答，停止")
+            self.stopped = True
+        elif self.watermark and page_newest and page_newest < self.watermark:
+            print(f"[incremental] page={page} 整页早于 {self.watermark}，停止")
+            self.stopped = True
+        elif self.last_page is not None and page >= self.last_page:
+            print(f"[incremental] 已到最后一页 page={self.last_page}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,30 @@
+# crawler/manifest.py
+"""
+按 attachments/ 下实际的文件重建附件清单（data/attachments_manifest.jsonl）：不发任何请求。
+
+    python crawler/manifest.py
+
+- 清单之前下载的旧文件补进清单（Viewer 只按清单展示本地附件）
+- 手动删掉的文件从清单去掉，同一文件的多行合成一行
+- 可以和 main.py 同时跑：期间下载完成的附件照常追加，替换时接在最后
+  （追加和替换对 data/attachments_manifest.jsonl.lock 加 flock 互斥，替换那一刻的追加会等它完成）
+"""
+import argparse
+import time
+
+from config import ATTACH_DIR, ATTACH_MANIFEST_FILE
+from download import rebuild_manifest
+
+
+def main():
+    ap = argparse.ArgumentParser(description="按 attachments/ 重建 data/attachments_manifest.jsonl")
+    ap.parse_args()
+
+    t0 = time.perf_counter()
+    stats = rebuild_manifest(ATTACH_DIR, ATTACH_MANIFEST_FILE)
+    print(f"[manifest] 完成 保留={stats['kept']} 补入={stats['added']} 大小不符={stats['mismatch']} "
+          f"去掉={stats['dropped']} 用时={time.perf_counter() - t0:.1f}s 文件：{ATTACH_MANIFEST_FILE}")
+
+
+if __name__ == "__main__":
+    main()
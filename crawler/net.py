@@ -1,35 +1,65 @@
 # crawler/net.py
 import time
 import random
+import asyncio
+import threading
+from http.cookiejar import DefaultCookiePolicy
+
 import requests
+from requests.adapters import HTTPAdapter
 
 from config import (
     BASE_URL_LIST, BASE_URL_DETAIL,
-    TARGET_RPM,
+    TARGET_RPM, RATE_BURST, ENDPOINT_RPM,
+    ADAPTIVE_RPM, MIN_RPM, RPM_INCREASE_STEP, RPM_INCREASE_EVERY, RPM_DECREASE_FACTOR,
     CONSEC_403_THRESHOLD, COOLDOWN_SECONDS,
     MAX_RETRIES,
-    TIMEOUT
+    TIMEOUT,
+    CONCURRENCY,
 )
+import events
 
 
 # ===================== Session & headers =====================
+DEFAULT_HEADERS = {
+    "User-Agent": (
+        "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
+        "AppleWebKit/537.36 (KHTML, like Gecko) "
+        "Chrome/142.0.0.0 Safari/537.36"
+    ),
+    "Accept": "application/json, text/javascript, */*; q=0.01",
+    "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+    "Accept-Encoding": "gzip, deflate",  # 不带 br 更稳
+    "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+    "X-Requested-With": "XMLHttpRequest",
+    "Origin": "https://12366.chinatax.gov.cn",
+    "Referer": "https://12366.chinatax.gov.cn/nszx/onlinemessage/main",
+    "Connection": "keep-alive",
+}
+
+
 def build_session() -> requests.Session:
     s = requests.Session()
-    s.headers.update({
-        "User-Agent": (
-            "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
-            "AppleWebKit/537.36 (KHTML, like Gecko) "
-            "Chrome/142.0.0.0 Safari/537.36"
-        ),
-        "Accept": "application/json, text/javascript, */*; q=0.01",
-        "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-        "Accept-Encoding": "gzip, deflate",  # 不带 br 更稳
-        "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-        "X-Requested-With": "XMLHttpRequest",
-        "Origin": "https://12366.chinatax.gov.cn",
-        "Referer": "https://12366.chinatax.gov.cn/nszx/onlinemessage/main",
-        "Connection": "keep-alive",
-    })
+    s.headers.update(DEFAULT_HEADERS)
+    # 并发抓取时每个在途请求一条连接
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, CONCURRENCY))
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+def build_attachment_session() -> requests.Session:
+    """
+    附件专用连接池：复用 TCP/TLS 连接（keep-alive），但保持与 requests.request 相同的隔离：
+    - 不设任何默认头，每个请求只带 build_attachment_headers() 给的头（无 X-Requested-With / Content-Type）
+    - 不存 cookie，响应里的 Set-Cookie 不会带到下一个附件请求
+    """
+    s = requests.Session()
+    s.headers.clear()
+    s.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(10, CONCURRENCY))
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
     return s
 
 
@@ -46,34 +76,201 @@ def build_attachment_headers(page_session: requests.Session, msg_id: str) -> dic
     }
 
 
-# ===================== 限速器：全局 30 req/min =====================
+# ===================== 限速器：令牌桶 + 分类子预算 + AIMD =====================
+class _Bucket:
+    """ 允许欠账的令牌桶：take() 返回拿到这个令牌需要等待的秒数（排在前面的预约先被满足）。 """
+
+    def __init__(self, rpm: float, burst: int):
+        self.rpm = float(rpm)
+        self.capacity = float(max(1, burst))
+        self.tokens = self.capacity
+        self.ts = time.monotonic()
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(self.capacity, self.tokens + (now - self.ts) * self.rpm / 60.0)
+        self.ts = now
+
+    def take(self, now: float) -> float:
+        self._refill(now)
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens * 60.0 / self.rpm
+
+    def set_rpm(self, rpm: float, now: float) -> None:
+        self._refill(now)
+        self.rpm = float(rpm)
+
+
 class RateLimiter:
-    def __init__(self, rpm: int = TARGET_RPM):
-        self.interval = 60.0 / max(1, rpm)
-        self.last_ts = 0.0
+    """
+    全局令牌桶（容量 RATE_BURST）+ 各类请求的子桶（ENDPOINT_RPM：list / detail / attachment），
+    一次请求同时从全局桶和自己类别的桶各取一个令牌。
 
-    def wait(self):
-        now = time.time()
-        if self.last_ts == 0:
-            self.last_ts = now
-            return
-        elapsed = now - self.last_ts
-        if elapsed < self.interval:
-            time.sleep((self.interval - elapsed) + random.uniform(0.05, 0.25))
-        self.last_ts = time.time()
+    AIMD（ADAPTIVE_RPM=True）：
+    - 每连续成功 RPM_INCREASE_EVERY 次，全局 rpm += RPM_INCREASE_STEP（不超过构造时的 rpm，即 TARGET_RPM）
+    - 403 / html-block：全局 rpm *= RPM_DECREASE_FACTOR（不低于 MIN_RPM；10s 内多个在途请求同时被拦只降一次）
+    - 已降到 MIN_RPM 仍连续被拦，才退回到 COOLDOWN_SECONDS 整体冷却
+
+    线程 / asyncio 均安全：锁内只做预约计算，锁外 sleep（wait）或 await（wait_async）。
+    current_rpm / stats() 暴露当前速率。
+    """
+
+    def __init__(self, rpm: int = TARGET_RPM, burst: int = RATE_BURST,
+                 endpoint_rpm: dict = None, adaptive: bool = ADAPTIVE_RPM):
+        now = time.monotonic()
+        self._lock = threading.Lock()
+        self._global = _Bucket(rpm, burst)
+        endpoint_rpm = ENDPOINT_RPM if endpoint_rpm is None else endpoint_rpm
+        self._endpoints = {name: _Bucket(v, 1) for name, v in endpoint_rpm.items() if v}
+
+        self.adaptive = adaptive
+        self.min_rpm = min(MIN_RPM, rpm)
+        # 加速只是从降速里恢复，不超出 TARGET_RPM 的预算
+        self.max_rpm = rpm
+        self._ok_streak = 0
+        self._last_cut = now - 60
+
+        self.ok_count = 0
+        self.blocked_count = 0
+        self.waited_seconds = 0.0
+
+    @property
+    def current_rpm(self) -> float:
+        return self._global.rpm
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "rpm": round(self._global.rpm, 2),
+                "endpoints": {k: b.rpm for k, b in self._endpoints.items()},
+                "ok": self.ok_count,
+                "blocked": self.blocked_count,
+                "waited_seconds": round(self.waited_seconds, 1),
+            }
+
+    def reserve(self, endpoint: str = None) -> float:
+        """ 预约一个发车时刻，返回需要等待的秒数（不 sleep）。 """
+        with self._lock:
+            now = time.monotonic()
+            delay = self._global.take(now)
+            bucket = self._endpoints.get(endpoint)
+            if bucket is not None:
+                delay = max(delay, bucket.take(now))
+            if delay > 0:
+                delay += random.uniform(0.05, 0.25)
+                self.waited_seconds += delay
+        return delay
+
+    def wait(self, endpoint: str = None):
+        # 每个请求都经过这里：停止之后不再发新请求
+        pause(self.reserve(endpoint))
+
+    async def wait_async(self, endpoint: str = None):
+        """ 协程里用：与 wait 共用同一份预算，等待时让出事件循环；停止后同样不再放行 """
+        deadline = time.monotonic() + self.reserve(endpoint)
+        while True:
+            if _stop.is_set():
+                raise CrawlStopped()
+            left = deadline - time.monotonic()
+            if left <= 0:
+                return
+            await asyncio.sleep(min(left, 0.5))
+
+    def on_success(self) -> None:
+        with self._lock:
+            self.ok_count += 1
+            if not self.adaptive:
+                return
+            self._ok_streak += 1
+            if self._ok_streak >= RPM_INCREASE_EVERY and self._global.rpm < self.max_rpm:
+                self._ok_streak = 0
+                self._global.set_rpm(min(self.max_rpm, self._global.rpm + RPM_INCREASE_STEP), time.monotonic())
+
+    def on_blocked(self) -> bool:
+        """ 返回 True 表示已由降速处理（调用方不必再进入整体冷却）。 """
+        with self._lock:
+            self.blocked_count += 1
+            self._ok_streak = 0
+            if not self.adaptive:
+                return False
+
+            # 已经降到底：没有可降的了，交给调用方整体冷却（不受 10s 窗口影响）
+            if self._global.rpm <= self.min_rpm:
+                return False
+            now = time.monotonic()
+            if now - self._last_cut < 10:
+                return True
+
+            old = self._global.rpm
+            self._global.set_rpm(max(self.min_rpm, old * RPM_DECREASE_FACTOR), now)
+            self._last_cut = now
+        print(f"[rate] 被拦截，降速 {old:.1f} → {self._global.rpm:.1f} rpm")
+        return True
 
 
 def backoff_sleep(attempt: int):
     # 阶梯：15 / 30 / 45或50 + jitter
     if attempt == 1:
-        time.sleep(15 + random.uniform(0, 5))
+        pause(15 + random.uniform(0, 5))
     elif attempt == 2:
-        time.sleep(30 + random.uniform(0, 8))
+        pause(30 + random.uniform(0, 8))
     else:
-        time.sleep(random.choice([45, 50]) + random.uniform(0, 10))
+        pause(random.choice([45, 50]) + random.uniform(0, 10))
+
+
+# ===================== 停止：Ctrl-C / SIGTERM 之后不再等 =====================
+# 抓取线程里的等待（限速 / 退避 / 403 冷却，最长 20 分钟）都走 pause()：request_stop() 之后立即结束，
+# main 的 pool.shutdown(wait=True) 不用等它们睡完，缓冲能及时写盘
+_stop = threading.Event()
+
+
+class CrawlStopped(Exception):
+    """ 已请求停止：不再等待、不再发新请求；在途的结果不会入库 """
+
+
+def request_stop() -> None:
+    _stop.set()
+
+
+def pause(seconds: float) -> None:
+    """ 可被 request_stop() 打断的 sleep；seconds<=0 只检查是否已停止 """
+    if _stop.wait(max(0.0, seconds)):
+        raise CrawlStopped()
 
 
 # ===================== 403 冷却 =====================
+# consec_403 / cooldown_until 会被多个抓取线程同时改
+_state_lock = threading.Lock()
+
+
+def note_blocked(state: dict, tag: str, attempt: int, url: str, extra: str = "", rate: RateLimiter = None) -> None:
+    # 自适应限速还有降速空间时只降速，不整体冷却
+    throttled = rate.on_blocked() if rate is not None else False
+
+    with _state_lock:
+        state["consec_403"] = int(state.get("consec_403", 0)) + 1
+        n = state["consec_403"]
+        cooldown = n >= CONSEC_403_THRESHOLD and not throttled
+        if cooldown:
+            state["cooldown_until"] = time.time() + COOLDOWN_SECONDS
+    print(f"[{tag}] attempt={attempt} {extra}consec_403={n} url={url}")
+    events.emit("blocked", tag=tag, consec_403=n, rpm=None if rate is None else round(rate.current_rpm, 1), url=url)
+    if cooldown:
+        print(f"[{tag}] 达到阈值，进入 cooldown {COOLDOWN_SECONDS//60} 分钟")
+        events.emit("cooldown", cooldown_until=state["cooldown_until"], seconds=COOLDOWN_SECONDS)
+
+
+def note_ok(state: dict, rate: RateLimiter = None) -> None:
+    if rate is not None:
+        rate.on_success()
+    with _state_lock:
+        blocked = int(state.get("consec_403", 0) or 0)
+        state["consec_403"] = 0
+        state["cooldown_until"] = 0.0
+    # 每次成功都会调用：只在从被拦恢复时发一条
+    if blocked:
+        events.emit("unblocked", rpm=None if rate is None else round(rate.current_rpm, 1))
+
+
 def maybe_cooldown(state: dict):
     now = time.time()
     until = float(state.get("cooldown_until", 0.0) or 0.0)
@@ -81,26 +278,22 @@ def maybe_cooldown(state: dict):
         remaining = int(until - now)
         print(f"[cooldown] 403 触发冷却，剩余 {remaining}s（约 {remaining//60} 分钟）")
         while time.time() < until:
-            time.sleep(min(30, until - time.time()))
+            pause(min(30, until - time.time()))
 
 
 # ===================== 统一请求：重试 + 403 cooldown + 504/timeout =====================
 def request_with_retry(session, rate: RateLimiter, state: dict, method: str, url: str, *,
-                       timeout=TIMEOUT, max_retries=MAX_RETRIES, **kwargs):
+                       timeout=TIMEOUT, max_retries=MAX_RETRIES, endpoint: str = None, **kwargs):
 
     last_exc = None
     for attempt in range(1, max_retries + 1):
         maybe_cooldown(state)
-        rate.wait()
+        rate.wait(endpoint)
         try:
             resp = session.request(method, url, timeout=timeout, **kwargs)
 
             if resp.status_code == 403:
-                state["consec_403"] = int(state.get("consec_403", 0)) + 1
-                print(f"[403] attempt={attempt} consec_403={state['consec_403']} url={resp.url}")
-                if state["consec_403"] >= CONSEC_403_THRESHOLD:
-                    state["cooldown_until"] = time.time() + COOLDOWN_SECONDS
-                    print(f"[403] 达到阈值，进入 cooldown {COOLDOWN_SECONDS//60} 分钟")
+                note_blocked(state, "403", attempt, resp.url, rate=rate)
                 backoff_sleep(attempt)
                 continue
 
@@ -111,8 +304,7 @@ def request_with_retry(session, rate: RateLimiter, state: dict, method: str, url
 
             resp.raise_for_status()
 
-            state["consec_403"] = 0
-            state["cooldown_until"] = 0.0
+            note_ok(state, rate)
             return resp
 
         except requests.exceptions.Timeout as e:
@@ -133,70 +325,65 @@ def request_with_retry_plain(rate: RateLimiter, state: dict,
                              max_retries=MAX_RETRIES,
                              block_if_html=False,
                              is_permanent_attachment_error=None,
+                             endpoint: str = None,
+                             session: requests.Session = None,
                              **kwargs) -> requests.Response:
     """
-    用 requests.request（非 session）发请求；
+    附件专用：session 应来自 build_attachment_session()（连接复用、无默认头、不存 cookie）；
+    不传则退回 requests.request（每次新建连接）。
     is_permanent_attachment_error: 可注入一个函数(resp)->bool，命中则不重试直接返回
+    退避放在下一次尝试之前：最后一次失败直接抛给调用方，不再白等一轮
+    （max_retries=1 即单发，重试 / 退避由调用方负责）
     """
     last_exc = None
 
     for attempt in range(1, max_retries + 1):
+        if attempt > 1:
+            backoff_sleep(attempt - 1)
         maybe_cooldown(state)
-        rate.wait()
+        rate.wait(endpoint)
 
         try:
-            resp = requests.request(method, url, timeout=timeout, **kwargs)
+            send = session.request if session is not None else requests.request
+            resp = send(method, url, timeout=timeout, **kwargs)
 
             if callable(is_permanent_attachment_error) and is_permanent_attachment_error(resp):
                 return resp
 
+            # 重试前 close()：stream=True 时不读完 body 连接不会回到池里
             if resp.status_code == 403:
                 if callable(is_permanent_attachment_error) and is_permanent_attachment_error(resp):
                     return resp
 
-                state["consec_403"] = int(state.get("consec_403", 0)) + 1
-                print(f"[403] attempt={attempt} consec_403={state['consec_403']} url={resp.url}")
-
-                if state["consec_403"] >= CONSEC_403_THRESHOLD:
-                    state["cooldown_until"] = time.time() + COOLDOWN_SECONDS
-                    print(f"[403] 达到阈值，进入 cooldown {COOLDOWN_SECONDS//60} 分钟")
-
-                backoff_sleep(attempt)
+                resp.close()
+                note_blocked(state, "403", attempt, resp.url, rate=rate)
                 continue
 
             if resp.status_code in (502, 503, 504):
+                resp.close()
+                last_exc = requests.HTTPError(f"{resp.status_code} Server Error: {resp.url}", response=resp)
                 print(f"[{resp.status_code}] attempt={attempt} url={resp.url}")
-                backoff_sleep(attempt)
                 continue
 
             if block_if_html:
                 ct = (resp.headers.get("Content-Type") or "").lower()
                 if "text/html" in ct:
-                    state["consec_403"] = int(state.get("consec_403", 0)) + 1
-                    print(f"[html-block] attempt={attempt} ct={ct} consec_403={state['consec_403']} url={resp.url}")
-
-                    if state["consec_403"] >= CONSEC_403_THRESHOLD:
-                        state["cooldown_until"] = time.time() + COOLDOWN_SECONDS
-                        print(f"[html-block] 达到阈值，进入 cooldown {COOLDOWN_SECONDS//60} 分钟")
-
-                    backoff_sleep(attempt)
+                    resp.close()
+                    note_blocked(state, "html-block", attempt, resp.url, extra=f"ct={ct} ", rate=rate)
                     continue
 
             resp.raise_for_status()
 
-            state["consec_403"] = 0
-            state["cooldown_until"] = 0.0
+            note_ok(state, rate)
             return resp
 
         except requests.exceptions.Timeout as e:
             last_exc = e
             print(f"[timeout] attempt={attempt} {type(e).__name__}: {e}")
-            backoff_sleep(attempt)
 
         except requests.exceptions.RequestException as e:
             last_exc = e
             print(f"[request error] attempt={attempt} {type(e).__name__}: {e}")
-            backoff_sleep(attempt)
 
     if isinstance(last_exc, BaseException):
         raise last_exc
@@ -221,6 +408,7 @@ def fetch_page(session, rate: RateLimiter, state: dict, page: int) -> dict:
         data=payload,
         timeout=TIMEOUT,
         max_retries=MAX_RETRIES,
+        endpoint="list",
     )
     return resp.json()
 
@@ -232,6 +420,7 @@ def fetch_detail_html(session, rate: RateLimiter, state: dict, msg_id: str) -> s
         params={"id": msg_id},
         timeout=TIMEOUT,
         max_retries=MAX_RETRIES,
+        endpoint="detail",
     )
     return resp.text
 
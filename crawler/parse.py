@@ -1,52 +1,90 @@
 # crawler/parse.py
 import re
 from urllib.parse import urljoin
+from lxml import etree
 from lxml import html as lxml_html
 
 from config import BASE_SITE
 
 
+# ===================== 预编译：XPath / 正则只编译一次 =====================
+XP_TABFORM = etree.XPath("//table[contains(@class, 'tabform')]")
+XP_ROWS = etree.XPath(".//tr")
+XP_STRING = etree.XPath("string(.)")
+XP_TEXTAREA_TEXT = etree.XPath(".//td//textarea//text()")
+XP_INPUT_VALUE = etree.XPath(".//td//input/@value")
+XP_TD_TEXT = etree.XPath(".//td//text()")
+XP_TITLE = etree.XPath("string(//div[contains(@class,'articletitle')]//h1)")
+XP_LEAVE_TIME = etree.XPath("string(//*[@id='cjsj'])")
 
-def extract_by_th_label(tree, label: str) -> str:
-    tables = tree.xpath("//table[contains(@class, 'tabform')]")
-    if not tables:
-        return ""
-    table = tables[0]
+RE_JGMC = re.compile(r'var\s+jgmc\s*=\s*"([^"]+)"\s*;')
+RE_FJ = re.compile(r"var\s+fj\s*=\s*\[(.*?)\];", re.S)
+RE_FJ_ITEM = re.compile(r"\{[^}]*?id:'([^']+)'[^}]*?wjmc:'([^']+)'[^}]*?\}")
 
-    tr_list = table.xpath(".//tr[th[contains(normalize-space(.), $label)]]", label=label)
-    if not tr_list:
-        return ""
+# tabform 里要取的行（th 文本包含该标签即命中，取第一行）
+TH_LABELS = ("问题内容", "答复内容", "答复机构", "答复时间")
 
-    tr = tr_list[0]
 
-    texts = tr.xpath(".//td//textarea//text()")
-    texts = [t.strip() for t in texts if t.strip()]
+def _tr_value(tr) -> str:
+    # 优先 textarea，其次 input[value]，最后 td 里的纯文本
+    texts = [t.strip() for t in XP_TEXTAREA_TEXT(tr) if t.strip()]
     if texts:
         return "\n".join(texts)
 
-    inputs = tr.xpath(".//td//input/@value")
-    inputs = [t.strip() for t in inputs if t.strip()]
+    inputs = [t.strip() for t in XP_INPUT_VALUE(tr) if t.strip()]
     if inputs:
         return inputs[0]
 
-    texts = tr.xpath(".//td//text()")
-    texts = [t.strip() for t in texts if t.strip()]
+    texts = [t.strip() for t in XP_TD_TEXT(tr) if t.strip()]
     if texts:
         return "\n".join(texts)
 
     return ""
 
 
+def extract_th_values(tree, labels=TH_LABELS) -> dict:
+    """
+    只遍历一次 tabform 表格，得到 {label: value}；没找到的 label 为 ""。
+    与逐个 label 查 .//tr[th[contains(normalize-space(.), label)]] 结果相同：
+    label 不含空白，normalize-space 不影响“是否包含”，这里直接对 th 原文判断。
+    """
+    out = {label: "" for label in labels}
+    tables = XP_TABFORM(tree)
+    if not tables:
+        return out
+
+    pending = list(labels)
+    for tr in XP_ROWS(tables[0]):
+        # 每个 th 单独判断，不能把同一行的多个 th 拼起来
+        th_texts = [XP_STRING(th) for th in tr.iterchildren("th")]
+        if not th_texts:
+            continue
+        hit = [label for label in pending if any(label in t for t in th_texts)]
+        if not hit:
+            continue
+        value = _tr_value(tr)
+        for label in hit:
+            out[label] = value
+            pending.remove(label)
+        if not pending:
+            break
+    return out
+
+
+def extract_by_th_label(tree, label: str) -> str:
+    return extract_th_values(tree, (label,))[label]
+
+
 def extract_title(tree) -> str:
-    return tree.xpath("string(//div[contains(@class,'articletitle')]//h1)").strip()
+    return XP_TITLE(tree).strip()
 
 
 def extract_leave_time(tree) -> str:
-    return tree.xpath("string(//*[@id='cjsj'])").strip()
+    return XP_LEAVE_TIME(tree).strip()
 
 
 def extract_nsrssd_from_script(html_text: str) -> str:
-    m = re.search(r'var\s+jgmc\s*=\s*"([^"]+)"\s*;', html_text)
+    m = RE_JGMC.search(html_text)
     if not m:
         return ""
     jgmc = m.group(1).strip()
@@ -57,13 +95,12 @@ def extract_nsrssd_from_script(html_text: str) -> str:
 
 def extract_attachments_from_script(html_text: str):
     attachments = []
-    m = re.search(r"var\s+fj\s*=\s*\[(.*?)\];", html_text, re.S)
+    m = RE_FJ.search(html_text)
     if not m:
         return attachments
 
     inner = m.group(1)
-    item_pattern = re.compile(r"\{[^}]*?id:'([^']+)'[^}]*?wjmc:'([^']+)'[^}]*?\}")
-    for fid, name in item_pattern.findall(inner):
+    for fid, name in RE_FJ_ITEM.findall(inner):
         url = urljoin(BASE_SITE, f"/filecenter/fileupload/download?fileId={fid}&type=1")
         attachments.append({"标题": name, "url": url, "fileId": fid})
     return attachments
@@ -76,10 +113,7 @@ def parse_detail(html_text: str) -> dict:
     leave_time = extract_leave_time(tree)
     nsrssd = extract_nsrssd_from_script(html_text)
 
-    question_text = extract_by_th_label(tree, "问题内容")
-    answer_text = extract_by_th_label(tree, "答复内容")
-    reply_org = extract_by_th_label(tree, "答复机构")
-    reply_time = extract_by_th_label(tree, "答复时间")
+    th_values = extract_th_values(tree)
 
     attachments = extract_attachments_from_script(html_text)
 
@@ -87,9 +121,9 @@ def parse_detail(html_text: str) -> dict:
         "标题": title,
         "留言时间": leave_time,
         "纳税人所属地": nsrssd,
-        "答复时间": reply_time,
-        "问题内容": question_text,
-        "答复内容": answer_text,
-        "答复机构": reply_org,
+        "答复时间": th_values["答复时间"],
+        "问题内容": th_values["问题内容"],
+        "答复内容": th_values["答复内容"],
+        "答复机构": th_values["答复机构"],
         "附件": attachments,
     }
@@ -0,0 +1,62 @@
+# crawler/parse_pool.py
+import time
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config import PARSE_WORKERS
+from parse import parse_detail
+
+
+class ParsePool:
+    """
+    把 parse_detail（lxml + XPath，吃 CPU、持有 GIL）放到子进程里跑，抓取线程只负责收发 HTML。
+    - workers <= 0：不开进程，直接在调用线程里解析（与原来一致）
+    - parse() 是同步调用：提交后在调用它的抓取线程（engine 线程池）里等结果，
+      所以在途解析数不会超过 CONCURRENCY，不另设上限；抓取线程等解析的总时长记在 stats() 里
+    """
+
+    def __init__(self, workers: int = PARSE_WORKERS):
+        self.workers = max(0, int(workers))
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._parsed = 0
+        self._waited_seconds = 0.0
+
+        self._executor = None
+        if self.workers > 0:
+            # spawn：父进程里已经有抓取线程 / 写盘线程，fork 可能把锁的状态一起带过去
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+
+    def parse(self, html_text: str) -> dict:
+        if self._executor is None:
+            return parse_detail(html_text)
+
+        with self._lock:
+            self._pending += 1
+        t0 = time.monotonic()
+        try:
+            return self._executor.submit(parse_detail, html_text).result()
+        finally:
+            with self._lock:
+                self._pending -= 1
+                self._parsed += 1
+                self._waited_seconds += time.monotonic() - t0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "pending": self._pending,
+                "parsed": self._parsed,
+                "waited_seconds": round(self._waited_seconds, 3),
+            }
+
+    def close(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,93 @@
+# crawler/persist.py
+import atexit
+import signal
+import threading
+
+from config import FLUSH_EVERY_RECORDS, FLUSH_INTERVAL_SECONDS, FLUSH_ON_PAGE
+
+
+class PersistWriter:
+    """
+    后台写盘线程：store 的写入只进内存缓冲，由这里批量 flush（组提交）。
+    触发条件（先到者）：
+    - 缓冲条数 >= every_records
+    - 距上次 flush >= interval 秒
+    - page_done()（on_page=True 时）
+    close() 时同步做最后一次 flush；atexit 兜底。
+    """
+
+    def __init__(self, store,
+                 every_records: int = FLUSH_EVERY_RECORDS,
+                 interval: float = FLUSH_INTERVAL_SECONDS,
+                 on_page: bool = FLUSH_ON_PAGE):
+        self.store = store
+        self.every_records = max(1, int(every_records))
+        self.interval = max(0.1, float(interval))
+        self.on_page = on_page
+
+        self.flush_count = 0
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="persist-writer", daemon=True)
+
+    def start(self) -> "PersistWriter":
+        self.store.autoflush = False
+        self.store.on_dirty = self._on_dirty
+        self._thread.start()
+        atexit.register(self.close)
+        return self
+
+    def _on_dirty(self, pending: int) -> None:
+        if pending >= self.every_records:
+            self._wake.set()
+
+    def page_done(self) -> None:
+        if self.on_page:
+            self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            self._flush()
+
+    def _flush(self) -> None:
+        try:
+            self.store.flush()
+            self.flush_count += 1
+        except Exception as e:
+            # 缓冲已放回 store，下一轮重试
+            print(f"[persist] flush 失败，稍后重试 err={type(e).__name__}: {e}")
+
+    def close(self) -> None:
+        if self._closed:
+            return
+        self._closed = True
+
+        self._stop.set()
+        self._wake.set()
+        self._thread.join()
+
+        # 最后一次同步 flush 期间不再响应 Ctrl-C，避免二次中断把缓冲丢掉
+        old = None
+        if threading.current_thread() is threading.main_thread():
+            old = signal.signal(signal.SIGINT, signal.SIG_IGN)
+        try:
+            self.store.flush()
+        finally:
+            if old is not None:
+                signal.signal(signal.SIGINT, old)
+            self.store.autoflush = True
+            self.store.on_dirty = None
+
+
+def install_signal_handlers() -> None:
+    """
+    SIGTERM 转成 SystemExit（SIGINT 默认就是 KeyboardInterrupt），
+    让 main 的 finally / atexit 有机会把缓冲写完。
+    """
+    def _on_term(signum, frame):
+        raise SystemExit(128 + signum)
+
+    signal.signal(signal.SIGTERM, _on_term)
@@ -0,0 +1,101 @@
+# crawler/reparse.py
+"""
+从原始响应归档（data/raw/，RAW_ARCHIVE=True 时抓取的）离线重建 qa_db：不发任何请求。
+parse.py 修了 bug 之后跑一遍即可，所有核都用上。
+
+    python crawler/reparse.py [--workers N] [--only-missing]
+
+- 每个归档过的详情页重新 parse_detail，按 id 覆盖写入当前 STORAGE_BACKEND 的 store
+- 附件的 local_path 从已有记录里按 url 带过来（附件文件本身不动）
+- state.null_msg_ids 里的问答（附件 oid-null，抓取时就跳过了）仍然跳过
+- 不要和 main.py 同时跑：两边都会写 store
+"""
+import os
+import argparse
+import multiprocessing
+from functools import partial
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+
+from config import BASE_URL_DETAIL, RAW_ARCHIVE_DIR
+from archive import load_index, read_entry
+from parse import parse_detail
+from storage import open_store
+
+
+def parse_entry(entry: dict, root: str):
+    """ 子进程里跑：自己读段文件 + 解压 + 解析，主进程只收结果 """
+    try:
+        return entry["key"], parse_detail(read_entry(entry, Path(root))), None
+    except Exception as e:
+        return entry["key"], None, f"{type(e).__name__}: {e}"
+
+
+def carry_local_paths(record: dict, old: dict) -> None:
+    old_paths = {
+        att.get("url"): att.get("local_path")
+        for att in (old or {}).get("附件") or []
+        if isinstance(att, dict) and att.get("local_path")
+    }
+    for att in record.get("附件") or []:
+        if att.get("url") in old_paths:
+            att["local_path"] = old_paths[att["url"]]
+
+
+def reparse(workers: int = 0, only_missing: bool = False, flush_every: int = 1000,
+            root: Path = RAW_ARCHIVE_DIR) -> dict:
+    index = load_index(root)
+    # 按段文件、偏移排序：子进程顺序读盘
+    entries = sorted(
+        (e for (kind, _), e in index.items() if kind == "detail"),
+        key=lambda e: (e["seg"], e["off"]),
+    )
+
+    store = open_store(load_records=True)  # carry_local_paths 要读旧记录（逐条解码、不缓存）
+    store.autoflush = False
+    skip = set(store.list_failed("null_msg_ids"))
+    if only_missing:
+        entries = [e for e in entries if not store.has_record(e["key"])]
+    entries = [e for e in entries if e["key"] not in skip]
+
+    print(f"[reparse] 归档详情 {len(entries)} 条，跳过 null_msg_ids {len(skip)} 条")
+
+    stats = {"parsed": 0, "failed": 0}
+    workers = workers or os.cpu_count() or 1
+    try:
+        # spawn：store 可能已经起了后台压缩线程
+        ctx = multiprocessing.get_context("spawn")
+        with ProcessPoolExecutor(max_workers=workers, mp_context=ctx) as pool:
+            for msg_id, detail, err in pool.map(partial(parse_entry, root=str(root)), entries, chunksize=64):
+                if err is not None:
+                    print(f"[reparse 失败] id={msg_id} err={err}")
+                    stats["failed"] += 1
+                    continue
+
+                record = {"id": msg_id, **detail, "url": f"{BASE_URL_DETAIL}?id={msg_id}"}
+                carry_local_paths(record, store.get_record(msg_id))
+                store.upsert_record(record)
+
+                stats["parsed"] += 1
+                if stats["parsed"] % flush_every == 0:
+                    store.flush()
+                    print(f"[reparse] {stats['parsed']}/{len(entries)}")
+
+        store.flush()
+        print(f"[reparse] 完成 parsed={stats['parsed']} failed={stats['failed']} DB记录数={store.meta['count']}")
+    finally:
+        store.close()
+
+    return stats
+
+
+def main():
+    ap = argparse.ArgumentParser(description="从 data/raw/ 原始响应归档离线重建 qa_db")
+    ap.add_argument("--workers", type=int, default=0, help="解析进程数，默认 CPU 核数")
+    ap.add_argument("--only-missing", action="store_true", help="只补 store 里还没有的记录")
+    args = ap.parse_args()
+    reparse(workers=args.workers, only_missing=args.only_missing)
+
+
+if __name__ == "__main__":
+    main()
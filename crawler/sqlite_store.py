@@ -0,0 +1,451 @@
+# crawler/sqlite_store.py
+import json
+import sqlite3
+import threading
+from pathlib import Path
+from datetime import datetime
+
+from config import START_PAGE
+from storage import (
+    FAILED_KINDS,
+    load_db, load_state,
+    dedup_list, normalize_failed_attachment_item,
+    update_attachment_local_path,
+)
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    id          TEXT PRIMARY KEY,
+    标题        TEXT,
+    留言时间    TEXT,
+    纳税人所属地 TEXT,
+    答复时间    TEXT,
+    答复机构    TEXT,
+    问题内容    TEXT,
+    答复内容    TEXT,
+    status      TEXT,
+    url         TEXT,
+    data        TEXT NOT NULL          -- 完整记录 JSON（不含 附件，附件见 attachments 表）
+);
+CREATE INDEX IF NOT EXISTS idx_records_leave_time ON records (留言时间);
+
+CREATE TABLE IF NOT EXISTS attachments (
+    msg_id      TEXT NOT NULL,
+    seq         INTEGER NOT NULL,
+    fileId      TEXT,
+    标题        TEXT,
+    url         TEXT,
+    local_path  TEXT,
+    PRIMARY KEY (msg_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_attachments_url ON attachments (msg_id, url);
+CREATE INDEX IF NOT EXISTS idx_attachments_fileid ON attachments (fileId);
+
+CREATE TABLE IF NOT EXISTS failed_pages (page INTEGER PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS failed_ids (id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS null_msg_ids (id TEXT PRIMARY KEY);
+CREATE TABLE IF NOT EXISTS failed_attachments (
+    id      TEXT NOT NULL,
+    url     TEXT NOT NULL,
+    标题    TEXT,
+    fileId  TEXT,
+    PRIMARY KEY (id, url)
+);
+
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+
+-- 断点游标：只有一行
+CREATE TABLE IF NOT EXISTS cursor (
+    one             INTEGER PRIMARY KEY CHECK (one = 1),
+    next_page       INTEGER,
+    end_page        INTEGER,
+    consec_403      INTEGER,
+    cooldown_until  REAL,
+    last_saved_at   TEXT
+);
+"""
+
+CURSOR_KEYS = ("next_page", "end_page", "consec_403", "cooldown_until", "last_saved_at")
+RECORD_COLUMNS = ("标题", "留言时间", "纳税人所属地", "答复时间", "答复机构", "问题内容", "答复内容", "status", "url")
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # autocommit；多语句写入自己 BEGIN/COMMIT
+    conn = sqlite3.connect(str(path), isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class SqliteStore:
+    """
+    与 storage.JsonStore 同接口，但每次写入都是带索引的单行写：
+    - upsert_record → records 一行 + attachments 若干行
+    - add_failed / discard_failed → failed_* 表（list_failed / failed_count 读）
+    - save_state → cursor 表的唯一一行
+    records 不进内存；state 只保留 cursor 的几个标量（net.py 会改 consec_403/cooldown_until）。
+
+    写入同样先进内存缓冲，flush() 时在一个事务里落盘（autoflush 语义同 JsonStore）。
+    两个连接：flush 用写连接，has_record/get_record 用读连接（WAL 下读写互不阻塞）。
+    """
+
+    def __init__(self, path: Path, json_db_path: Path = None, json_state_path: Path = None):
+        self.path = Path(path)
+        self.conn = connect(self.path)
+        self.rconn = connect(self.path)
+
+        self.autoflush = True
+        self.on_dirty = None
+        self._lock = threading.RLock()        # 保护内存缓冲
+        self._flush_lock = threading.RLock()  # 串行化 flush（写连接）
+        self._read_lock = threading.Lock()    # 读连接
+        self._pending_records = {}            # id -> record
+        self._flushing_records = {}           # 正在 flush 的一批：COMMIT 之前读连接还看不到，查询时也要算上
+        self._pending_atts = []               # (msg_id, url, local_path)
+        self._pending_failed = []             # (kind, item, add?)：按顺序回放，同一项先加后删不会乱
+        self._state_dirty = False
+
+        if json_db_path is not None and json_state_path is not None and self._needs_import():
+            self.import_json(json_db_path, json_state_path)
+
+        self.state = self._load_cursor()
+
+    # ---------- cursor / state ----------
+    def _load_cursor(self) -> dict:
+        with self._read_lock:
+            row = self.rconn.execute(
+                f"SELECT {', '.join(CURSOR_KEYS)} FROM cursor WHERE one = 1"
+            ).fetchone()
+        cur = dict(zip(CURSOR_KEYS, row or [None] * len(CURSOR_KEYS)))
+
+        state = {
+            "next_page": cur["next_page"] or START_PAGE,
+            "consec_403": cur["consec_403"] or 0,
+            "cooldown_until": cur["cooldown_until"] or 0.0,
+            "last_saved_at": cur["last_saved_at"] or "",
+        }
+        # end_page 未写入时不放 key（与 json state 一致）
+        if cur["end_page"]:
+            state["end_page"] = cur["end_page"]
+        return state
+
+    def _write_cursor(self, st: dict) -> None:
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO cursor (one, {', '.join(CURSOR_KEYS)}) VALUES (1, ?, ?, ?, ?, ?)",
+            [st.get(k) for k in CURSOR_KEYS],
+        )
+
+    def save_state(self) -> None:
+        self._dirty(state=True)
+
+    # ---------- meta ----------
+    def _meta_get(self, conn, key: str, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def _meta_set(self, key: str, value) -> None:
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+            (key, json.dumps(value, ensure_ascii=False)),
+        )
+
+    @property
+    def meta(self) -> dict:
+        with self._read_lock:
+            return {
+                "count": self._meta_get(self.rconn, "count", 0),
+                "max_question_length": self._meta_get(self.rconn, "max_question_length", 0),
+                "max_question_id": self._meta_get(self.rconn, "max_question_id", ""),
+                # 走 idx_records_leave_time，不用单独维护
+                "newest_leave_time": self.rconn.execute("SELECT MAX(留言时间) FROM records").fetchone()[0] or "",
+            }
+
+    # ---------- 缓冲 ----------
+    def _dirty(self, state: bool = False) -> None:
+        with self._lock:
+            if state:
+                self._state_dirty = True
+            pending = len(self._pending_records) + len(self._pending_atts) + len(self._pending_failed)
+        if self.autoflush:
+            self.flush()
+        elif self.on_dirty is not None:
+            self.on_dirty(pending)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                records, self._pending_records = self._pending_records, {}
+                self._flushing_records = records
+                atts, self._pending_atts = self._pending_atts, []
+                failed, self._pending_failed = self._pending_failed, []
+                st = dict(self.state) if self._state_dirty else None
+                self._state_dirty = False
+
+            if not (records or atts or failed or st is not None):
+                return
+
+            # 先记录后 cursor，同一事务：next_page 不会跑到已落盘记录的前面
+            self.conn.execute("BEGIN")
+            try:
+                for record in records.values():
+                    self._write_record(record)
+                for msg_id, url, local_path in atts:
+                    self._write_attachment_local_path(msg_id, url, local_path)
+                for kind, item, add in failed:
+                    if add:
+                        self._write_failed(kind, item)
+                    else:
+                        self._delete_failed(kind, item)
+                if st is not None:
+                    st["last_saved_at"] = datetime.now().isoformat(timespec="seconds")
+                    self._write_cursor(st)
+                self.conn.execute("COMMIT")
+            except Exception:
+                self.conn.execute("ROLLBACK")
+                with self._lock:
+                    self._pending_records = {**records, **self._pending_records}
+                    self._pending_atts[:0] = atts
+                    self._pending_failed[:0] = failed
+                    if st is not None:
+                        self._state_dirty = True
+                raise
+            finally:
+                with self._lock:
+                    self._flushing_records = {}
+
+            if st is not None:
+                self.state["last_saved_at"] = st["last_saved_at"]
+
+    # ---------- records ----------
+    def _buffered_record(self, msg_id: str):
+        """ 还没提交的记录：缓冲里的，或正在 flush、读连接还看不到的 """
+        with self._lock:
+            record = self._pending_records.get(msg_id)
+            if record is None:
+                record = self._flushing_records.get(msg_id)
+            return record
+
+    def has_record(self, msg_id: str) -> bool:
+        if self._buffered_record(msg_id) is not None:
+            return True
+        with self._read_lock:
+            return self.rconn.execute("SELECT 1 FROM records WHERE id = ?", (msg_id,)).fetchone() is not None
+
+    def leave_time(self, msg_id: str) -> str:
+        record = self._buffered_record(msg_id)
+        if record is not None:
+            return record.get("留言时间") or ""
+        with self._read_lock:
+            row = self.rconn.execute("SELECT 留言时间 FROM records WHERE id = ?", (msg_id,)).fetchone()
+        return (row[0] or "") if row else ""
+
+    def get_record(self, msg_id: str):
+        record = self._buffered_record(msg_id)
+        if record is not None:
+            return record
+        with self._read_lock:
+            row = self.rconn.execute("SELECT data FROM records WHERE id = ?", (msg_id,)).fetchone()
+            if not row:
+                return None
+            atts = self.rconn.execute(
+                "SELECT 标题, url, fileId, local_path FROM attachments WHERE msg_id = ? ORDER BY seq",
+                (msg_id,),
+            ).fetchall()
+        record = json.loads(row[0])
+        record["附件"] = [attachment_from_row(a) for a in atts]
+        return record
+
+    def _write_record(self, record: dict) -> None:
+        rid = record["id"]
+        is_new = self.conn.execute("SELECT 1 FROM records WHERE id = ?", (rid,)).fetchone() is None
+
+        data = {k: v for k, v in record.items() if k != "附件"}
+        self.conn.execute(
+            f"INSERT OR REPLACE INTO records (id, {', '.join(RECORD_COLUMNS)}, data) "
+            f"VALUES (?, {', '.join('?' * len(RECORD_COLUMNS))}, ?)",
+            [rid, *[record.get(k) for k in RECORD_COLUMNS], json.dumps(data, ensure_ascii=False)],
+        )
+
+        self.conn.execute("DELETE FROM attachments WHERE msg_id = ?", (rid,))
+        self.conn.executemany(
+            "INSERT INTO attachments (msg_id, seq, fileId, 标题, url, local_path) VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (rid, i, att.get("fileId"), att.get("标题"), att.get("url"), att.get("local_path"))
+                for i, att in enumerate(record.get("附件") or [])
+                if isinstance(att, dict)
+            ],
+        )
+
+        if is_new:
+            self._meta_set("count", self._meta_get(self.conn, "count", 0) + 1)
+
+        q_len = len(record.get("问题内容") or "")
+        if q_len > self._meta_get(self.conn, "max_question_length", 0):
+            self._meta_set("max_question_length", q_len)
+            self._meta_set("max_question_id", rid)
+
+    def upsert_record(self, record: dict) -> None:
+        record["status"] = "ok"
+        with self._lock:
+            self._pending_records[record["id"]] = record
+        self._dirty()
+
+    def _write_attachment_local_path(self, msg_id: str, url: str, local_path: str) -> bool:
+        cur = self.conn.execute(
+            "UPDATE attachments SET local_path = ? WHERE rowid = "
+            "(SELECT rowid FROM attachments WHERE msg_id = ? AND url = ? ORDER BY seq LIMIT 1)",
+            (local_path, msg_id, url),
+        )
+        if cur.rowcount:
+            return True
+
+        # 兜底：按 fileId 匹配
+        fid = url.split("fileId=")[-1].split("&")[0] if "fileId=" in url else ""
+        if not fid:
+            return False
+        cur = self.conn.execute(
+            "UPDATE attachments SET local_path = ? WHERE rowid = "
+            "(SELECT rowid FROM attachments WHERE msg_id = ? AND fileId = ? ORDER BY seq LIMIT 1)",
+            (local_path, msg_id, fid),
+        )
+        return bool(cur.rowcount)
+
+    def update_attachment_local_path(self, msg_id: str, url: str, local_path: str) -> bool:
+        with self._lock:
+            rec = self._pending_records.get(msg_id)
+            if rec is not None:
+                # 记录还在缓冲里：直接改，随记录一起落盘
+                return update_attachment_local_path({"records": {msg_id: rec}}, msg_id, url, local_path)
+
+        if not self.has_record(msg_id):
+            return False
+        with self._lock:
+            self._pending_atts.append((msg_id, url, local_path))
+        self._dirty()
+        return True
+
+    # ---------- failed_* ----------
+    def _write_failed(self, kind: str, item) -> None:
+        if kind == "failed_pages":
+            self.conn.execute("INSERT OR IGNORE INTO failed_pages (page) VALUES (?)", (int(item),))
+        elif kind in ("failed_ids", "null_msg_ids"):
+            self.conn.execute(f"INSERT OR IGNORE INTO {kind} (id) VALUES (?)", (item,))
+        elif kind == "failed_attachments":
+            self.conn.execute(
+                "INSERT OR IGNORE INTO failed_attachments (id, url, 标题, fileId) VALUES (?, ?, ?, ?)",
+                (item.get("id"), item.get("url"), item.get("标题", ""), item.get("fileId", "")),
+            )
+        else:
+            raise KeyError(kind)
+
+    def _delete_failed(self, kind: str, item) -> None:
+        if kind == "failed_pages":
+            self.conn.execute("DELETE FROM failed_pages WHERE page = ?", (int(item),))
+        elif kind in ("failed_ids", "null_msg_ids"):
+            self.conn.execute(f"DELETE FROM {kind} WHERE id = ?", (item,))
+        elif kind == "failed_attachments":
+            self.conn.execute(
+                "DELETE FROM failed_attachments WHERE id = ? AND url = ?", (item.get("id"), item.get("url"))
+            )
+        else:
+            raise KeyError(kind)
+
+    def add_failed(self, kind: str, item) -> None:
+        if kind not in FAILED_KINDS:
+            raise KeyError(kind)
+        with self._lock:
+            self._pending_failed.append((kind, item, True))
+        self._dirty()
+
+    def discard_failed(self, kind: str, item) -> None:
+        if kind not in FAILED_KINDS:
+            raise KeyError(kind)
+        with self._lock:
+            self._pending_failed.append((kind, item, False))
+        self._dirty()
+
+    def list_failed(self, kind: str) -> list:
+        if kind not in FAILED_KINDS:
+            raise KeyError(kind)
+        self.flush()
+        with self._read_lock:
+            if kind == "failed_pages":
+                return [r[0] for r in self.rconn.execute("SELECT page FROM failed_pages ORDER BY rowid")]
+            if kind in ("failed_ids", "null_msg_ids"):
+                return [r[0] for r in self.rconn.execute(f"SELECT id FROM {kind} ORDER BY rowid")]
+            return [
+                {"id": r[0], "url": r[1], "标题": r[2] or "", "fileId": r[3] or ""}
+                for r in self.rconn.execute(
+                    "SELECT id, url, 标题, fileId FROM failed_attachments ORDER BY rowid"
+                )
+            ]
+
+    def failed_count(self, kind: str) -> int:
+        if kind not in FAILED_KINDS:
+            raise KeyError(kind)
+        self.flush()
+        with self._read_lock:
+            return self.rconn.execute(f"SELECT COUNT(*) FROM {kind}").fetchone()[0]
+
+    def close(self) -> None:
+        self._state_dirty = True
+        self.flush()
+        self.conn.close()
+        self.rconn.close()
+
+    # ---------- 从 JSON 文件一次性导入 ----------
+    def _needs_import(self) -> bool:
+        """ 导入完成记在 meta.json_imported（与导入同一个事务）；不看库文件是否存在，导入失败下次还会再导 """
+        if self._meta_get(self.conn, "json_imported") is not None:
+            return False
+        # 加这个标记之前建的库：已经有数据就是导入过（或本来就没有 JSON），补上标记
+        if self.conn.execute("SELECT 1 FROM cursor UNION ALL SELECT 1 FROM records LIMIT 1").fetchone():
+            self._meta_set("json_imported", "")
+            return False
+        return True
+
+    def import_json(self, db_path: Path, state_path: Path) -> None:
+        db_path, state_path = Path(db_path), Path(state_path)
+        imported_at = datetime.now().isoformat(timespec="seconds")
+        if not db_path.exists() and not state_path.exists():
+            self._meta_set("json_imported", imported_at)
+            return
+
+        db = load_db(db_path)
+        st = load_state(state_path)
+
+        with self._flush_lock:
+            self.conn.execute("BEGIN")
+            try:
+                for record in db["records"].values():
+                    self._write_record(record)
+
+                for kind in ("failed_pages", "failed_ids", "null_msg_ids"):
+                    for x in dedup_list(st.get(kind, [])):
+                        self._write_failed(kind, x)
+                for x in st.get("failed_attachments", []):
+                    it = normalize_failed_attachment_item(x)
+                    if it:
+                        self._write_failed("failed_attachments", it)
+
+                self._write_cursor(st)
+                self._meta_set("json_imported", imported_at)
+                self.conn.execute("COMMIT")
+            except BaseException:
+                # 中途出错 / Ctrl-C：整个导入作废，库保持空的，下次打开重新导入
+                self.conn.execute("ROLLBACK")
+                raise
+
+        print(f"[sqlite] 已从 {db_path.name}/{state_path.name} 导入 {len(db['records'])} 条记录")
+
+
+def attachment_from_row(row) -> dict:
+    title, url, fid, local_path = row
+    att = {"标题": title or "", "url": url or "", "fileId": fid or ""}
+    if local_path:
+        att["local_path"] = local_path
+    return att
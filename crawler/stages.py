@@ -0,0 +1,181 @@
+# crawler/stages.py
+"""
+engine 的具体 stage：列表页 / 详情（含解析和附件）/ 附件补下载。
+run() 在线程池里跑，只做网络 + 解析；commit() 在调度线程里入库。
+"""
+from config import BASE_URL_DETAIL, DOWNLOAD_ATTACHMENTS
+from net import fetch_page, fetch_detail_html
+from download import download_one_attachment
+from engine import Stage, Engine, Work, Detail, Attachment
+import events
+
+
+def is_null_attachment_error(e: Exception) -> bool:
+    em = (str(e) or "").lower()
+    return ("oid can not be null" in em) or ("permanent invalid" in em) or ("permanentalid" in em)
+
+
+def new_msg_ids(store, page_set: list) -> list:
+    """ 列表页里库中还没有的 id（保持页内顺序、去重） """
+    msg_ids = []
+    for raw in page_set:
+        msg_id = raw.get("id")
+        if msg_id and not store.has_record(msg_id) and msg_id not in msg_ids:
+            msg_ids.append(msg_id)
+    return msg_ids
+
+
+def fetch_message(session, att_session, parser, archive, rate, state: dict, msg_id: str) -> dict:
+    """
+    只做网络 + 解析，不碰 store；结果交回调度线程 DetailStage.commit()。
+    返回 {"id", "record", "error", "null_attachment", "failed_attachments"}
+    """
+    result = {"id": msg_id, "record": None, "error": None, "null_attachment": False, "failed_attachments": []}
+
+    try:
+        html_text = fetch_detail_html(session, rate, state, msg_id)
+        if archive is not None:
+            archive.put_detail(msg_id, html_text)
+        detail = parser.parse(html_text)
+    except Exception as e:
+        result["error"] = e
+        return result
+
+    if DOWNLOAD_ATTACHMENTS:
+        for att in (detail.get("附件") or []):
+            try:
+                local_path = download_one_attachment(session, rate, state, msg_id, att, att_session)
+                att["local_path"] = local_path
+            except Exception as e:
+                # ✅ 命中 null：记录“问答 id”，然后跳过整个问答
+                if is_null_attachment_error(e):
+                    result["null_attachment"] = True
+                    return result
+
+                item = Attachment(msg_id, att.get("url", ""), att.get("标题", ""), att.get("fileId", ""))
+                result["failed_attachments"].append((item, e))
+
+    result["record"] = {"id": msg_id, **detail, "url": f"{BASE_URL_DETAIL}?id={msg_id}"}
+    return result
+
+
+class ListStage(Stage):
+    def __init__(self, session, rate, state: dict, archive=None, parser=None):
+        self.session = session
+        self.rate = rate
+        self.state = state
+        self.archive = archive
+        self.parser = parser  # 只用来在日志里打印解析背压
+
+    def run(self, item):
+        return fetch_page(self.session, self.rate, self.state, item.page)
+
+    def commit(self, engine: Engine, work: Work, outcome) -> None:
+        page = work.item.page
+        fresh = not work.retry and work.attempt == 1
+
+        if isinstance(outcome, Exception):
+            tag = engine.source.name if fresh else "backfill pages"
+            print(f"[{tag} 列表失败] page={page} attempt={work.attempt} err={outcome}")
+            engine.fail(work, "failed_pages", page, outcome)
+            if fresh:
+                # 与原来一致：列表失败的页记入 failed_pages，断点照常往后走
+                engine.page_failed(page)
+            return
+
+        data = outcome
+        if self.archive is not None:
+            self.archive.put_list(page, data)
+
+        engine.resolve(work, "failed_pages", page)
+
+        page_set = data.get("pageSet") or []
+        msg_ids = [m for m in new_msg_ids(engine.store, page_set) if m not in engine.active_ids]
+
+        if fresh:
+            parse_wait = ""
+            if self.parser is not None:
+                parse_wait = f" parse_wait={self.parser.stats()['waited_seconds']:.1f}s"
+            print(f"[{engine.source.name}] page={page} items={len(page_set)} new={len(msg_ids)} "
+                  f"consec_403={self.state.get('consec_403', 0)} rpm={self.rate.current_rpm:.1f}{parse_wait}")
+            engine.open_page(page, data, msg_ids)
+        else:
+            print(f"[backfill pages] page={page} items={len(page_set)} new={len(msg_ids)}")
+            for msg_id in msg_ids:
+                engine.push(Detail(msg_id))
+
+
+class DetailStage(Stage):
+    def __init__(self, session, att_session, parser, archive, rate, state: dict):
+        self.session = session
+        self.att_session = att_session
+        self.parser = parser
+        self.archive = archive
+        self.rate = rate
+        self.state = state
+
+    def run(self, item):
+        return fetch_message(self.session, self.att_session, self.parser, self.archive, self.rate, self.state,
+                             item.msg_id)
+
+    def commit(self, engine: Engine, work: Work, outcome) -> None:
+        item = work.item
+        msg_id = item.msg_id
+        store = engine.store
+        tag = "详情失败" if not work.retry else "backfill 详情失败"
+
+        try:
+            if isinstance(outcome, Exception):
+                outcome = {"id": msg_id, "error": outcome}
+
+            if outcome.get("error") is not None:
+                print(f"[{tag}] id={msg_id} attempt={work.attempt} err={outcome['error']}")
+                engine.fail(work, "failed_ids", msg_id, outcome["error"])
+                return
+
+            if outcome["null_attachment"]:
+                store.add_failed("null_msg_ids", msg_id)
+                engine.resolve(work, "failed_ids", msg_id)
+                store.save_state()
+                print(f"[问答跳过-null附件] id={msg_id} 因附件oid-null，已记录到 state.null_msg_ids")
+                return
+
+            for att, e in outcome["failed_attachments"]:
+                print(f"[附件失败] {msg_id} {att.url} err={e}")
+                engine.fail(Work(att), "failed_attachments", att.failed_item(), e)
+
+            record = outcome["record"]
+            store.upsert_record(record)
+            engine.resolve(work, "failed_ids", msg_id)
+            events.emit("record", id=msg_id, 标题=record.get("标题"), 留言时间=record.get("留言时间"))
+        finally:
+            engine.detail_done(item)
+
+
+class AttachmentStage(Stage):
+    """ 失败附件的补下载（首次下载在 DetailStage 里随详情一起做） """
+
+    def __init__(self, session, att_session, rate, state: dict, store):
+        self.session = session
+        self.att_session = att_session
+        self.rate = rate
+        self.state = state
+        self.store = store
+
+    def run(self, item):
+        # 没有对应问答的附件不下载，原样留在 failed_attachments
+        if not self.store.has_record(item.msg_id):
+            return None
+        att = {"url": item.url, "标题": item.title, "fileId": item.file_id}
+        return download_one_attachment(self.session, self.rate, self.state, item.msg_id, att, self.att_session)
+
+    def commit(self, engine: Engine, work: Work, outcome) -> None:
+        item = work.item
+        if outcome is None:
+            return
+        if isinstance(outcome, Exception):
+            print(f"[backfill 附件仍失败] {item.msg_id} {item.url} attempt={work.attempt} err={outcome}")
+            engine.fail(work, "failed_attachments", item.failed_item(), outcome)
+            return
+        engine.store.update_attachment_local_path(item.msg_id, item.url, outcome)
+        engine.resolve(work, "failed_attachments", item.failed_item())
@@ -1,92 +1,397 @@
 # crawler/storage.py
 import json
 import os
+import mmap
+import threading
+from collections.abc import MutableMapping
 from pathlib import Path
 from datetime import datetime
 
-from config import START_PAGE
+from config import (
+    START_PAGE,
+    DB_FILE, STATE_FILE, DB_LOG_COMPACT_BYTES, FLUSH_FSYNC,
+    STORAGE_BACKEND, SQLITE_FILE,
+)
+from dblog import (
+    empty_meta, upsert_record, update_meta, update_attachment_local_path,
+    parse_db_log_line, apply_db_op,
+)
 
 
 
-def atomic_write_json(path: Path, data: dict) -> None:
+def atomic_write_json(path: Path, data: dict, fsync: bool = False) -> None:
     path = Path(path)
     path.parent.mkdir(parents=True, exist_ok=True)
 
     tmp = path.with_suffix(path.suffix + ".tmp")
     with tmp.open("w", encoding="utf-8") as f:
         json.dump(data, f, ensure_ascii=False, indent=2)
+        if fsync:
+            f.flush()
+            os.fsync(f.fileno())
 
     os.replace(tmp, path)
 
 
 # ===================== JSON DB：按 id 存记录 =====================
-def load_db(path: Path) -> dict:
+def load_db_snapshot(path: Path) -> dict:
+    """
+    有对得上的 id 索引（带字节偏移）时 records 是 LazyRecords，不解码任何记录；
+    否则（旧版 indent=2 快照、索引缺失 / 过期）整个 json.load。
+    """
     path = Path(path)
     if not path.exists():
         return {
-            "meta": {
-                "count": 0,
-                "max_question_length": 0,
-                "max_question_id": "",
-            },
+            "meta": empty_meta(),
             "records": {}
         }
+    index = read_id_index(path, offsets=True)
+    if index is not None:
+        return {"meta": dict(index.meta), "records": LazyRecords(path, index.offsets, index.times)}
     with path.open("r", encoding="utf-8") as f:
         return json.load(f)
 
 
-def save_db_atomic(path: Path, db: dict) -> None:
-    atomic_write_json(path, db)
+def load_db(path: Path) -> dict:
+    """
+    快照 + 追加日志回放：
+    qa_db.json（快照） → qa_db.log.jsonl.compacting（压缩中的旧日志，可能不存在） → qa_db.log.jsonl
+    """
+    db = load_db_snapshot(path)
 
+    # 旧快照没有 newest_leave_time：扫一遍补上，之后（包括下面的日志回放）由 upsert_record 维护
+    # （LazyRecords 的快照一定带索引，索引头的 meta 里有）
+    if "newest_leave_time" not in db["meta"]:
+        db["meta"]["newest_leave_time"] = max(
+            (r.get("留言时间") or "" for r in db["records"].values()), default=""
+        )
 
-def upsert_record(db: dict, record: dict) -> None:
-    rid = record["id"]
-    record["status"] = "ok"
-    is_new = rid not in db["records"]
-    db["records"][rid] = record
+    replay_db_log(db, db_compacting_log_path(path))
+    replay_db_log(db, db_log_path(path))
+    return db
 
-    if is_new:
-        db["meta"]["count"] += 1
 
-    # 更新 max_question_length
-    q = record.get("问题内容") or ""
-    q_len = len(q)
-    if q_len > db["meta"].get("max_question_length", 0):
-        db["meta"]["max_question_length"] = q_len
-        db["meta"]["max_question_id"] = rid
+def save_db_atomic(path: Path, db: dict) -> dict:
+    """
+    流式写快照，每条记录单独一行（仍是合法 JSON，viewer / 旧代码照常 json.load）：
 
+        {"meta": {...},
+        "records": {
+        "<id>": {...},
+        ...
+        }}
 
-def update_attachment_local_path(db: dict, msg_id: str, url: str, local_path: str) -> bool:
+    记录从 LazyRecords 来的、没改过的直接拷贝原始字节，不解码。返回 {id: (字节偏移, 长度)}。
     """
-    在 db.records[msg_id]["附件"] 里按 url/fileId 找到对应附件，写入 local_path。
-    找不到也不算致命，返回 False。
+    path = Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    records = db["records"]
+    offsets = {}
+
+    tmp = path.with_suffix(path.suffix + ".tmp")
+    with tmp.open("wb") as f:
+        f.write(b'{"meta": ' + json.dumps(db["meta"], ensure_ascii=False).encode("utf-8") + b',\n"records": {')
+        sep = b"\n"
+        for rid in records:
+            if isinstance(records, LazyRecords):
+                raw = records.raw(rid)
+            else:
+                raw = json.dumps(records[rid], ensure_ascii=False).encode("utf-8")
+            f.write(sep + json.dumps(rid, ensure_ascii=False).encode("utf-8") + b": ")
+            offsets[rid] = (f.tell(), len(raw))
+            f.write(raw)
+            sep = b",\n"
+        f.write(b"\n}}\n")
+
+    if isinstance(records, LazyRecords):
+        # 先释放旧快照的映射再替换（Windows 上映射中的文件不能被替换）
+        records.close()
+    os.replace(tmp, path)
+    return offsets
+
+
+class LazyRecords(MutableMapping):
     """
-    rec = db["records"].get(msg_id)
-    if not rec:
-        return False
+    快照里的 records：按 id 索引里的字节偏移从 mmap 按需解码，启动时不解码任何记录。
+    - get / [] 解码后缓存：调用方可能就地改（回填附件 local_path）；写入的记录也进缓存
+    - peek / values() / items() 逐条解码、不缓存：全量遍历（导入 sqlite、reparse 等）时内存不随记录数增长
+    - 迭代顺序：快照顺序，之后新增的排在后面（与 dict 一致）
+    """
+
+    def __init__(self, path: Path, offsets: dict, times: dict):
+        self._f = Path(path).open("rb")
+        self._mm = mmap.mmap(self._f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._offsets = offsets
+        self._times = times  # id -> 留言时间，同时是全部 id 的有序集合
+        self._cache = {}
+
+    def _decode(self, rid: str) -> dict:
+        off, n = self._offsets[rid]
+        return json.loads(self._mm[off:off + n])
+
+    def raw(self, rid: str) -> bytes:
+        """ 记录的 JSON 字节；没改过的直接切快照 """
+        if rid in self._cache:
+            return json.dumps(self._cache[rid], ensure_ascii=False).encode("utf-8")
+        off, n = self._offsets[rid]
+        return self._mm[off:off + n]
+
+    def leave_times(self) -> dict:
+        return self._times
+
+    def peek(self, rid: str):
+        """ 同 get，但不缓存解码结果 """
+        if rid in self._cache:
+            return self._cache[rid]
+        if rid not in self._offsets:
+            return None
+        return self._decode(rid)
+
+    def __getitem__(self, rid):
+        if rid in self._cache:
+            return self._cache[rid]
+        if rid not in self._offsets:
+            raise KeyError(rid)
+        rec = self._cache[rid] = self._decode(rid)
+        return rec
+
+    def __setitem__(self, rid, record) -> None:
+        self._cache[rid] = record
+        self._times[rid] = record.get("留言时间") or ""
+
+    def __delitem__(self, rid) -> None:
+        del self._times[rid]
+        self._cache.pop(rid, None)
+        self._offsets.pop(rid, None)
+
+    def __contains__(self, rid) -> bool:
+        return rid in self._times
+
+    def __iter__(self):
+        return iter(self._times)
+
+    def __len__(self) -> int:
+        return len(self._times)
+
+    def values(self):
+        for rid in self:
+            yield self._cache[rid] if rid in self._cache else self._decode(rid)
+
+    def items(self):
+        for rid in self:
+            yield rid, (self._cache[rid] if rid in self._cache else self._decode(rid))
+
+    def close(self) -> None:
+        self._mm.close()
+        self._f.close()
+
+
+# ===================== 追加日志：每条 upsert 只追加一行，后台压缩成快照 =====================
+# op 的格式与回放见 crawler/dblog.py
+_db_log_lock = threading.Lock()
+_compact_thread = None
+
+
+def db_log_path(path: Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.stem + ".log.jsonl")
+
+
+def db_compacting_log_path(path: Path) -> Path:
+    log = db_log_path(path)
+    return log.with_name(log.name + ".compacting")
+
 
-    atts = rec.get("附件") or []
-    if not isinstance(atts, list):
+def iter_db_log(log_path: Path):
+    """ 逐行解析日志里的 op；崩溃时最后一行可能只写了一半，直接丢弃 """
+    log_path = Path(log_path)
+    if not log_path.exists():
+        return
+    with log_path.open("r", encoding="utf-8") as f:
+        for line in f:
+            op = parse_db_log_line(line)
+            if op is not None:
+                yield op
+
+
+def replay_db_log(db: dict, log_path: Path) -> int:
+    return sum(apply_db_op(db, op) for op in iter_db_log(log_path))
+
+
+def db_log_line(op: dict) -> str:
+    return json.dumps(op, ensure_ascii=False) + "\n"
+
+
+def append_db_log_lines(path: Path, lines: list, fsync: bool = False) -> None:
+    """ 日志唯一的写入口（JsonStore.flush 批量追加 db_log_line 生成的行） """
+    log = db_log_path(path)
+    with _db_log_lock:
+        log.parent.mkdir(parents=True, exist_ok=True)
+        with log.open("a+b") as f:
+            # 上次写到一半就崩溃（最后一行没有换行）：先补上换行，否则这次的第一行会接在半行后面，
+            # 回放时两行一起丢掉。半行本身照旧在回放时丢弃
+            if f.seek(0, os.SEEK_END) > 0:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b"\n":
+                    f.write(b"\n")
+            f.write("".join(lines).encode("utf-8"))
+            if fsync:
+                f.flush()
+                os.fsync(f.fileno())
+
+
+def compact_db(path: Path) -> None:
+    """
+    把 快照 + .compacting 日志 合并成新快照，然后删掉 .compacting。
+    只读写文件，不碰调用方内存里的 db，可以放在后台线程跑。
+    """
+    compacting = db_compacting_log_path(path)
+    db = load_db_snapshot(path)
+    replay_db_log(db, compacting)
+    # 旧快照有索引时只解码日志涉及的记录，其余按字节拷贝
+    offsets = save_db_atomic(path, db)
+    # 先写快照再写索引：中间崩溃时索引与快照对不上，下次启动会重建
+    save_id_index(path, IdIndex.from_db(db, offsets))
+    compacting.unlink(missing_ok=True)
+
+
+def maybe_compact_db(path: Path, max_bytes: int = DB_LOG_COMPACT_BYTES) -> bool:
+    """
+    日志超过 max_bytes 时：把当前日志改名为 .compacting（新的 upsert 写进新日志），
+    再起后台线程压缩。上次压缩没做完（.compacting 还在）就不再轮转，只补跑压缩。
+    """
+    global _compact_thread
+
+    if _compact_thread is not None and _compact_thread.is_alive():
         return False
 
-    # 优先用 url 精确匹配
-    for att in atts:
-        if isinstance(att, dict) and att.get("url") == url:
-            att["local_path"] = local_path
-            return True
+    log = db_log_path(path)
+    compacting = db_compacting_log_path(path)
+
+    with _db_log_lock:
+        if not compacting.exists():
+            if not log.exists() or log.stat().st_size < max_bytes:
+                return False
+            os.replace(log, compacting)
+
+    # 非 daemon：进程退出前会等它写完快照
+    _compact_thread = threading.Thread(target=compact_db, args=(path,), name="db-compact")
+    _compact_thread.start()
+    return True
+
+
+# ===================== id 索引：不加载 records 也能判断“已有” =====================
+# qa_db.ids.tsv：第一行是 JSON 头 {"snapshot": {"size", "mtime_ns"}, "offsets": true, "meta": {...}}，
+# 之后每行 "id\t留言时间\t字节偏移\t长度"（记录在 qa_db.json 里的位置，LazyRecords 按它解码）。
+# 只对应快照（随 compact_db 重写）；快照之后的日志启动时再回放一遍（日志有 DB_LOG_COMPACT_BYTES 上限，很快）。
+# 头里的 size / mtime_ns 与快照文件对不上（旧版本没有索引、写完快照还没写索引就崩溃）时，完整加载一次，
+# 按逐行格式重写快照并重建索引。
+def db_index_path(path: Path) -> Path:
+    path = Path(path)
+    return path.with_name(path.stem + ".ids.tsv")
+
 
-    # 兜底：按 fileId 匹配
-    fid = ""
-    if "fileId=" in url:
-        fid = url.split("fileId=")[-1].split("&")[0]
+def snapshot_signature(path: Path) -> dict:
+    path = Path(path)
+    if not path.exists():
+        return {"size": 0, "mtime_ns": 0}
+    st = path.stat()
+    return {"size": st.st_size, "mtime_ns": st.st_mtime_ns}
+
+
+class IdIndex:
+    """ id -> 留言时间 + meta；每条只有两个短字符串，比完整 records 小两个数量级 """
+
+    def __init__(self, times: dict = None, meta: dict = None, offsets: dict = None):
+        self.times = times if times is not None else {}
+        self.meta = meta if meta is not None else empty_meta()
+        self.meta.setdefault("newest_leave_time", max(self.times.values(), default=""))
+        self.offsets = offsets  # {id: (偏移, 长度)}；只有按需解码时才读
+
+    @classmethod
+    def from_db(cls, db: dict, offsets: dict = None) -> "IdIndex":
+        records = db["records"]
+        if isinstance(records, LazyRecords):
+            times = dict(records.leave_times())
+        else:
+            times = {rid: r.get("留言时间") or "" for rid, r in records.items()}
+        return cls(times, dict(db["meta"]), offsets)
+
+    def __contains__(self, msg_id) -> bool:
+        return msg_id in self.times
+
+    def add(self, record: dict) -> None:
+        rid = record["id"]
+        is_new = rid not in self.times
+        self.times[rid] = record.get("留言时间") or ""
+        update_meta(self.meta, record, is_new)
+
+    def replay(self, log_path: Path) -> int:
+        """ 只看 put：att 只改附件 local_path，与索引无关 """
+        n = 0
+        for op in iter_db_log(log_path):
+            if op.get("op") == "put" and isinstance(op.get("record"), dict):
+                self.add(op["record"])
+                n += 1
+        return n
+
+
+def save_id_index(path: Path, index: IdIndex) -> None:
+    out = db_index_path(path)
+    tmp = out.with_suffix(out.suffix + ".tmp")
+    header = {"snapshot": snapshot_signature(path), "offsets": True, "meta": index.meta}
+    offsets = index.offsets
+    with tmp.open("w", encoding="utf-8") as f:
+        f.write(json.dumps(header, ensure_ascii=False) + "\n")
+        f.writelines(f"{rid}\t{t}\t{offsets[rid][0]}\t{offsets[rid][1]}\n" for rid, t in index.times.items())
+    os.replace(tmp, out)
 
-    if fid:
-        for att in atts:
-            if isinstance(att, dict) and (att.get("fileId") == fid or att.get("id") == fid):
-                att["local_path"] = local_path
-                return True
 
-    return False
+def read_id_index(path: Path, offsets: bool = False):
+    """
+    与当前快照对得上的索引；没有 / 过期 / 损坏返回 None。
+    offsets=False 不保留字节偏移（只判断“已有”时省内存）。
+    """
+    p = db_index_path(path)
+    if not p.exists():
+        return None
+    try:
+        with p.open("r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("snapshot") != snapshot_signature(path) or not header.get("offsets"):
+                return None
+            times = {}
+            offs = {} if offsets else None
+            for line in f:
+                rid, t, off, n = line.rstrip("\n").split("\t")
+                times[rid] = t
+                if offsets:
+                    offs[rid] = (int(off), int(n))
+    except (OSError, ValueError):
+        return None
+    return IdIndex(times, header.get("meta") or empty_meta(), offs)
+
+
+def load_id_index(path: Path) -> IdIndex:
+    """
+    快照的 id 索引 + 日志回放（与 load_db 同顺序）。
+    索引不可用时完整 load 快照一次、写出索引；records 随即释放。
+    """
+    path = Path(path)
+    index = read_id_index(path)
+    if index is None:
+        index = IdIndex()
+        if path.exists():
+            print(f"[storage] {db_index_path(path).name} 缺失或与快照不一致，完整加载快照重建（只此一次）")
+            db = load_db_snapshot(path)
+            # 顺便把旧版 indent=2 快照改写成逐行格式，之后就能按偏移解码
+            index = IdIndex.from_db(db, save_db_atomic(path, db))
+            save_id_index(path, index)
+            index.offsets = None
+
+    index.replay(db_compacting_log_path(path))
+    index.replay(db_log_path(path))
+    return index
 
 
 # ===================== STATE：failed_pages/failed_ids + 断点续跑 =====================
@@ -109,9 +414,9 @@ def load_state(path: Path) -> dict:
         return json.load(f)
 
 
-def save_state_atomic(path: Path, st: dict) -> None:
+def save_state_atomic(path: Path, st: dict, fsync: bool = False) -> None:
     st["last_saved_at"] = datetime.now().isoformat(timespec="seconds")
-    atomic_write_json(path, st)
+    atomic_write_json(path, st, fsync=fsync)
 
 
 def dedup_list(lst: list) -> list:
@@ -125,21 +430,6 @@ def dedup_list(lst: list) -> list:
     return out
 
 
-def add_unique(lst: list, x) -> None:
-    # dict 的唯一性按序列化 key
-    if isinstance(x, dict):
-        k = json.dumps(x, ensure_ascii=False, sort_keys=True)
-        for y in lst:
-            ky = json.dumps(y, ensure_ascii=False, sort_keys=True) if isinstance(y, dict) else str(y)
-            if ky == k:
-                return
-        lst.append(x)
-        return
-
-    if x not in lst:
-        lst.append(x)
-
-
 def normalize_failed_attachment_item(x):
     """
     兼容旧格式：
@@ -158,3 +448,204 @@ def normalize_failed_attachment_item(x):
             return {"id": msg_id.strip(), "url": url.strip(), "标题": "", "fileId": ""}
 
     return None
+
+
+# ===================== 失败集合：有序 + 哈希去重 =====================
+FAILED_KINDS = ("failed_pages", "failed_ids", "failed_attachments", "null_msg_ids")
+
+
+def failure_key(kind: str, x):
+    """ failed_attachments 按 (id, url)；failed_pages 按页码；failed_ids / null_msg_ids 按 msg id。 """
+    if kind == "failed_attachments":
+        return (x.get("id"), x.get("url")) if isinstance(x, dict) else str(x)
+    if kind == "failed_pages":
+        try:
+            return int(x)
+        except (TypeError, ValueError):
+            return str(x)
+    return str(x)
+
+
+class FailureSet:
+    """
+    failed_* 的一类失败项，按 failure_key 去重：dict 保序，成员判断 O(1)。
+    to_list() 输出与旧版 crawl_state.json 相同的 list 结构（viewer 和旧 state 文件照常可用）。
+    """
+
+    def __init__(self, kind: str, items=()):
+        self.kind = kind
+        self._items = {}
+        for x in items:
+            self.add(x)
+
+    def add(self, x) -> bool:
+        k = failure_key(self.kind, x)
+        if k in self._items:
+            return False
+        self._items[k] = x
+        return True
+
+    def discard(self, x) -> None:
+        self._items.pop(failure_key(self.kind, x), None)
+
+    def __contains__(self, x) -> bool:
+        return failure_key(self.kind, x) in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __iter__(self):
+        return iter(list(self._items.values()))
+
+    def to_list(self) -> list:
+        return list(self._items.values())
+
+
+# ===================== Store：main 通过它读写 DB 和 state =====================
+
+
+class JsonStore:
+    """
+    qa_db.json（快照 + 追加日志） + crawl_state.json。
+    state 就是 crawl_state.json 的 dict（net.py 直接改 consec_403/cooldown_until）。
+
+    load_records=False（抓取默认）：只加载 id 索引（qa_db.ids.tsv），has_record / leave_time / meta 都走索引，
+    不把问答全文读进内存；get_record 需要 load_records=True（reparse 用）。
+    load_records=True 时 records 是打开那一刻的只读视图：get_record 逐条解码、不缓存，upsert 只写日志和索引，
+    不进视图——reparse 每条先读旧记录再覆盖，内存不随记录数增长。
+
+    写入先进内存缓冲，flush() 才落盘：
+    - autoflush=True（默认）：每次写入立即 flush，与旧行为一致
+    - 交给 persist.PersistWriter 后：autoflush=False，由后台线程按策略 flush
+    """
+
+    def __init__(self, db_path: Path, state_path: Path, load_records: bool = False):
+        self.db_path = Path(db_path)
+        self.state_path = Path(state_path)
+        if load_records:
+            self.db = load_db(self.db_path)
+            self.index = IdIndex.from_db(self.db)
+        else:
+            self.db = None
+            self.index = load_id_index(self.db_path)
+        self.state = load_state(self.state_path)
+
+        # failed_* 在内存里是 FailureSet（自带去重），落盘时还原成 list；failed_attachments 兼容旧格式
+        for kind in FAILED_KINDS:
+            items = self.state.get(kind, [])
+            if kind == "failed_attachments":
+                items = filter(None, map(normalize_failed_attachment_item, items))
+            self.state[kind] = FailureSet(kind, items)
+
+        self.autoflush = True
+        self.on_dirty = None            # callback(pending_count)，PersistWriter 注入
+        self._lock = threading.RLock()  # 保护内存缓冲
+        self._flush_lock = threading.Lock()
+        self._pending_lines = []        # 已序列化的日志行（入队时序列化，避免后台线程读到被改动的 dict）
+        self._state_dirty = False
+
+    @property
+    def meta(self) -> dict:
+        return self.index.meta
+
+    def has_record(self, msg_id: str) -> bool:
+        return msg_id in self.index
+
+    def leave_time(self, msg_id: str) -> str:
+        """ 已入库问答的 留言时间；没有这条返回 "" """
+        return self.index.times.get(msg_id) or ""
+
+    def get_record(self, msg_id: str):
+        if self.db is None:
+            raise RuntimeError("JsonStore 未加载 records：需要 get_record 时用 open_store(load_records=True)")
+        records = self.db["records"]
+        return records.peek(msg_id) if isinstance(records, LazyRecords) else records.get(msg_id)
+
+    def _dirty(self, line: str = None) -> None:
+        with self._lock:
+            if line is not None:
+                self._pending_lines.append(line)
+            else:
+                self._state_dirty = True
+            pending = len(self._pending_lines)
+        if self.autoflush:
+            self.flush()
+        elif self.on_dirty is not None:
+            self.on_dirty(pending)
+
+    def upsert_record(self, record: dict) -> None:
+        with self._lock:
+            record["status"] = "ok"
+            self.index.add(record)
+            line = db_log_line({"op": "put", "record": record})
+        self._dirty(line)
+
+    def update_attachment_local_path(self, msg_id: str, url: str, local_path: str) -> bool:
+        """
+        只要问答在库里就记一条 att op；url / fileId 的匹配留给日志回放（匹配不上就是空操作）。
+        """
+        with self._lock:
+            ok = msg_id in self.index
+        if ok:
+            self._dirty(db_log_line({"op": "att", "id": msg_id, "url": url, "local_path": local_path}))
+        return ok
+
+    def add_failed(self, kind: str, item) -> None:
+        with self._lock:
+            self.state[kind].add(item)
+
+    def discard_failed(self, kind: str, item) -> None:
+        with self._lock:
+            self.state[kind].discard(item)
+        self._dirty()
+
+    def list_failed(self, kind: str) -> list:
+        with self._lock:
+            return self.state[kind].to_list()
+
+    def failed_count(self, kind: str) -> int:
+        return len(self.state[kind])
+
+    def save_state(self) -> None:
+        self._dirty()
+
+    def flush(self) -> None:
+        """ 把缓冲的日志行追加到 qa_db.log.jsonl，state 脏了就重写 crawl_state.json。 """
+        with self._flush_lock:
+            with self._lock:
+                lines, self._pending_lines = self._pending_lines, []
+                st = None
+                if self._state_dirty:
+                    st = {k: (v.to_list() if isinstance(v, FailureSet) else v) for k, v in dict(self.state).items()}
+                    self._state_dirty = False
+
+            try:
+                # 先写记录再写 state：next_page 永远不会跑到已落盘记录的前面
+                if lines:
+                    append_db_log_lines(self.db_path, lines, fsync=FLUSH_FSYNC)
+                if st is not None:
+                    save_state_atomic(self.state_path, st, fsync=FLUSH_FSYNC)
+                    self.state["last_saved_at"] = st["last_saved_at"]
+            except Exception:
+                # 放回缓冲，下次重试（日志回放幂等，重复追加无害）
+                with self._lock:
+                    self._pending_lines[:0] = lines
+                    if st is not None:
+                        self._state_dirty = True
+                raise
+
+            maybe_compact_db(self.db_path)
+
+    def close(self) -> None:
+        with self._lock:
+            self._state_dirty = True
+        self.flush()
+        if self.db is not None and isinstance(self.db["records"], LazyRecords):
+            self.db["records"].close()
+
+
+def open_store(load_records: bool = False):
+    if STORAGE_BACKEND == "sqlite":
+        from sqlite_store import SqliteStore
+        return SqliteStore(SQLITE_FILE, json_db_path=DB_FILE, json_state_path=STATE_FILE)
+    return JsonStore(DB_FILE, STATE_FILE, load_records=load_records)
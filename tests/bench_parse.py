@@ -0,0 +1,60 @@
+# tests/bench_parse.py
+"""
+详情页解析的微基准：tests/fixtures/detail_*.html 上对比旧的逐标签 XPath（parse_legacy）
+和单次遍历的 extract_th_values。不是测试用例，pytest 不会收集。
+
+    python tests/bench_parse.py [次数]
+"""
+import sys
+import timeit
+from pathlib import Path
+
+HERE = Path(__file__).resolve().parent
+for p in (HERE, HERE.parent / "crawler"):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+from lxml import html as lxml_html  # noqa: E402
+
+import parse  # noqa: E402
+import parse_legacy  # noqa: E402
+
+
+def best_of(fn, number: int, repeat: int = 5) -> float:
+    """ 每次调用的最短平均耗时（微秒） """
+    return min(timeit.repeat(fn, number=number, repeat=repeat)) / number * 1e6
+
+
+def main(number: int = 2000) -> None:
+    pages = [p.read_text(encoding="utf-8") for p in sorted((HERE / "fixtures").glob("detail_*.html"))]
+    trees = [lxml_html.fromstring(page) for page in pages]
+
+    def legacy_th():
+        for tree in trees:
+            for label in parse.TH_LABELS:
+                parse_legacy.extract_by_th_label(tree, label)
+
+    def single_pass_th():
+        for tree in trees:
+            parse.extract_th_values(tree)
+
+    def legacy_detail():
+        for page in pages:
+            parse_legacy.parse_detail(page)
+
+    def new_detail():
+        for page in pages:
+            parse.parse_detail(page)
+
+    print(f"{len(pages)} 个页面，每项跑 {number} 次取 5 轮最好成绩；单位：解析全部页面一遍的 µs")
+    for name, old, new in (
+        ("tabform 四个字段", legacy_th, single_pass_th),
+        ("parse_detail 全部", legacy_detail, new_detail),
+    ):
+        t_old = best_of(old, number)
+        t_new = best_of(new, number)
+        print(f"  {name:<16} 旧 {t_old:8.1f}   新 {t_new:8.1f}   ×{t_old / t_new:.2f}")
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,56 @@
+# tests/conftest.py
+"""
+crawler/ 里的模块按脚本方式互相导入（from config import ...），测试时把 crawler/ 放进 sys.path；
+viewer 按包导入（viewer.backend.app），需要项目根目录。
+
+    python -m pytest -q
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parents[1]
+for p in (ROOT, ROOT / "crawler"):
+    if str(p) not in sys.path:
+        sys.path.insert(0, str(p))
+
+
+@pytest.fixture
+def viewer_data(tmp_path, monkeypatch):
+    """
+    viewer 的数据文件全部指到临时目录（不读仓库里的 data/、attachments/），
+    文件缓存 / 搜索索引 / 事件尾巴换成新的，测试之间不串。返回 viewer.backend.app 模块
+    """
+    from viewer.backend import app as viewer
+    from viewer.backend.events import EventTail
+    from viewer.backend.search import SearchIndex
+
+    data, att = tmp_path / "data", tmp_path / "attachments"
+    data.mkdir()
+    att.mkdir()
+    monkeypatch.delenv("VIEWER_STORAGE", raising=False)
+    for name, value in {
+        "DATA_DIR": data,
+        "ATT_DIR": att,
+        "BLOB_DIR": att / "_blobs",
+        "STATE_PATH": data / "crawl_state.json",
+        "QA_PATH": data / "qa_db.json",
+        "ATT_MANIFEST_PATH": data / "attachments_manifest.jsonl",
+        "QA_LOG_PATHS": [data / "qa_db.log.jsonl.compacting", data / "qa_db.log.jsonl"],
+        "QA_INDEX_PATH": data / "qa_db.ids.tsv",
+        "EVENTS_PATH": data / "crawl_events.jsonl",
+        "SQLITE_PATH": data / "crawl.sqlite3",
+        "search_index": SearchIndex(data / "viewer_search.sqlite3"),
+        "event_tail": EventTail(data / "crawl_events.jsonl"),
+        "_snapshot": None,
+        "_pending_since": None,
+        "_qa_replay": None,
+        "_att_manifest": None,
+        "_failed_index": None,
+    }.items():
+        monkeypatch.setattr(viewer, name, value)
+    for name in ("qa_cache", "state_cache", "att_cache"):
+        cache = getattr(viewer, name)
+        monkeypatch.setattr(viewer, name, viewer.FileCache(cache.name, cache.paths, cache.loader))
+    return viewer
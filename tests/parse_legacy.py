@@ -0,0 +1,64 @@
+# tests/parse_legacy.py
+"""
+改成单次遍历（extract_th_values）之前的 tabform 解析，原样保留，
+只给 test_parse.py 做结果对照、bench_parse.py 做速度对照。
+"""
+from lxml import html as lxml_html
+
+from parse import extract_attachments_from_script, extract_leave_time, extract_nsrssd_from_script, extract_title
+
+
+def extract_by_th_label(tree, label: str) -> str:
+    tables = tree.xpath("//table[contains(@class, 'tabform')]")
+    if not tables:
+        return ""
+    table = tables[0]
+
+    tr_list = table.xpath(".//tr[th[contains(normalize-space(.), $label)]]", label=label)
+    if not tr_list:
+        return ""
+
+    tr = tr_list[0]
+
+    texts = tr.xpath(".//td//textarea//text()")
+    texts = [t.strip() for t in texts if t.strip()]
+    if texts:
+        return "\n".join(texts)
+
+    inputs = tr.xpath(".//td//input/@value")
+    inputs = [t.strip() for t in inputs if t.strip()]
+    if inputs:
+        return inputs[0]
+
+    texts = tr.xpath(".//td//text()")
+    texts = [t.strip() for t in texts if t.strip()]
+    if texts:
+        return "\n".join(texts)
+
+    return ""
+
+
+def parse_detail(html_text: str) -> dict:
+    tree = lxml_html.fromstring(html_text)
+
+    title = extract_title(tree)
+    leave_time = extract_leave_time(tree)
+    nsrssd = extract_nsrssd_from_script(html_text)
+
+    question_text = extract_by_th_label(tree, "问题内容")
+    answer_text = extract_by_th_label(tree, "答复内容")
+    reply_org = extract_by_th_label(tree, "答复机构")
+    reply_time = extract_by_th_label(tree, "答复时间")
+
+    attachments = extract_attachments_from_script(html_text)
+
+    return {
+        "标题": title,
+        "留言时间": leave_time,
+        "纳税人所属地": nsrssd,
+        "答复时间": reply_time,
+        "问题内容": question_text,
+        "答复内容": answer_text,
+        "答复机构": reply_org,
+        "附件": attachments,
+    }
@@ -0,0 +1,132 @@
+# tests/test_download.py
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import pytest
+import requests
+
+import download
+import events
+import net
+from download import download_one_attachment, load_manifest, rebuild_manifest
+
+CRAWLER_DIR = Path(download.__file__).resolve().parent
+
+# 另一个进程（相当于正在跑的 main.py）往同一份清单追加一行
+APPEND = """
+import sys
+sys.path.insert(0, {crawler!r})
+from pathlib import Path
+import download
+download.ATTACH_MANIFEST_FILE = Path({path!r})
+download._manifest, download._by_file_id = {{}}, {{}}
+download.record_manifest({{"path": "m2/late.pdf", "msg_id": "m2", "fileId": "late", "size": 3, "sha256": "x"}})
+"""
+
+
+def test_append_from_other_process_during_rebuild_is_kept(tmp_path, monkeypatch):
+    root = tmp_path / "attachments"
+    for rel in ("m1/a.pdf", "m2/late.pdf"):
+        (root / rel).parent.mkdir(parents=True, exist_ok=True)
+        (root / rel).write_bytes(b"abc")
+    manifest = tmp_path / "attachments_manifest.jsonl"
+    manifest.write_text(json.dumps({"path": "m1/a.pdf", "msg_id": "m1", "size": 3, "sha256": "y"}) + "\n",
+                        encoding="utf-8")
+
+    copy = download.shutil.copyfileobj
+    procs = []
+
+    def copy_then_append(src, dst):
+        # 接完尾巴、替换之前，另一个进程来追加：必须等到替换之后写进新文件
+        copy(src, dst)
+        procs.append(subprocess.Popen([sys.executable, "-c", APPEND.format(crawler=str(CRAWLER_DIR), path=str(manifest))]))
+        time.sleep(1.0)
+
+    monkeypatch.setattr(download.shutil, "copyfileobj", copy_then_append)
+    rebuild_manifest(root, manifest)
+    assert procs[0].wait(timeout=30) == 0
+
+    entries = load_manifest(manifest)
+    assert set(entries) == {"m1/a.pdf", "m2/late.pdf"}
+    assert entries["m2/late.pdf"]["sha256"] == "x"
+
+
+class FakeResponse:
+    def __init__(self, status: int, body: bytes = b"", headers: dict = None, break_after: int = None):
+        self.status_code = status
+        self.headers = {"Content-Type": "application/octet-stream", "Content-Length": str(len(body)), **(headers or {})}
+        self.url = "https://example.com/download?fileId=F1"
+        self.body = body
+        self.break_after = break_after
+
+    def iter_content(self, chunk_size):
+        yield self.body[:self.break_after]
+        if self.break_after is not None:
+            raise requests.exceptions.ChunkedEncodingError("connection reset")
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(str(self.status_code), response=self)
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class FakeSession:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+        self.headers = {}
+
+    def request(self, method, url, **kwargs):
+        self.calls.append(kwargs.get("headers", {}).get("Range"))
+        return self.responses.pop(0)
+
+
+@pytest.fixture
+def attach_env(tmp_path, monkeypatch):
+    monkeypatch.setattr(download, "ATTACH_DIR", tmp_path / "attachments")
+    monkeypatch.setattr(download, "ATTACH_BLOB_DIR", tmp_path / "attachments" / "_blobs")
+    monkeypatch.setattr(download, "ATTACH_MANIFEST_FILE", tmp_path / "attachments_manifest.jsonl")
+    monkeypatch.setattr(download, "_manifest", {})
+    monkeypatch.setattr(download, "_by_file_id", {})
+    monkeypatch.setattr(events, "EVENTS_FILE", None)
+    sleeps = []
+    monkeypatch.setattr(net, "backoff_sleep", sleeps.append)
+    monkeypatch.setattr(download, "backoff_sleep", sleeps.append)
+    return sleeps
+
+
+def fetch(session):
+    att = {"url": "https://example.com/download?fileId=F1", "标题": "a.pdf", "fileId": "F1"}
+    return download_one_attachment(FakeSession([]), net.RateLimiter(6000, endpoint_rpm={}), {}, "m1", att, session)
+
+
+def test_failing_attachment_costs_at_most_max_retries_requests(attach_env):
+    session = FakeSession([FakeResponse(503) for _ in range(download.MAX_RETRIES ** 2)])
+    with pytest.raises(requests.HTTPError):
+        fetch(session)
+    assert len(session.calls) == download.MAX_RETRIES
+    # 退避只在两次请求之间，最后一次失败后不再等
+    assert attach_env == list(range(1, download.MAX_RETRIES))
+
+
+def test_broken_stream_resumes_with_range(attach_env):
+    body = bytes(range(256)) * 4
+    session = FakeSession([
+        FakeResponse(200, body, break_after=300),
+        FakeResponse(206, body[300:], {"Content-Range": f"bytes 300-{len(body) - 1}/{len(body)}"}),
+    ])
+    path = Path(fetch(session))
+    assert path.read_bytes() == body
+    assert session.calls == [None, "bytes=300-"]
+    assert attach_env == [1]
@@ -0,0 +1,161 @@
+# tests/test_engine.py
+from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
+
+import pytest
+
+import events
+import stages
+from engine import Attachment, Detail, Engine, ListPage, Source, Stage
+from stages import DetailStage
+
+
+class MemoryStore:
+    def __init__(self):
+        self.state = {}
+        self.records = {}
+        self.failed = {"failed_ids": set()}
+
+    def has_record(self, msg_id) -> bool:
+        return msg_id in self.records
+
+    def upsert_record(self, record) -> None:
+        self.records[record["id"]] = record
+
+    def add_failed(self, kind, item) -> None:
+        self.failed.setdefault(kind, set()).add(item)
+
+    def discard_failed(self, kind, item) -> None:
+        self.failed.setdefault(kind, set()).discard(item)
+
+    def save_state(self) -> None:
+        pass
+
+
+class OnePage(Source):
+    def __init__(self):
+        self.done = []
+
+    def page_done(self, engine, page, info) -> None:
+        # 页完成时，页里的详情必须都已经处理过（入库或用完重试次数）
+        self.done.append((page, sorted(engine.store.records)))
+
+
+@pytest.fixture
+def no_events(monkeypatch):
+    monkeypatch.setattr(events, "EVENTS_FILE", None)
+
+
+def test_retried_detail_does_not_close_page_early(monkeypatch, no_events):
+    calls = []
+
+    def fake_fetch(session, att_session, parser, archive, rate, state, msg_id):
+        calls.append(msg_id)
+        result = {"id": msg_id, "record": {"id": msg_id}, "error": None,
+                  "null_attachment": False, "failed_attachments": []}
+        if msg_id == "b" and calls.count("b") == 1:
+            result["error"] = RuntimeError("timeout")
+        return result
+
+    monkeypatch.setattr(stages, "fetch_message", fake_fetch)
+
+    store = MemoryStore()
+    source = OnePage()
+    with ThreadPoolExecutor(1) as pool:
+        # 串行 + 重试立即可执行且优先：a、b（失败）、b 重试、c
+        engine = Engine(store, pool, {Detail: DetailStage(None, None, None, None, None, {})}, source,
+                        concurrency=1, retry_ratio=1.0, max_attempts=2, retry_delay=0)
+        engine.open_page(1, {"pageSet": []}, ["a", "b", "c"])
+        engine.run()
+
+    assert calls == ["a", "b", "b", "c"]
+    assert source.done == [(1, ["a", "b", "c"])]
+    assert store.failed["failed_ids"] == set()
+    assert engine.active_ids == set()
+    assert engine.retry_ids == set()
+
+
+def test_detail_waiting_for_retry_stays_active(no_events):
+    store = MemoryStore()
+    engine = Engine(store, None, {}, Source(), retry_delay=60)
+    engine.open_page(1, {"pageSet": []}, ["a"])
+    work = engine._next_work()
+
+    engine.fail(work, "failed_ids", "a", RuntimeError("timeout"))
+    engine.detail_done(work.item)
+
+    # 页已完成，但 a 还在 retry 队列里：下一页列出同一个 id 不能再排一次
+    assert 1 not in engine.pages
+    assert "a" in engine.active_ids
+    retry = engine._retry[0][2]
+    assert retry.item == Detail("a", None)
+    assert retry.attempt == 2
+
+
+def drain(engine: Engine) -> list:
+    out = []
+    while (work := engine._next_work()) is not None:
+        out.append(work.item)
+    return out
+
+
+@pytest.mark.parametrize("ratio, expected", [
+    # 每 2 次调度给重试一次
+    (0.5, ["f0", "r0", "f1", "r1", "f2", "f3"]),
+    # 只在没有 fresh 工作时才重试
+    (0, ["f0", "f1", "f2", "f3", "r0", "r1"]),
+])
+def test_retries_interleave_with_fresh_work(ratio, expected):
+    engine = Engine(MemoryStore(), None, {}, Source(), retry_ratio=ratio)
+    for i in range(2):
+        engine.push_retry(Detail(f"r{i}"))
+    for i in range(4):
+        engine.push(Detail(f"f{i}"))
+    assert [item.msg_id for item in drain(engine)] == expected
+    assert engine.retry_ids == set()
+
+
+def test_fresh_work_by_type_priority():
+    engine = Engine(MemoryStore(), None, {}, Source())
+    engine.push(ListPage(2))
+    engine.push(Attachment("a", "u"))
+    engine.push(Detail("d"))
+    assert drain(engine) == [Detail("d"), Attachment("a", "u"), ListPage(2)]
+
+
+class Ping(NamedTuple):
+    """ 引擎不认识的 work item 类型：只要 stages 里有对应的 Stage 就能跑 """
+    n: int = 0
+
+
+class FlakyStage(Stage):
+    def __init__(self, failures: int):
+        self.failures = failures
+        self.runs = 0
+
+    def run(self, item):
+        self.runs += 1
+        if self.runs <= self.failures:
+            raise RuntimeError("boom")
+        return "pong"
+
+    def commit(self, engine, work, outcome) -> None:
+        if isinstance(outcome, Exception):
+            engine.fail(work, "failed_pings", work.item, outcome)
+        else:
+            engine.resolve(work, "failed_pings", work.item)
+
+
+@pytest.mark.parametrize("failures, left", [(1, set()), (5, {Ping()})])
+def test_pluggable_stage_retries_until_max_attempts(no_events, failures, left):
+    store = MemoryStore()
+    stage = FlakyStage(failures)
+    with ThreadPoolExecutor(2) as pool:
+        engine = Engine(store, pool, {Ping: stage}, Source(), max_attempts=3, retry_delay=0)
+        engine.push(Ping())
+        engine.run()
+
+    # 重试成功就移出 failed_*；用完次数的留给下次运行
+    assert stage.runs == min(failures + 1, 3)
+    assert store.failed["failed_pings"] == left
+    assert engine.stats()["retried"] == {"Ping": stage.runs - 1}
@@ -0,0 +1,105 @@
+# tests/test_net.py
+import asyncio
+import threading
+import time
+
+import pytest
+
+import net
+from net import CrawlStopped, backoff_sleep, maybe_cooldown, request_stop
+
+
+@pytest.fixture
+def stop_reset():
+    yield
+    net._stop.clear()
+
+
+def run_in_thread(fn):
+    out = {}
+
+    def target():
+        try:
+            fn()
+        except BaseException as e:
+            out["error"] = e
+
+    t = threading.Thread(target=target, daemon=True)
+    t.start()
+    return t, out
+
+
+@pytest.mark.parametrize("wait", [
+    lambda: maybe_cooldown({"cooldown_until": time.time() + 20 * 60}),
+    lambda: backoff_sleep(3),
+])
+def test_request_stop_interrupts_waits(stop_reset, wait):
+    t, out = run_in_thread(wait)
+    time.sleep(0.2)
+    assert t.is_alive()
+
+    t0 = time.monotonic()
+    request_stop()
+    t.join(timeout=2)
+    assert not t.is_alive()
+    assert time.monotonic() - t0 < 1
+    assert isinstance(out.get("error"), CrawlStopped)
+
+
+def test_no_new_requests_after_stop(stop_reset):
+    rate = net.RateLimiter(30)
+    request_stop()
+    with pytest.raises(CrawlStopped):
+        rate.wait("list")
+
+
+def test_adaptive_rate_never_exceeds_target(monkeypatch):
+    monkeypatch.setattr(net, "RPM_INCREASE_EVERY", 1)
+    rate = net.RateLimiter(30, adaptive=True)
+    for _ in range(100):
+        rate.on_success()
+        assert rate.current_rpm <= 30
+    assert rate.current_rpm == 30
+
+    rate._last_cut -= 60
+    assert rate.on_blocked()
+    assert rate.current_rpm == 15
+    for _ in range(100):
+        rate.on_success()
+        assert rate.current_rpm <= 30
+    assert rate.current_rpm == 30
+
+
+def test_block_at_min_rpm_falls_back_to_cooldown():
+    rate = net.RateLimiter(12, adaptive=True)
+    assert rate.on_blocked()
+    assert rate.current_rpm == rate.min_rpm
+    # 刚降过速（10s 窗口内）又被拦：已经没得降了，必须交给整体冷却
+    assert not rate.on_blocked()
+    assert rate.stats()["blocked"] == 2
+
+
+def test_wait_async_shares_budget_with_threads(stop_reset):
+    rate = net.RateLimiter(600, burst=1, endpoint_rpm={})
+
+    async def three():
+        t0 = time.monotonic()
+        await asyncio.gather(*(rate.wait_async() for _ in range(3)))
+        return time.monotonic() - t0
+
+    # 600 rpm = 0.1s 一个：第一个立即放行，后两个依次等
+    assert asyncio.run(three()) >= 0.2
+
+
+def test_wait_async_stops(stop_reset):
+    rate = net.RateLimiter(1, burst=1, endpoint_rpm={})
+    rate.reserve()
+
+    async def waiter():
+        asyncio.get_running_loop().call_later(0.2, request_stop)
+        await rate.wait_async()
+
+    t0 = time.monotonic()
+    with pytest.raises(CrawlStopped):
+        asyncio.run(waiter())
+    assert time.monotonic() - t0 < 2
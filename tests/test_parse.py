@@ -0,0 +1,58 @@
+# tests/test_parse.py
+from pathlib import Path
+
+import pytest
+from lxml import html as lxml_html
+
+import parse
+import parse_legacy
+
+FIXTURE_DIR = Path(__file__).parent / "fixtures"
+FIXTURES = sorted(FIXTURE_DIR.glob("detail_*.html"))
+# 除了 parse_detail 用到的四个，再加几个会命中多行 / 同一行 / 不命中的标签
+LABELS = parse.TH_LABELS + ("内容", "时间", "答复", "留言信息", "补充答复内容", "不存在")
+
+
+def load(name: str) -> str:
+    return (FIXTURE_DIR / name).read_text(encoding="utf-8")
+
+
+@pytest.fixture(params=FIXTURES, ids=lambda p: p.stem)
+def page(request):
+    return request.param.read_text(encoding="utf-8")
+
+
+def test_parse_detail_matches_legacy(page):
+    assert parse.parse_detail(page) == parse_legacy.parse_detail(page)
+
+
+def test_th_values_match_per_label_lookup(page):
+    tree = lxml_html.fromstring(page)
+    expected = {label: parse_legacy.extract_by_th_label(tree, label) for label in LABELS}
+    assert parse.extract_th_values(tree, LABELS) == expected
+    for label in LABELS:
+        assert parse.extract_by_th_label(tree, label) == expected[label]
+
+
+def test_fixture_values():
+    # 对照之外再钉住几个具体值，防止两边一起错
+    textarea = parse.parse_detail(load("detail_textarea.html"))
+    assert textarea["答复机构"] == "国家税务总局北京市税务局"
+    assert textarea["答复时间"] == "2024-03-20"
+    assert textarea["问题内容"].startswith("您好：\n    我公司为小规模纳税人")
+
+    plain = parse.parse_detail(load("detail_plain_td.html"))
+    assert plain["纳税人所属地"] == "黑龙江"
+    assert plain["问题内容"] == "我在哈尔滨工作，\n社保在\n大庆\n缴纳。\n请问个税在哪里申报？"
+    assert plain["答复时间"] == "2023-11-06"
+    assert [a["fileId"] for a in plain["附件"]] == ["8a8b1c2d3e4f", "9f9e8d7c"]
+
+    unanswered = parse.parse_detail(load("detail_unanswered.html"))
+    assert unanswered["问题内容"] == "办理出口退税备案需要哪些材料？"
+    assert unanswered["答复内容"] == ""
+
+    nested = lxml_html.fromstring(load("detail_nested.html"))
+    values = parse.extract_th_values(nested)
+    assert values["问题内容"] == "嵌套表格里的问题内容"
+    assert values["答复机构"] == values["答复时间"] == "同一行两个 th"
+    assert values["答复内容"] == ""
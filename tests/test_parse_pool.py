@@ -0,0 +1,25 @@
+# tests/test_parse_pool.py
+from pathlib import Path
+
+import parse
+from parse_pool import ParsePool
+
+PAGE = (Path(__file__).parent / "fixtures" / "detail_textarea.html").read_text(encoding="utf-8")
+
+
+def test_subprocess_parse_matches_inline():
+    pool = ParsePool(workers=1)
+    try:
+        assert pool.parse(PAGE) == parse.parse_detail(PAGE)
+        stats = pool.stats()
+    finally:
+        pool.close()
+    assert stats["parsed"] == 1
+    assert stats["pending"] == 0
+    assert stats["waited_seconds"] > 0
+
+
+def test_no_workers_parses_inline():
+    pool = ParsePool(workers=0)
+    assert pool.parse(PAGE) == parse.parse_detail(PAGE)
+    assert pool.stats()["parsed"] == 0
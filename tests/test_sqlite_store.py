@@ -0,0 +1,80 @@
+# tests/test_sqlite_store.py
+import json
+
+import pytest
+
+import sqlite_store
+from sqlite_store import SqliteStore
+
+
+def write_json_store(tmp_path, n: int = 3):
+    db_path, state_path = tmp_path / "qa_db.json", tmp_path / "crawl_state.json"
+    records = {f"m{i}": {"id": f"m{i}", "标题": f"t{i}", "问题内容": "q" * i} for i in range(n)}
+    db_path.write_text(json.dumps({"meta": {"count": n}, "records": records}, ensure_ascii=False), encoding="utf-8")
+    state_path.write_text(json.dumps({"next_page": 7, "failed_ids": ["x1"]}), encoding="utf-8")
+    return db_path, state_path
+
+
+def test_failed_import_is_rolled_back_and_retried(tmp_path, monkeypatch):
+    db_path, state_path = write_json_store(tmp_path)
+    sqlite_path = tmp_path / "crawl.sqlite3"
+
+    write_record = SqliteStore._write_record
+    calls = []
+
+    def flaky(self, record):
+        calls.append(record["id"])
+        if len(calls) == 2:
+            raise sqlite_store.sqlite3.OperationalError("disk I/O error")
+        write_record(self, record)
+
+    monkeypatch.setattr(SqliteStore, "_write_record", flaky)
+    with pytest.raises(sqlite_store.sqlite3.OperationalError):
+        SqliteStore(sqlite_path, json_db_path=db_path, json_state_path=state_path)
+    monkeypatch.setattr(SqliteStore, "_write_record", write_record)
+
+    # 库文件已经存在，但导入没完成：重新打开时再导一次
+    store = SqliteStore(sqlite_path, json_db_path=db_path, json_state_path=state_path)
+    try:
+        assert store.meta["count"] == 3
+        assert store.state["next_page"] == 7
+        assert store.list_failed("failed_ids") == ["x1"]
+    finally:
+        store.close()
+
+
+def test_import_runs_once(tmp_path):
+    db_path, state_path = write_json_store(tmp_path)
+    sqlite_path = tmp_path / "crawl.sqlite3"
+    SqliteStore(sqlite_path, json_db_path=db_path, json_state_path=state_path).close()
+
+    # JSON 之后又变了：已导入的库不再重新导入
+    write_json_store(tmp_path, n=5)
+    store = SqliteStore(sqlite_path, json_db_path=db_path, json_state_path=state_path)
+    try:
+        assert store.meta["count"] == 3
+    finally:
+        store.close()
+
+
+def test_record_stays_visible_while_its_batch_commits(tmp_path, monkeypatch):
+    store = SqliteStore(tmp_path / "crawl.sqlite3")
+    store.autoflush = False
+    write_record = SqliteStore._write_record
+    seen = []
+
+    def checking(self, record):
+        write_record(self, record)
+        # 已经移出缓冲、还没 COMMIT：读连接看不到，但抓取线程不能因此再抓一遍
+        seen.append((store.has_record(record["id"]), store.leave_time(record["id"]),
+                     (store.get_record(record["id"]) or {}).get("id")))
+
+    monkeypatch.setattr(SqliteStore, "_write_record", checking)
+    try:
+        store.upsert_record({"id": "m1", "留言时间": "2024-05-01"})
+        store.flush()
+        assert seen == [(True, "2024-05-01", "m1")]
+        assert store.has_record("m1")
+        assert store._flushing_records == {}
+    finally:
+        store.close()
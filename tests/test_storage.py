@@ -0,0 +1,157 @@
+# tests/test_storage.py
+import json
+
+from dblog import apply_db_op, empty_meta, parse_db_log_line
+import pytest
+
+from storage import (
+    IdIndex, JsonStore, LazyRecords,
+    append_db_log_lines, compact_db, db_compacting_log_path, db_index_path, db_log_line, db_log_path,
+    load_db, load_db_snapshot, load_id_index, read_id_index, save_db_atomic, save_id_index,
+)
+
+
+def put(rid: str, **fields) -> str:
+    return db_log_line({"op": "put", "record": {"id": rid, **fields}})
+
+
+def test_append_after_torn_line_keeps_next_record(tmp_path):
+    db_path = tmp_path / "qa_db.json"
+    log = db_log_path(db_path)
+    append_db_log_lines(db_path, [put("a")])
+    # 写到一半崩溃：最后一行没有换行
+    with log.open("ab") as f:
+        f.write(put("b").encode("utf-8")[:15])
+
+    append_db_log_lines(db_path, [put("c"), put("d")])
+
+    db = load_db(db_path)
+    assert list(db["records"]) == ["a", "c", "d"]
+    assert db["meta"]["count"] == 3
+    assert log.read_bytes().endswith(b"\n")
+
+
+def test_att_op_falls_back_to_file_id():
+    db = {"meta": empty_meta(), "records": {}}
+    att = {"标题": "附件", "url": "https://example.com/download?fileId=F1&x=1", "fileId": "F1"}
+    apply_db_op(db, {"op": "put", "record": {"id": "m1", "附件": [att]}})
+
+    # url 变了（签名参数不同）：按 fileId 找到同一个附件
+    line = json.dumps({"op": "att", "id": "m1", "url": "https://example.com/dl?fileId=F1", "local_path": "m1/F1.pdf"})
+    assert apply_db_op(db, parse_db_log_line(line))
+    assert db["records"]["m1"]["附件"][0]["local_path"] == "m1/F1.pdf"
+
+
+def test_parse_db_log_line_skips_partial_lines():
+    assert parse_db_log_line('{"op": "put", "rec') is None
+    assert parse_db_log_line("\n") is None
+
+
+def make_records(n: int = 3) -> dict:
+    return {f"m{i}": {"id": f"m{i}", "留言时间": f"2024-01-0{i + 1}"} for i in range(n)}
+
+
+def write_snapshot(db_path, records: dict) -> None:
+    db = {"meta": {**empty_meta(), "count": len(records)}, "records": records}
+    save_id_index(db_path, IdIndex.from_db(db, save_db_atomic(db_path, db)))
+
+
+def test_id_index_rebuilt_once_from_old_snapshot(tmp_path):
+    db_path = tmp_path / "qa_db.json"
+    # 旧版 indent=2 快照，没有 ids.tsv
+    db_path.write_text(json.dumps({"meta": {**empty_meta(), "count": 3}, "records": make_records()}, indent=2),
+                       encoding="utf-8")
+
+    index = load_id_index(db_path)
+    assert index.times == {"m0": "2024-01-01", "m1": "2024-01-02", "m2": "2024-01-03"}
+    assert index.meta["newest_leave_time"] == "2024-01-03"
+    assert index.offsets is None
+    # 快照改写成逐行格式（仍是合法 JSON），索引与之对得上
+    assert json.loads(db_path.read_text(encoding="utf-8"))["records"] == make_records()
+    assert db_index_path(db_path).exists()
+    assert read_id_index(db_path).times == index.times
+
+
+def test_stale_id_index_is_ignored(tmp_path):
+    db_path = tmp_path / "qa_db.json"
+    write_snapshot(db_path, make_records())
+    assert read_id_index(db_path) is not None
+
+    # 快照换了、索引还是旧的（写完快照还没写索引就崩溃）
+    with db_path.open("ab") as f:
+        f.write(b"\n")
+    assert read_id_index(db_path) is None
+
+
+def test_store_without_records_uses_index_and_log(tmp_path):
+    db_path = tmp_path / "qa_db.json"
+    write_snapshot(db_path, make_records())
+    append_db_log_lines(db_path, [put("m1", 留言时间="2024-02-01"), put("m9", 留言时间="2024-01-09")])
+
+    store = JsonStore(db_path, tmp_path / "state.json")
+    assert store.db is None
+    assert store.has_record("m0") and store.has_record("m9")
+    assert not store.has_record("m5")
+    assert store.leave_time("m1") == "2024-02-01"
+    assert store.leave_time("m5") == ""
+    assert store.meta["count"] == 4
+    assert store.meta["newest_leave_time"] == "2024-02-01"
+    with pytest.raises(RuntimeError):
+        store.get_record("m0")
+    store.close()
+
+
+def test_reparse_reads_do_not_cache_records(tmp_path):
+    db_path = tmp_path / "qa_db.json"
+    write_snapshot(db_path, make_records())
+
+    store = JsonStore(db_path, tmp_path / "state.json", load_records=True)
+    records = store.db["records"]
+    assert isinstance(records, LazyRecords)
+    # reparse 的顺序：读旧记录，再覆盖写入
+    for rid in ["m0", "m1", "m2"]:
+        assert store.get_record(rid)["id"] == rid
+        store.upsert_record({"id": rid, "留言时间": "2024-02-01"})
+    assert records._cache == {}
+    assert store.leave_time("m1") == "2024-02-01"
+    store.close()
+
+    assert load_db(db_path)["records"]["m1"]["留言时间"] == "2024-02-01"
+
+
+def test_snapshot_decodes_records_on_access(tmp_path):
+    db_path = tmp_path / "qa_db.json"
+    write_snapshot(db_path, make_records())
+
+    records = load_db_snapshot(db_path)["records"]
+    assert isinstance(records, LazyRecords)
+    assert list(records) == ["m0", "m1", "m2"]
+    assert records._cache == {}
+    # 全量遍历不缓存；按 id 取才缓存（调用方可能就地改）
+    assert list(records.values()) == list(make_records().values())
+    assert records._cache == {}
+    assert records["m1"] == make_records()["m1"]
+    assert list(records._cache) == ["m1"]
+    records.close()
+
+
+def test_compaction_copies_untouched_records(tmp_path, monkeypatch):
+    db_path = tmp_path / "qa_db.json"
+    write_snapshot(db_path, make_records())
+    before = load_db_snapshot(db_path)["records"]
+    raw_m0 = before.raw("m0")
+    before.close()
+
+    append_db_log_lines(db_path, [put("m1", 留言时间="2024-02-01")])
+    db_log_path(db_path).replace(db_compacting_log_path(db_path))
+    decoded = []
+    decode = LazyRecords._decode
+    monkeypatch.setattr(LazyRecords, "_decode", lambda self, rid: decoded.append(rid) or decode(self, rid))
+    compact_db(db_path)
+    assert decoded == []
+
+    after = load_db_snapshot(db_path)["records"]
+    assert isinstance(after, LazyRecords)
+    assert after.raw("m0") == raw_m0
+    assert after["m1"]["留言时间"] == "2024-02-01"
+    after.close()
@@ -0,0 +1,109 @@
+# tests/test_viewer_events.py
+import asyncio
+import json
+import threading
+
+import pytest
+
+import events as crawler_events
+from viewer.backend import events
+from viewer.backend.events import EventTail, parse_event_id, sse_stream
+
+
+def line(n: int) -> bytes:
+    return json.dumps({"type": "record", "id": f"m{n}"}).encode("utf-8") + b"\n"
+
+
+def append(tail: EventTail, data: bytes) -> None:
+    with tail.path.open("ab") as f:
+        f.write(data)
+
+
+def ids(tail: EventTail, seq: int = 0) -> list:
+    return [json.loads(raw)["id"] for _, raw in tail.since(seq)]
+
+
+@pytest.fixture
+def tail(tmp_path):
+    path = tmp_path / "crawl_events.jsonl"
+    path.write_bytes(line(0))
+    tail = EventTail(path, buffer=4)
+    # 第一次从文件末尾开始：不回放启动前的历史
+    assert tail.poll() == 0
+    return tail
+
+
+def test_tail_reads_only_complete_lines(tail):
+    append(tail, line(1) + line(2)[:5])
+    assert tail.poll() == 1
+    append(tail, line(2)[5:])
+    assert tail.poll() == 2
+    assert ids(tail) == ["m1", "m2"]
+    assert ids(tail, 1) == ["m2"]
+    assert tail.since(2) == []
+
+
+def test_tail_finishes_rotated_file_first(tmp_path, monkeypatch):
+    path = tmp_path / "crawl_events.jsonl"
+    monkeypatch.setattr(crawler_events, "EVENTS_FILE", path)
+    monkeypatch.setattr(crawler_events, "_file", None)
+    crawler_events.emit("record", id="m0")
+    tail = EventTail(path)
+    tail.poll()
+
+    crawler_events.emit("record", id="m1")
+    # 下一条写之前轮转：m1 留在 .1 里还没读
+    monkeypatch.setattr(crawler_events, "EVENTS_MAX_BYTES", 1)
+    crawler_events.emit("record", id="m2")
+    crawler_events.close()
+    assert path.with_name(path.name + ".1").exists()
+    assert tail.poll() == 2
+    assert ids(tail) == ["m1", "m2"]
+
+
+def test_since_reports_gaps(tail):
+    append(tail, b"".join(line(n) for n in range(1, 7)))
+    assert tail.poll() == 6
+    # 缓冲 4 条：1、2 已滚掉
+    assert ids(tail, 2) == ["m3", "m4", "m5", "m6"]
+    assert tail.since(1) is None
+    # 不是这个进程的序号（Viewer 重启过）
+    assert tail.since(99) is None
+
+
+def test_parse_event_id():
+    assert parse_event_id("12") == 12
+    assert parse_event_id("x") == -1
+    assert parse_event_id(None) == -1
+
+
+async def take(stream, n: int) -> list:
+    return [await asyncio.wait_for(stream.__anext__(), 5) for _ in range(n)]
+
+
+def test_sse_resumes_from_last_event_id(tail):
+    append(tail, line(1) + line(2))
+    tail.poll()
+
+    chunks = asyncio.run(take(sse_stream(tail, "1"), 2))
+    assert chunks[0] == b"retry: 3000\n\n"
+    assert chunks[1] == b"id: 2\ndata: " + line(2).rstrip(b"\n") + b"\n\n"
+
+    chunks = asyncio.run(take(sse_stream(tail, "99"), 2))
+    assert chunks[1] == b"event: reset\ndata: {}\n\n"
+
+
+def test_sse_wakes_on_new_event(tail, monkeypatch):
+    monkeypatch.setattr(events, "POLL_SECONDS", 0.01)
+
+    async def run():
+        stream = sse_stream(tail)
+        assert await take(stream, 1) == [b"retry: 3000\n\n"]
+        timer = threading.Timer(0.05, append, (tail, line(1)))
+        timer.start()
+        chunk = (await take(stream, 1))[0]
+        timer.join()
+        await stream.aclose()
+        return chunk
+
+    assert asyncio.run(run()) == b"id: 1\ndata: " + line(1).rstrip(b"\n") + b"\n\n"
@@ -0,0 +1,79 @@
+# tests/test_viewer_http.py
+import json
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from storage import append_db_log_lines, db_log_line
+
+N = 40
+
+
+@pytest.fixture
+def client(viewer_data, monkeypatch):
+    records = {f"m{i}": {"id": f"m{i}", "标题": f"增值税发票问题 {i}", "留言时间": "2024-01-01"} for i in range(N)}
+    viewer_data.QA_PATH.write_text(json.dumps({"meta": {}, "records": records}), encoding="utf-8")
+    monkeypatch.setattr(viewer_data, "kick_search_sync", lambda: "none")
+    # 不进 lifespan：不起预热线程
+    return TestClient(viewer_data.app)
+
+
+def wait_reloaded(cache, old: tuple) -> None:
+    cache.get()
+    deadline = time.monotonic() + 5
+    while cache.version() == old:
+        assert time.monotonic() < deadline, "FileCache 没有重新加载"
+        time.sleep(0.01)
+
+
+def test_unchanged_list_is_304(client):
+    res = client.get("/api/qa")
+    assert res.status_code == 200
+    assert res.headers["cache-control"] == "no-cache"
+    etag = res.headers["etag"]
+    assert etag.startswith('W/"')
+
+    res = client.get("/api/qa", headers={"If-None-Match": etag})
+    assert res.status_code == 304
+    assert res.content == b""
+    assert res.headers["etag"] == etag
+
+    # 查询参数不同是另一个 ETag
+    assert client.get("/api/qa?page=2").headers["etag"] != etag
+
+
+def test_data_change_changes_etag(client, viewer_data):
+    etag = client.get("/api/qa").headers["etag"]
+    old = viewer_data.qa_cache.version()
+    append_db_log_lines(viewer_data.QA_PATH, [db_log_line({"op": "put", "record": {"id": "new", "标题": "新"}})])
+    wait_reloaded(viewer_data.qa_cache, old)
+
+    res = client.get("/api/qa", headers={"If-None-Match": etag})
+    assert res.status_code == 200
+    assert res.headers["etag"] != etag
+    assert res.json()["total"] == N + 1
+
+
+def test_gzip_json_but_not_attachment_files(client, viewer_data):
+    res = client.get("/api/qa", headers={"Accept-Encoding": "gzip"})
+    assert res.headers["content-encoding"] == "gzip"
+    assert res.json()["total"] == N
+    # 中文直接输出 UTF-8（orjson），不转义成 \uXXXX
+    assert "增值税".encode("utf-8") in res.content
+
+    (viewer_data.ATT_DIR / "m1").mkdir()
+    (viewer_data.ATT_DIR / "m1" / "a.txt").write_bytes(b"x" * 4096)
+    res = client.get("/api/file/m1/a.txt", headers={"Accept-Encoding": "gzip"})
+    assert res.status_code == 200
+    assert "content-encoding" not in res.headers
+    assert res.headers["content-length"] == "4096"
+
+    res = client.get("/api/file/m1/a.txt", headers={"If-None-Match": res.headers["etag"]})
+    assert res.status_code == 304
+
+
+def test_stats_are_not_cached(client):
+    res = client.get("/api/cache")
+    assert res.headers["cache-control"] == "no-store"
+    assert "etag" not in res.headers
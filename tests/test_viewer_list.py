@@ -0,0 +1,102 @@
+# tests/test_viewer_list.py
+import json
+
+import pytest
+
+from sqlite_store import SqliteStore
+
+IDS = [f"m{i}" for i in range(7)]
+
+
+def make_records() -> dict:
+    return {rid: {"id": rid, "标题": rid, "留言时间": f"2024-01-0{i + 1}"} for i, rid in enumerate(IDS)}
+
+
+def list_page(viewer, cursor: str = "", page: int = 1, page_size: int = 3, **params) -> dict:
+    # 直接调用路由函数：Query 默认值要显式给
+    args = dict(q="", status="", region="", org="", leave_from="", leave_to="", reply_from="", reply_to="",
+                has_att=None, sort="", order="desc", cursor=cursor, facets=False, page=page, page_size=page_size)
+    return viewer.qa_list(**{**args, **params})
+
+
+def walk(viewer, page_size: int = 3, **params) -> list:
+    pages, cursor = [], ""
+    while True:
+        res = list_page(viewer, cursor, page_size=page_size, **params)
+        pages.append([row["id"] for row in res["rows"]])
+        cursor = res["next_cursor"]
+        if cursor is None:
+            return pages
+        assert len(pages) < 10
+
+
+@pytest.fixture
+def json_store(viewer_data):
+    viewer_data.QA_PATH.write_text(json.dumps({"meta": {}, "records": make_records()}), encoding="utf-8")
+    return viewer_data
+
+
+@pytest.fixture
+def sqlite_store(viewer_data, tmp_path):
+    db_path = tmp_path / "import.json"
+    db_path.write_text(json.dumps({"meta": {}, "records": make_records()}), encoding="utf-8")
+    SqliteStore(viewer_data.SQLITE_PATH, json_db_path=db_path, json_state_path=tmp_path / "state.json").close()
+    return viewer_data
+
+
+@pytest.fixture
+def no_index(monkeypatch, viewer_data):
+    monkeypatch.setattr(viewer_data, "kick_search_sync", lambda: "none")
+
+
+@pytest.fixture
+def json_index(monkeypatch, json_store):
+    # 同步建好索引，不在后台线程里跑
+    json_store.sync_search_json(json_store.search_index)
+    monkeypatch.setattr(json_store, "kick_search_sync", lambda: "json")
+    return json_store
+
+
+@pytest.mark.parametrize("store", ["json_store", "sqlite_store"])
+def test_unfiltered_list_pages_by_cursor(request, no_index, store):
+    viewer = request.getfixturevalue(store)
+    assert walk(viewer) == [IDS[0:3], IDS[3:6], IDS[6:7]]
+    assert list_page(viewer)["total"] == len(IDS)
+    # 不给游标时仍可按 page 取
+    assert [row["id"] for row in list_page(viewer, page=2)["rows"]] == IDS[3:6]
+
+
+def test_last_full_page_has_no_cursor(json_store, no_index):
+    res = list_page(json_store, page_size=7)
+    assert len(res["rows"]) == 7
+    assert res["next_cursor"] is None
+
+
+class NoWalk(dict):
+    """ 不允许按顺序遍历的记录表：深翻页只能按位置直接取 """
+
+    def __iter__(self):
+        raise AssertionError("walked the records")
+
+
+def test_deep_cursor_page_does_not_walk_records(json_store, no_index):
+    qa = json_store.qa_cache.get()
+    assert qa["ids"] == IDS
+    qa["records"] = NoWalk(qa["records"])
+    res = list_page(json_store, cursor=":4", page_size=2)
+    assert [row["id"] for row in res["rows"]] == ["m5", "m6"]
+    assert res["next_cursor"] is None
+
+
+@pytest.mark.parametrize("params", [
+    {"leave_from": "2024-01-06"},
+    {"leave_from": "2024-01-06", "sort": "leave_time"},
+    {"leave_from": "2024-01-04", "sort": "leave_time", "order": "asc"},
+])
+def test_filtered_last_full_page_has_no_cursor(json_index, params):
+    hits = [rid for rid, rec in make_records().items() if rec["留言时间"] >= params["leave_from"]]
+    pages = walk(json_index, page_size=2, **params)
+    # 命中数是 page_size 的整数倍：最后一页取满，不能再给一个通向空页的游标
+    assert len(hits) % 2 == 0
+    assert all(pages)
+    assert sorted(sum(pages, [])) == hits
@@ -0,0 +1,65 @@
+# tests/test_viewer_search.py
+import zlib
+
+import pytest
+
+from viewer.backend import search
+from viewer.backend.facets import Filters
+from viewer.backend.search import SearchIndex, bigram_tokens, record_hit
+
+TEXTS = ["增值税发票", "个人所得税", "税", "增值", "Tax 税率", "tax 退税", "发票增值税专用"]
+QUERIES = ["增值税", "税", "增", "票", "Tax", "tax", "x 税", "值税专", "所得税率", "发"]
+
+
+def make_records() -> dict:
+    return {f"m{i}": {"id": f"m{i}", "标题": text, "问题内容": "", "答复内容": "", "留言时间": f"2024-01-{i + 1:02d}"}
+            for i, text in enumerate(TEXTS)}
+
+
+def build(tmp_path, records: dict) -> SearchIndex:
+    index = SearchIndex(tmp_path / "search.sqlite3")
+    index.sync("json", ((rid, zlib.crc32(rec["标题"].encode("utf-8")), lambda rec=rec: rec)
+                        for rid, rec in records.items()))
+    return index
+
+
+def search_ids(index: SearchIndex, q: str, **kwargs) -> list:
+    return index.query(q, Filters(), limit=100, **kwargs)["ids"]
+
+
+def test_bigram_tokens():
+    assert bigram_tokens("增值税") == "增值 值税 税"
+    assert bigram_tokens("") == ""
+
+
+@pytest.mark.parametrize("q", QUERIES)
+def test_search_matches_substring_scan(tmp_path, q):
+    records = make_records()
+    index = build(tmp_path, records)
+    expected = {rid for rid, rec in records.items() if record_hit(rec, q)}
+    assert set(search_ids(index, q)) == expected
+
+
+def test_new_hits_after_cached_query(tmp_path):
+    records = make_records()
+    index = build(tmp_path, records)
+    assert search_ids(index, "发票", sort="leave_time") == ["m6", "m0"]
+
+    records["m9"] = {"id": "m9", "标题": "电子发票", "留言时间": "2024-02-01"}
+    index.sync("json", [("m9", 1, lambda: records["m9"])])
+    assert search_ids(index, "发票", sort="leave_time") == ["m9", "m6", "m0"]
+
+
+def test_query_cap_keeps_newest_hits(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, "QUERY_CAP", 2)
+    index = build(tmp_path, make_records())
+
+    # "税" 命中 6 条：只取入库最新的 2 条
+    res = index.query("税", Filters(), sort="leave_time")
+    assert res["capped"] is True
+    assert res["total"] == 2
+    assert res["ids"] == ["m6", "m5"]
+
+    res = index.query("发票", Filters())
+    assert res["capped"] is False
+    assert res["total"] == 2
@@ -0,0 +1,31 @@
+# tests/test_viewer_snapshot.py
+from storage import IdIndex, append_db_log_lines, db_log_line, save_db_atomic, save_id_index
+from dblog import empty_meta
+
+
+def put(rid: str, **fields) -> str:
+    return db_log_line({"op": "put", "record": {"id": rid, **fields}})
+
+
+def test_read_qa_decodes_snapshot_records_on_access(viewer_data):
+    records = {f"m{i}": {"id": f"m{i}", "留言时间": f"2024-01-0{i + 1}"} for i in range(3)}
+    db = {"meta": {**empty_meta(), "count": 3}, "records": records}
+    save_id_index(viewer_data.QA_PATH, IdIndex.from_db(db, save_db_atomic(viewer_data.QA_PATH, db)))
+    append_db_log_lines(viewer_data.QA_PATH, [put("m9", 留言时间="2024-01-09")])
+
+    qa = viewer_data.read_qa()
+    lazy = qa["records"]
+    assert isinstance(lazy, viewer_data.LazyRecords)
+    assert qa["ids"] == ["m0", "m1", "m2", "m9"]
+    assert qa["meta"]["count"] == 4
+    # meta / id 表都不用解码快照记录
+    assert lazy.snapshot.decoded == {}
+    assert lazy["m1"] == records["m1"]
+    assert list(lazy.snapshot.decoded) == ["m1"]
+
+    # 日志追加：同一个快照上只回放新行，已解码的记录共享
+    append_db_log_lines(viewer_data.QA_PATH, [put("m1", 留言时间="2024-02-01")])
+    again = viewer_data.read_qa()["records"]
+    assert again.snapshot is lazy.snapshot
+    assert again["m1"]["留言时间"] == "2024-02-01"
+    assert lazy["m1"]["留言时间"] == "2024-01-02"
@@ -1,20 +1,68 @@
-from fastapi import FastAPI, Query
+from fastapi import FastAPI, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
 from pathlib import Path
 import json
+import mmap
+import os
+import stat
+import sqlite3
+import threading
+import time
+import zlib
+from collections.abc import MutableMapping
+from bisect import bisect_right
 from datetime import datetime
 from typing import Optional
+from contextlib import asynccontextmanager, contextmanager
+from email.utils import formatdate
 from fastapi import HTTPException
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response, StreamingResponse
+import anyio.to_thread
+
+# 日志回放与爬虫共用（crawler/dblog.py 不依赖爬虫配置）；从项目根目录启动
+from crawler.dblog import apply_db_op, parse_db_log_line
+
+from .search import SearchIndex, record_hit
+from .facets import Filters, decode_cursor, scan_query
+from .manifest import load_manifest
+from .events import EventTail, sse_stream
+from .http_cache import OrjsonResponse, ApiGZipMiddleware, ConditionalGetMiddleware, data_version, not_modified
+import orjson
 
 ROOT = Path(__file__).resolve().parents[2]
 DATA_DIR = ROOT / "data"
 ATT_DIR = ROOT / "attachments"
+# 内容寻址的附件实体（crawler/download.py）；<msg_id>/ 下的文件是它的硬链接，列表时跳过这个目录
+BLOB_DIR = ATT_DIR / "_blobs"
 
 STATE_PATH = DATA_DIR / "crawl_state.json"
 QA_PATH = DATA_DIR / "qa_db.json"
+# 已下载附件的清单（见 crawler/download.py）：本地附件的展示都按它，不逐个目录扫描
+ATT_MANIFEST_PATH = DATA_DIR / "attachments_manifest.jsonl"
+# 爬虫的追加日志（见 crawler/storage.py），读 qa 时要回放到快照上
+QA_LOG_PATHS = [DATA_DIR / "qa_db.log.jsonl.compacting", DATA_DIR / "qa_db.log.jsonl"]
+# 快照的 id 索引（id / 留言时间 / 字节偏移 / 长度，见 crawler/storage.py）：有它就不用 json.load 整个快照
+QA_INDEX_PATH = DATA_DIR / "qa_db.ids.tsv"
+# 爬虫的进度事件（crawler/events.py）：/api/events 读增量转成 SSE
+EVENTS_PATH = DATA_DIR / "crawl_events.jsonl"
+# 爬虫 STORAGE_BACKEND="sqlite" 时的数据文件；VIEWER_STORAGE=json/sqlite 可强制指定，默认按文件是否存在
+SQLITE_PATH = DATA_DIR / "crawl.sqlite3"
+# /api/qa?q= 的倒排索引（viewer/backend/search.py）；viewer 自己的派生文件，删掉会在后台重建
+SEARCH_PATH = Path(os.environ.get("VIEWER_SEARCH_DB", DATA_DIR / "viewer_search.sqlite3"))
+
+@asynccontextmanager
+async def lifespan(app):
+    # 启动时在后台把数据加载好、索引同步起来，第一个请求不用等冷启动
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+    yield
+
+app = FastAPI(title="CN Tax Crawler Viewer", default_response_class=OrjsonResponse, lifespan=lifespan)
 
-app = FastAPI(title="CN Tax Crawler Viewer")
+# 中间件后加的在外层：CORS → gzip → ETag / 304（304 也要带上 CORS 头）
+# ETag / Cache-Control：按接口的数据来源（见 cache_rule）；数据没变直接 304，不执行接口
+app.add_middleware(ConditionalGetMiddleware, rules=lambda path, query: cache_rule(path, query))
+# 1KB 以下不压缩；级别 6：JSON 体积与 9 差不多，CPU 少一半；附件文件不压缩
+app.add_middleware(ApiGZipMiddleware, minimum_size=1024, compresslevel=6)
 
 # CORS 中间件
 app.add_middleware(
@@ -30,6 +78,391 @@ def read_json(path: Path) -> dict:
         return {}
     return json.loads(path.read_text(encoding="utf-8"))
 
+def file_signature(paths) -> tuple:
+    """ 各文件的 (size, mtime_ns)；不存在为 None。任何一个变了就要重新加载 """
+    out = []
+    for p in paths:
+        try:
+            st = p.stat()
+            out.append((st.st_size, st.st_mtime_ns))
+        except OSError:
+            out.append(None)
+    return tuple(out)
+
+class Snapshot:
+    """
+    一份 qa_db.json 快照：按索引里的偏移从 mmap 按需解码（同 crawler/storage.LazyRecords）。
+    快照没变时在多次 read_qa 之间共享：爬虫追加日志触发的重新加载不用把记录再解码一遍。
+    """
+
+    def __init__(self, path: Path, meta: dict, offsets: dict):
+        with path.open("rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.meta = meta
+        self.offsets = offsets
+        self.decoded = {}
+
+    def get(self, rid: str) -> dict:
+        rec = self.decoded.get(rid)
+        if rec is None:
+            off, n = self.offsets[rid]
+            rec = self.decoded[rid] = json.loads(self._mm[off:off + n])
+        return rec
+
+    def fp(self, rid: str) -> int:
+        """ 记录原始字节的 crc32；与 record_fp(同一条记录) 相同（爬虫按同样的 json.dumps 写快照） """
+        off, n = self.offsets[rid]
+        return zlib.crc32(self._mm[off:off + n])
+
+_snapshot = None          # (签名, Snapshot | None)
+_pending_since = None     # 快照换了、索引还没对上的起始时间
+# 爬虫压缩时先替换快照、再写索引（crawler/storage.compact_db）；这段时间继续用旧快照，
+# 不去整个 json.load 新快照。超过这么久还对不上（爬虫写完快照就崩了）才整个加载
+SNAPSHOT_PENDING_SECONDS = 120
+
+class SnapshotPending(Exception):
+    """ 快照已替换、索引还没写完：FileCache 保留旧数据，下个请求再试 """
+
+def read_snapshot():
+    global _snapshot, _pending_since
+    sig = file_signature([QA_PATH, QA_INDEX_PATH])
+    if _snapshot is None or _snapshot[0] != sig:
+        index = read_qa_index()
+        if index is None and _snapshot is not None and _snapshot[1] is not None and QA_INDEX_PATH.exists():
+            _pending_since = _pending_since or time.monotonic()
+            if time.monotonic() - _pending_since < SNAPSHOT_PENDING_SECONDS:
+                raise SnapshotPending()
+        _pending_since = None
+        _snapshot = (sig, Snapshot(QA_PATH, *index) if index is not None else None)
+    return _snapshot[1]
+
+class LazyRecords(MutableMapping):
+    """
+    快照记录（按需解码，Snapshot 里共享）+ 这次日志回放 put 的记录。
+    日志里的 att 会就地改共享的快照记录：日志只增不减，直到压缩换了快照，所以改动对之后的每次加载都成立。
+    """
+
+    def __init__(self, snapshot: Snapshot):
+        self.snapshot = snapshot
+        self._ids = dict.fromkeys(snapshot.offsets)  # 有序的全部 id（快照顺序，新增的在后）
+        self.puts = {}
+
+    def __getitem__(self, rid):
+        if rid in self.puts:
+            return self.puts[rid]
+        if rid not in self._ids:
+            raise KeyError(rid)
+        return self.snapshot.get(rid)
+
+    def __setitem__(self, rid, record):
+        self._ids[rid] = None
+        self.puts[rid] = record
+
+    def __delitem__(self, rid):
+        del self._ids[rid]
+        self.puts.pop(rid, None)
+
+    def __contains__(self, rid):
+        return rid in self._ids
+
+    def __iter__(self):
+        return iter(self._ids)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def copy(self) -> "LazyRecords":
+        """ 同一个快照上再回放新的日志行：只复制 id 表和 puts，不复制记录 """
+        out = LazyRecords.__new__(LazyRecords)
+        out.snapshot = self.snapshot
+        out._ids = dict(self._ids)
+        out.puts = dict(self.puts)
+        return out
+
+def read_qa_index():
+    """ 与快照对得上的 (meta, {id: (偏移, 长度)})；没有 / 过期返回 None，退回整个 json.load """
+    if not QA_INDEX_PATH.exists() or not QA_PATH.exists():
+        return None
+    st = QA_PATH.stat()
+    try:
+        with QA_INDEX_PATH.open("r", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("snapshot") != {"size": st.st_size, "mtime_ns": st.st_mtime_ns} or not header.get("offsets"):
+                return None
+            offsets = {}
+            for line in f:
+                rid, _, off, n = line.rstrip("\n").split("\t")
+                offsets[rid] = (int(off), int(n))
+    except (OSError, ValueError):
+        return None
+    return header.get("meta") or {}, offsets
+
+_qa_replay = None  # (快照, 上次 read_qa 的结果, {日志 inode: 已回放到的字节数})
+
+# qa_db.json 快照 + 追加日志回放（回放用 crawler/dblog.py，与 crawler/storage.load_db 一致）
+def read_qa() -> dict:
+    """
+    快照没变时在上次的结果上只回放日志新追加的行（爬虫每几秒追加一次，日志最多几十 MB）。
+    日志按 inode 记位置：轮转成 .compacting 后还是同一个文件；快照换了（压缩完）从头来
+    """
+    global _qa_replay
+    snapshot = read_snapshot()
+    if snapshot is not None and _qa_replay is not None and _qa_replay[0] is snapshot:
+        _, prev, positions = _qa_replay
+        qa = {"meta": dict(prev["meta"]), "records": prev["records"].copy()}
+    elif snapshot is not None:
+        qa, positions = {"meta": dict(snapshot.meta), "records": LazyRecords(snapshot)}, {}
+    else:
+        qa, positions = read_json(QA_PATH), {}
+    records = qa.setdefault("records", {})
+    meta = qa.setdefault("meta", {})
+    meta.setdefault("count", len(records))
+
+    replayed = {}
+    for log_path in QA_LOG_PATHS:
+        try:
+            st = log_path.stat()
+        except FileNotFoundError:
+            continue
+        start = positions.get(st.st_ino, 0)
+        if start > st.st_size:
+            start = 0
+        with log_path.open("rb") as f:
+            f.seek(start)
+            data = f.read()
+        # 爬虫可能正写到一半：只回放到最后一个换行，剩下的下次再读
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].decode("utf-8", errors="replace").split("\n"):
+            op = parse_db_log_line(line)
+            if op is not None:
+                apply_db_op(qa, op)
+        replayed[st.st_ino] = start + end
+
+    meta["count"] = len(records)
+    # 入库顺序的全部 id：不带条件的列表按位置直接切片，深翻页不用从头数
+    qa["ids"] = list(records)
+    if snapshot is not None:
+        _qa_replay = (snapshot, qa, replayed)
+    return qa
+
+class FileCache:
+    """
+    按文件签名失效的进程内缓存，所有请求线程共享（双缓冲）：
+    - 签名没变：直接返回当前数据（hit）
+    - 签名变了：起一个后台线程重新加载，加载完整体替换引用；替换前请求继续拿旧数据（stale），不在请求里等加载
+    - 还没有数据（冷启动）：请求线程同步加载，同一时刻只有一个线程在加载
+    缓存的数据只读，调用方不要改。
+    """
+
+    def __init__(self, name: str, paths, loader):
+        self.name = name
+        self.paths = paths    # () -> [Path]
+        self.loader = loader  # () -> data
+        self._current = None  # (signature, data)
+        self._lock = threading.Lock()
+        self._reloading = False
+        self.metrics = {"hits": 0, "stale": 0, "loads": 0, "reloads": 0, "pending": 0, "errors": 0,
+                        "last_load_seconds": None, "loaded_at": None, "last_error": None}
+
+    def _swap(self, sig: tuple, data, t0: float) -> None:
+        # 整体替换引用：读者要么拿到旧的，要么拿到新的
+        self._current = (sig, data)
+        self.metrics["last_load_seconds"] = round(time.perf_counter() - t0, 4)
+        self.metrics["loaded_at"] = datetime.now().isoformat(timespec="seconds")
+
+    def _reload(self, sig: tuple) -> None:
+        t0 = time.perf_counter()
+        try:
+            self._swap(sig, self.loader(), t0)
+            self.metrics["reloads"] += 1
+        except SnapshotPending:
+            self.metrics["pending"] += 1
+        except Exception as e:
+            # 保留旧数据，下个请求再试
+            self.metrics["errors"] += 1
+            self.metrics["last_error"] = f"{type(e).__name__}: {e}"
+        finally:
+            with self._lock:
+                self._reloading = False
+
+    def get(self):
+        sig = file_signature(self.paths())
+        current = self._current
+        if current is not None and current[0] == sig:
+            self.metrics["hits"] += 1
+            return current[1]
+
+        if current is None:
+            with self._lock:
+                # 冷启动：其他线程等这一次加载完直接用
+                if self._current is None:
+                    t0 = time.perf_counter()
+                    data = self.loader()
+                    self._swap(sig, data, t0)
+                    self.metrics["loads"] += 1
+                    return data
+                current = self._current
+                if current[0] == sig:
+                    self.metrics["hits"] += 1
+                    return current[1]
+
+        with self._lock:
+            if not self._reloading:
+                self._reloading = True
+                threading.Thread(target=self._reload, args=(sig,), name=f"cache-{self.name}", daemon=True).start()
+        self.metrics["stale"] += 1
+        return current[1]
+
+    def version(self) -> tuple:
+        """ 正在用的那份数据的文件签名（不是磁盘上的）：后台重载完成之前仍是旧的，用作 ETag """
+        self.get()
+        return self._current[0]
+
+    def stats(self) -> dict:
+        return {**self.metrics, "reloading": self._reloading, "signature": self._current and self._current[0]}
+
+_att_manifest = None  # 上一份 AttachmentManifest：重新加载时只读清单追加的行
+
+def read_att_manifest():
+    global _att_manifest
+    _att_manifest = load_manifest(ATT_MANIFEST_PATH, ATT_DIR, BLOB_DIR, _att_manifest)
+    return _att_manifest
+
+qa_cache = FileCache("qa", lambda: [QA_PATH, QA_INDEX_PATH, *QA_LOG_PATHS], read_qa)
+state_cache = FileCache("state", lambda: [STATE_PATH], lambda: read_json(STATE_PATH))
+# ATT_DIR：没有清单时按目录扫描，新建问答目录会改它的 mtime
+att_cache = FileCache("attachments", lambda: [ATT_MANIFEST_PATH, ATT_DIR], read_att_manifest)
+
+# ---------- 搜索索引同步（后台线程，见 SearchIndex.kick） ----------
+search_index = SearchIndex(SEARCH_PATH)
+
+def record_fp(record: dict) -> int:
+    return zlib.crc32(json.dumps(record, ensure_ascii=False).encode("utf-8"))
+
+def sync_search_json(index: SearchIndex) -> None:
+    records = qa_cache.get().get("records") or {}
+    if not isinstance(records, LazyRecords):
+        # 旧格式快照（没有 id 索引）：每次全量比对指纹
+        index.sync("json", ((rid, record_fp(rec), lambda rec=rec: rec) for rid, rec in records.items()))
+        return
+
+    snap = records.snapshot
+    if index.ready("json") and index.synced_base() is snap:
+        ids = list(records.puts)  # 快照没变：只有日志里的记录可能是新的
+    else:
+        ids = list(records)       # 启动 / 压缩后：全量比对指纹（快照记录只算 crc32，不解码）
+
+    def items():
+        for rid in ids:
+            rec = records.puts.get(rid)
+            if rec is not None:
+                yield rid, record_fp(rec), lambda rec=rec: rec
+            else:
+                yield rid, snap.fp(rid), lambda rid=rid: snap.get(rid)
+
+    index.sync("json", items(), base=snap)
+
+def sync_search_sqlite(index: SearchIndex) -> None:
+    # INSERT OR REPLACE 会给记录新的 rowid：rowid 大于上次位置的就是新增 / 改过的
+    cursor = int(index.cursor(0) or 0)
+    with sqlite_conn() as conn:
+        max_rowid = conn.execute("SELECT MAX(rowid) FROM records").fetchone()[0] or 0
+        if cursor > max_rowid:
+            cursor = 0  # 换了一个库
+        rows = conn.execute(
+            f"SELECT rowid, {', '.join(SQLITE_SEARCH_COLUMNS)}, "
+            "(SELECT COUNT(*) FROM attachments a WHERE a.msg_id = records.id) "
+            "FROM records WHERE rowid > ? ORDER BY rowid",
+            (cursor,),
+        )
+        index.sync("sqlite", (
+            (r[1], r[0], lambda r=r: dict(zip((*SQLITE_SEARCH_COLUMNS, "附件数量"), r[1:])))
+            for r in rows
+        ), cursor=max_rowid)
+
+SQLITE_SEARCH_COLUMNS = ("id", "标题", "问题内容", "答复内容", "status", "纳税人所属地", "答复机构", "留言时间", "答复时间")
+
+def kick_search_sync() -> str:
+    source = "sqlite" if use_sqlite() else "json"
+    search_index.kick(sync_search_sqlite if source == "sqlite" else sync_search_json)
+    return source
+
+def warm_up() -> None:
+    for step in ((lambda: None) if use_sqlite() else qa_cache.get, state_cache.get, att_cache.get, kick_search_sync):
+        try:
+            step()
+        except Exception as e:
+            print(f"[viewer] 预加载失败：{e!r}")
+
+# ---------- HTTP 缓存（viewer/backend/http_cache.py） ----------
+def sqlite_signature() -> tuple:
+    # 爬虫每次提交都会改 -wal 的 mtime
+    return file_signature([SQLITE_PATH, SQLITE_PATH.with_name(SQLITE_PATH.name + "-wal")])
+
+def qa_version() -> tuple:
+    # 列表行里有“本地附件”；有没有走索引（以及索引同步到哪）会影响结果和顺序
+    data = sqlite_signature() if use_sqlite() else qa_cache.version()
+    search = (search_index.version, search_index.ready("sqlite" if use_sqlite() else "json"))
+    return data_version(data, att_cache.version(), search)
+
+def state_version() -> tuple:
+    return data_version(sqlite_signature() if use_sqlite() else state_cache.version())
+
+def overview_version() -> tuple:
+    if use_sqlite():
+        return data_version(sqlite_signature())
+    return data_version(state_cache.version(), qa_cache.version())
+
+def cache_rule(path: str, query: bytes):
+    """
+    (Cache-Control, 数据版本) 或 None。
+    列表 / 概览：no-cache（浏览器每次带 If-None-Match 来问，没变就 304）；导出和统计：no-store；
+    单条问答：短时间内不再问
+    """
+    if path == "/api/cache" or b"format=ndjson" in query:
+        return "no-store", None
+    if path == "/api/overview":
+        return "no-cache", overview_version
+    if path == "/api/qa":
+        return "no-cache", qa_version
+    if path.startswith("/api/qa/"):
+        return "private, max-age=30", qa_version
+    if path.startswith("/api/attachments"):
+        return "no-cache", lambda: data_version(att_cache.version())
+    if path == "/api/failed_attachments":
+        return "no-cache", state_version
+    return None
+
+def use_sqlite() -> bool:
+    mode = os.environ.get("VIEWER_STORAGE", "auto")
+    if mode == "auto":
+        return SQLITE_PATH.exists()
+    return mode == "sqlite"
+
+# 只读连接；WAL 模式下可与爬虫并发读
+@contextmanager
+def sqlite_conn():
+    conn = sqlite3.connect(f"file:{SQLITE_PATH}?mode=ro", uri=True)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+def sqlite_meta(conn, key: str, default=None):
+    row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+    return json.loads(row[0]) if row else default
+
+def sqlite_attachments(conn, msg_id: str) -> list:
+    out = []
+    for title, url, fid, local_path in conn.execute(
+        "SELECT 标题, url, fileId, local_path FROM attachments WHERE msg_id = ? ORDER BY seq", (msg_id,)
+    ):
+        att = {"标题": title or "", "url": url or "", "fileId": fid or ""}
+        if local_path:
+            att["local_path"] = local_path
+        out.append(att)
+    return out
+
 # file 最后修改时间
 def file_mtime_iso(path: Path) -> Optional[str]:
     if not path.exists():
@@ -37,10 +470,48 @@ def file_mtime_iso(path: Path) -> Optional[str]:
     ts = path.stat().st_mtime # modification time
     return datetime.fromtimestamp(ts).isoformat(timespec="seconds")
 
+def overview_sqlite():
+    with sqlite_conn() as conn:
+        row = conn.execute(
+            "SELECT next_page, end_page, last_saved_at, consec_403, cooldown_until FROM cursor WHERE one = 1"
+        ).fetchone() or [None] * 5
+        counts = {
+            k: conn.execute(f"SELECT COUNT(*) FROM {k}").fetchone()[0]
+            for k in ("failed_pages", "failed_ids", "failed_attachments")
+        }
+        qa_meta = {
+            "count": sqlite_meta(conn, "count", 0),
+            "max_question_length": sqlite_meta(conn, "max_question_length"),
+            "max_question_id": sqlite_meta(conn, "max_question_id"),
+        }
+    mtime = file_mtime_iso(SQLITE_PATH)
+    wal_mtime = file_mtime_iso(SQLITE_PATH.with_name(SQLITE_PATH.name + "-wal"))
+    return {
+        "state": {
+            "next_page": row[0],
+            "end_page": row[1],
+            "last_saved_at": row[2],
+            "consec_403": row[3],
+            "cooldown_until": row[4],
+            **counts,
+        },
+        "qa": qa_meta,
+        "files": {
+            "crawl_state_mtime": max(filter(None, [mtime, wal_mtime]), default=None),
+            "qa_db_mtime": max(filter(None, [mtime, wal_mtime]), default=None),
+        }
+    }
+
+def has_local_attachments(x):
+    return att_cache.get().has(x.get("id"))
+
 @app.get("/api/overview")
 def overview():
-    state = read_json(STATE_PATH)
-    qa = read_json(QA_PATH)
+    if use_sqlite():
+        return overview_sqlite()
+
+    state = state_cache.get()
+    qa = qa_cache.get()
 
     records = (qa.get("records") or {})
     meta = (qa.get("meta") or {})
@@ -65,53 +536,150 @@ def overview():
         },
         "files": {
             "crawl_state_mtime": file_mtime_iso(STATE_PATH),
-            "qa_db_mtime": file_mtime_iso(QA_PATH),
+            "qa_db_mtime": max(filter(None, [file_mtime_iso(p) for p in [QA_PATH, *QA_LOG_PATHS]]), default=None),
         }
     }
 
+event_tail = EventTail(EVENTS_PATH)
+
+@app.get("/api/events")
+async def crawl_events(request: Request):
+    # 概览的实时更新：页面先取一次 /api/overview，之后按事件改数字，不再定时轮询
+    return StreamingResponse(
+        sse_stream(event_tail, request.headers.get("last-event-id")),
+        media_type="text/event-stream",
+        headers={"cache-control": "no-store", "x-accel-buffering": "no"},
+    )
+
+@app.get("/api/cache")
+def cache_stats():
+    # qa_db / crawl_state / 附件清单缓存的命中、后台重载统计（sqlite 模式的 qa / state 直接查库，不走缓存）
+    return {**{c.name: c.stats() for c in (qa_cache, state_cache, att_cache)}, "search": search_index.stats()}
+
+def ndjson_response(rows) -> StreamingResponse:
+    # 批量导出：一行一条，边取边发，不在内存里拼整个 JSON
+    return StreamingResponse((orjson.dumps(r) + b"\n" for r in rows), media_type="application/x-ndjson")
+
+def iter_pages(fetch, cursor: str = ""):
+    """ fetch(cursor) -> (总数, 行, next_cursor)；按游标一页页取到最后（每页单独取，不跨线程持有连接） """
+    while True:
+        _, rows, cursor = fetch(cursor)
+        yield from rows
+        if not cursor:
+            return
+
+def failed_attachment_item(x) -> Optional[dict]:
+    # 兼容 state 里的旧格式 "msgid:url"（同 crawler/storage.normalize_failed_attachment_item）
+    if isinstance(x, str) and ":" in x:
+        msg_id, url = x.split(":", 1)
+        return {"id": msg_id.strip(), "url": url.strip(), "标题": "", "fileId": ""}
+    if isinstance(x, dict) and "id" in x and "url" in x:
+        return {"id": x["id"], "url": x["url"], "标题": x.get("标题") or "", "fileId": x.get("fileId") or ""}
+    return None
+
+_failed_index = None  # (state 对象, 按 (id, url) 排好的键, 行)：state 重新加载之前复用
+
+def failed_attachments_page(cursor: str, limit: int):
+    """ 按 (问答 id, url) 排序；游标是上一页最后一条的 "id:url"（与失败项的旧格式相同） """
+    global _failed_index
+    after = tuple(cursor.split(":", 1)) if ":" in cursor else None
+    if use_sqlite():
+        with sqlite_conn() as conn:
+            total = conn.execute("SELECT COUNT(*) FROM failed_attachments").fetchone()[0]
+            # (id, url) 是主键：按它走索引，不排序
+            rows = [
+                {"id": r[0], "url": r[1], "标题": r[2] or "", "fileId": r[3] or ""}
+                for r in conn.execute(
+                    "SELECT id, url, 标题, fileId FROM failed_attachments "
+                    f"{'WHERE (id, url) > (?, ?)' if after else ''} ORDER BY id, url LIMIT ?",
+                    (*(after or ()), limit + 1),
+                )
+            ]
+        more = len(rows) > limit
+        rows = rows[:limit]
+    else:
+        state = state_cache.get()
+        if _failed_index is None or _failed_index[0] is not state:
+            items = sorted(filter(None, map(failed_attachment_item, state.get("failed_attachments") or [])),
+                           key=lambda x: (x["id"], x["url"]))
+            _failed_index = (state, [(x["id"], x["url"]) for x in items], items)
+        _, keys, items = _failed_index
+        total = len(items)
+        start = bisect_right(keys, after) if after else 0
+        rows, more = items[start:start + limit], start + limit < total
+    return total, rows, (f"{rows[-1]['id']}:{rows[-1]['url']}" if rows and more else None)
+
 @app.get("/api/failed_attachments")
-def failed_attachments():
-    state = read_json(STATE_PATH)
-    return state.get("failed_attachments") or []
+def failed_attachments(
+    cursor: str = Query(default="", description="上一页返回的 next_cursor"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    format: str = Query(default="json", pattern="^(json|ndjson)$", description="ndjson：从游标处流式导出到最后，忽略 limit"),
+):
+    if format == "ndjson":
+        return ndjson_response(iter_pages(lambda c: failed_attachments_page(c, 1000), cursor))
+    total, rows, next_cursor = failed_attachments_page(cursor, limit)
+    return {"total": total, "rows": rows, "next_cursor": next_cursor}
 
-# /api/qa?q=增值税&status=ok&page=2&page_size=20
+# /api/qa?q=增值税&region=北京市&leave_from=2024-01-01&sort=leave_time&page=2&page_size=20
 @app.get("/api/qa")
 def qa_list(
     q: str = Query(default="", description="Search in 标题/问题内容/答复内容"),
     status: str = Query(default="", description="Filter by status, e.g. ok/failed"),
+    region: str = Query(default="", description="纳税人所属地"),
+    org: str = Query(default="", description="答复机构"),
+    leave_from: str = Query(default="", description="留言时间 >= , e.g. 2024-01-01"),
+    leave_to: str = Query(default="", description="留言时间 <= （含当天）"),
+    reply_from: str = Query(default="", description="答复时间 >="),
+    reply_to: str = Query(default="", description="答复时间 <= （含当天）"),
+    has_att: Optional[bool] = Query(default=None, description="有 / 无附件"),
+    sort: str = Query(default="", pattern="^(|leave_time|reply_time)$", description="按时间排序；不给时按相关度 / 入库顺序"),
+    order: str = Query(default="desc", pattern="^(asc|desc)$"),
+    cursor: str = Query(default="", description="上一页返回的 next_cursor；给了就从它之后取，不再按 page 跳过"),
+    facets: bool = Query(default=True, description="返回 纳税人所属地 / 答复机构 / 附件 的分面计数"),
     page: int = Query(default=1, ge=1),
     page_size: int = Query(default=20, ge=1, le=200),
 ):
-    qa = read_json(QA_PATH)
-    records: dict = qa.get("records") or {}
-
-    items = list(records.values())
-
-    if status:
-        items = [x for x in items if (x.get("status") or "") == status]
+    q2 = q.strip()
+    filters = Filters(status, region, org, leave_from, leave_to, reply_from, reply_to, has_att)
+    desc = order == "desc"
+    after = decode_cursor(cursor, sort)
+    start = (page - 1) * page_size
 
-    if q:
-        q2 = q.strip()
-        def hit(x):
-            return (q2 in (x.get("标题") or "")
-                    or q2 in (x.get("问题内容") or "")
-                    or q2 in (x.get("答复内容") or ""))
-        items = [x for x in items if hit(x)]
+    if use_sqlite():
+        return qa_list_sqlite(q2, filters, sort, desc, page, page_size, after, facets)
 
-    total = len(items)
-    start = (page - 1) * page_size
-    end = start + page_size
+    qa = qa_cache.get()
+    records: dict = qa.get("records") or {}
 
-    def has_local_attachments(x):
-        msg_id = x.get("id")
-        if not msg_id:
-            return False
-        p = ATT_DIR / msg_id
-        return p.exists() and any(p.iterdir())
+    narrowed = bool(q2 or filters.active() or sort)
+    ready = search_index.ready(kick_search_sync())
+    facet_data = None
+    if not narrowed:
+        # 入库顺序：游标是上一页最后一条的位置（记录只增不删，压缩也保持顺序）
+        ids = qa["ids"]
+        first = after + 1 if after is not None else start
+        page_items = [records[i] for i in ids[first:first + page_size]]
+        last = first + len(page_items)
+        res = {"total": len(ids), "capped": False,
+               "next_cursor": f":{last - 1}" if page_items and last < len(ids) else None}
+    elif ready:
+        # 索引：只解码这一页；索引可能落后爬虫几秒，页内再核对一遍条件
+        res = search_index.query(q2, filters, sort, desc, start, page_size, after)
+        page_items = [records[i] for i in res["ids"] if i in records]
+        page_items = [x for x in page_items if filters.match(x) and (not q2 or record_hit(x, q2))]
+    else:
+        # 索引还没建好（后台在建）：逐条扫描
+        search_index.metrics["fallbacks"] += 1
+        hits = (x for x in records.values() if not q2 or record_hit(x, q2))
+        res = scan_query(hits, filters, sort, desc, start, page_size, facets)
+        page_items = res["items"]
+        facet_data = res["facets"]
+    if facets and ready:
+        facet_data = search_index.facets(q2, filters)
 
     # 返回列表只带轻量字段
     rows = []
-    for x in items[start:end]:
+    for x in page_items:
         rows.append({
             "id": x.get("id"),
             "标题": x.get("标题"),
@@ -125,61 +693,158 @@ def qa_list(
             "本地附件": has_local_attachments(x),
         })
 
-    return {"total": total, "page": page, "page_size": page_size, "rows": rows}
+    return qa_page(res, page, page_size, rows, facet_data)
+
+def qa_page(res: dict, page: int, page_size: int, rows: list, facet_data: Optional[dict]) -> dict:
+    return {
+        "total": res["total"],
+        "total_capped": res["capped"],
+        "page": page,
+        "page_size": page_size,
+        "rows": rows,
+        "next_cursor": res["next_cursor"],
+        "facets": facet_data,
+    }
+
+def qa_list_sqlite(q: str, filters: Filters, sort: str, desc: bool, page: int, page_size: int, after, facets: bool):
+    start = (page - 1) * page_size
+    narrowed = bool(q or filters.active() or sort)
+    ready = search_index.ready(kick_search_sync())
+    facet_data = None
+
+    with sqlite_conn() as conn:
+        if not narrowed:
+            # 入库顺序：游标是上一页最后一条的 rowid，按主键接着取；多取一条判断后面还有没有
+            total = conn.execute("SELECT COUNT(*) FROM records").fetchone()[0]
+            if after is not None:
+                page_rows = conn.execute(
+                    "SELECT rowid, id FROM records WHERE rowid > ? ORDER BY rowid LIMIT ?", (after, page_size + 1)
+                ).fetchall()
+            else:
+                page_rows = conn.execute(
+                    "SELECT rowid, id FROM records ORDER BY rowid LIMIT ? OFFSET ?", (page_size + 1, start)
+                ).fetchall()
+            page_rows, more = page_rows[:page_size], len(page_rows) > page_size
+            res = {"total": total, "capped": False, "ids": [r[1] for r in page_rows],
+                   "next_cursor": f":{page_rows[-1][0]}" if more else None}
+        elif ready:
+            res = search_index.query(q, filters, sort, desc, start, page_size, after)
+        else:
+            # 索引还没建好：全文条件交给 SQL，过滤 / 排序 / 分面在这边扫（只取轻量列）
+            search_index.metrics["fallbacks"] += 1
+            where, args = "", []
+            if q:
+                where = "WHERE instr(标题, ?) > 0 OR instr(问题内容, ?) > 0 OR instr(答复内容, ?) > 0"
+                args = [q] * 3
+            rows = conn.execute(f"SELECT {SQLITE_FACET_COLUMNS} FROM records {where} ORDER BY rowid", args)
+            keys = ("id", "status", "纳税人所属地", "答复机构", "留言时间", "答复时间", "附件数量")
+            res = scan_query((dict(zip(keys, r)) for r in rows), filters, sort, desc, start, page_size, facets)
+            res["ids"] = [x["id"] for x in res["items"]]
+            facet_data = res["facets"]
+
+        found = {}
+        for r in conn.execute(
+            f"SELECT {SQLITE_LIST_COLUMNS}, 问题内容, 答复内容 FROM records "
+            f"WHERE id IN ({', '.join('?' * len(res['ids']))})",
+            res["ids"],
+        ):
+            row = sqlite_row(r)
+            # 索引可能落后爬虫几秒：页内再核对一遍条件
+            if filters.match(row) and (not q or record_hit({"标题": r[1], "问题内容": r[9], "答复内容": r[10]}, q)):
+                found[r[0]] = row
+
+    if facets and ready:
+        facet_data = search_index.facets(q, filters)
+    return qa_page(res, page, page_size, [found[i] for i in res["ids"] if i in found], facet_data)
+
+SQLITE_FACET_COLUMNS = (
+    "id, status, 纳税人所属地, 答复机构, 留言时间, 答复时间, "
+    "(SELECT COUNT(*) FROM attachments a WHERE a.msg_id = records.id)"
+)
+
+SQLITE_LIST_COLUMNS = (
+    "id, 标题, 留言时间, 纳税人所属地, 答复时间, 答复机构, status, url, "
+    "(SELECT COUNT(*) FROM attachments a WHERE a.msg_id = records.id)"
+)
+
+def sqlite_row(r) -> dict:
+    return {
+        "id": r[0],
+        "标题": r[1],
+        "留言时间": r[2],
+        "纳税人所属地": r[3],
+        "答复时间": r[4],
+        "答复机构": r[5],
+        "status": r[6],
+        "url": r[7],
+        "附件数量": r[8],
+        "本地附件": has_local_attachments({"id": r[0]}),
+    }
 
 @app.get("/api/qa/{msg_id}")
 def qa_detail(msg_id: str):
-    qa = read_json(QA_PATH)
+    if use_sqlite():
+        with sqlite_conn() as conn:
+            row = conn.execute("SELECT data FROM records WHERE id = ?", (msg_id,)).fetchone()
+            if not row:
+                return {}
+            record = json.loads(row[0])
+            record["附件"] = sqlite_attachments(conn, msg_id)
+            return record
+
+    qa = qa_cache.get()
     records: dict = qa.get("records") or {}
     return records.get(msg_id) or {}
 
 @app.get("/api/attachments")
-def attachments_index():
-    # 聚合 attachments/<msg_id>/ 下文件数量和大小
-    out = []
-    if not ATT_DIR.exists():
-        return out
-    for d in ATT_DIR.iterdir():
-        if not d.is_dir():
-            continue
-        files = [p for p in d.iterdir() if p.is_file()]
-        total_size = sum(p.stat().st_size for p in files)
-        out.append({
-            "msg_id": d.name,
-            "file_count": len(files),
-            "total_size": total_size,
-        })
-    # 文件多的话按 file_count 降序
-    out.sort(key=lambda x: x["file_count"], reverse=True)
-    return out
+def attachments_index(
+    sort: str = Query(default="file_count", pattern="^(file_count|total_size|msg_id)$", description="同值再按 msg_id"),
+    order: str = Query(default="desc", pattern="^(asc|desc)$"),
+    cursor: str = Query(default="", description="上一页返回的 next_cursor"),
+    limit: int = Query(default=100, ge=1, le=1000),
+    format: str = Query(default="json", pattern="^(json|ndjson)$", description="ndjson：从游标处流式导出到最后，忽略 limit"),
+):
+    # 按问答聚合的文件数量和大小：附件清单里按排序键算好，翻页只是切片
+    manifest = att_cache.get()
+    if format == "ndjson":
+        return ndjson_response(manifest.summary(sort, order == "desc", cursor)[1])
+    total, rows, next_cursor = manifest.summary(sort, order == "desc", cursor, limit)
+    return {"total": total, "rows": rows, "next_cursor": next_cursor}
 
 @app.get("/api/attachments/{msg_id}")
 def attachments_by_msg(msg_id: str):
-    base = ATT_DIR / msg_id
-    if not base.exists() or not base.is_dir():
-        return []
+    return att_cache.get().entries(msg_id)
 
-    out = []
-    for p in base.iterdir():
-        if not p.is_file():
-            continue
-        out.append({
-            "filename": p.name,
-            "fileId": p.stem,     # 去掉 .docx / .pdf
-            "size": p.stat().st_size,
-        })
-    return out
+# 浏览器内直接打开（PDF 阅读器按 Range 跳页）；其余按下载处理
+INLINE_SUFFIXES = {".pdf", ".png", ".jpg", ".jpeg", ".gif", ".webp", ".txt"}
 
 @app.get("/api/file/{msg_id}/{filename}")
-def download_file(msg_id: str, filename: str):
-    base = (ATT_DIR / msg_id).resolve()
-    file_path = (base / filename).resolve()
+async def download_file(msg_id: str, filename: str, request: Request):
+    # Range / If-Range / 多段由 FileResponse 处理，服务器支持时用 sendfile（pathsend）零拷贝发送
+    if msg_id in ("_blobs", ".", ".."):
+        raise HTTPException(status_code=403, detail="Invalid path")
+    file_path = (ATT_DIR / msg_id / filename).resolve()
 
-    # 防止 ../../ 越权
-    if not str(file_path).startswith(str(base)):
+    # 防止 ../../ 越权：只能是 attachments/<msg_id>/ 下一层的文件
+    if file_path.parent.parent != ATT_DIR.resolve():
         raise HTTPException(status_code=403, detail="Invalid path")
 
-    if not file_path.exists():
+    try:
+        st = await anyio.to_thread.run_sync(os.stat, file_path)
+    except (FileNotFoundError, NotADirectoryError):
         raise HTTPException(status_code=404, detail="File not found")
+    if not stat.S_ISREG(st.st_mode):
+        raise HTTPException(status_code=404, detail="File not found")
+
+    # 附件下载完就不再改（重新下载是换文件），按 (size, mtime) 做 ETag
+    headers = {
+        "etag": f'"{st.st_size:x}-{st.st_mtime_ns:x}"',
+        "last-modified": formatdate(st.st_mtime, usegmt=True),
+        "cache-control": "private, max-age=3600",
+    }
+    if not_modified(request.headers, headers["etag"], headers["last-modified"]):
+        return Response(status_code=304, headers=headers)
 
-    return FileResponse(file_path, filename=filename)
+    inline = file_path.suffix.lower() in INLINE_SUFFIXES
+    return FileResponse(file_path, filename=filename, stat_result=st, headers=headers,
+                        content_disposition_type="inline" if inline else "attachment")
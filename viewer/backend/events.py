@@ -0,0 +1,156 @@
+"""
+爬虫进度事件（crawler/events.py 追加的 data/crawl_events.jsonl）→ /api/events 的 Server-Sent Events。
+
+- 每个进程一个 EventTail，所有连接共享：有连接时一个后台任务每 POLL_SECONDS stat 一次，
+  新增的行放进环形缓冲并唤醒各连接；没有连接时不读
+- 记着当前文件的 inode 和位置：爬虫把文件轮转成 .1 后，先读完 .1 剩下的行再从新文件开头读；
+  只读到最后一个换行，写到一半的行下次再读
+- Viewer 启动后第一次读从文件末尾开始，不回放历史
+- SSE 的 id 是这个进程里的递增序号：浏览器重连时带 Last-Event-ID，缓冲里还有就补发，
+  否则（缓冲已滚掉、Viewer 重启过）发 reset，页面重新取一次概览
+"""
+import asyncio
+import threading
+from collections import deque
+from itertools import islice
+from pathlib import Path
+
+import anyio.to_thread
+import orjson
+
+POLL_SECONDS = 0.5
+# 没有事件时隔多久发一行注释，防止代理 / 浏览器当成断线
+HEARTBEAT_SECONDS = 15
+
+
+class EventTail:
+    def __init__(self, path: Path, buffer: int = 1000):
+        self.path = path
+        self.rotated = path.with_name(path.name + ".1")
+        self.events = deque(maxlen=buffer)  # (序号, 原始 JSON 行)
+        self.seq = 0
+        self.position = None  # 当前文件的 (inode, 已读到的字节数)；None = 还没读过
+        self._lock = threading.Lock()
+        self._changed = None  # asyncio.Condition：有新事件时唤醒等待的连接
+        self._reader = None   # 读文件的后台任务
+        self._waiting = 0
+
+    def poll(self) -> int:
+        """ 读新增的事件，返回最新序号（在线程里调用） """
+        with self._lock:
+            st = stat_or_none(self.path)
+            if self.position is None:
+                self.position = (st.st_ino, st.st_size) if st else (None, 0)
+                return self.seq
+
+            inode, offset = self.position
+            if st is None or st.st_ino != inode:
+                # 轮转过：上次读的文件现在是 .1，把剩下的读完。新文件从头读
+                # （不按 inode 记多个位置：旧 .1 删掉后，它的 inode 可能被新文件复用）
+                old = stat_or_none(self.rotated)
+                if old is not None and old.st_ino == inode:
+                    self._read(self.rotated, offset)
+                offset = 0
+            if st is not None:
+                if offset > st.st_size:
+                    offset = 0
+                offset = self._read(self.path, offset)
+            self.position = (st.st_ino if st else None, offset)
+            return self.seq
+
+    def _read(self, path: Path, offset: int) -> int:
+        with path.open("rb") as f:
+            f.seek(offset)
+            data = f.read()
+        # 只读到最后一个换行，写到一半的行下次再读
+        end = data.rfind(b"\n") + 1
+        self._add(data[:end])
+        return offset + end
+
+    def _add(self, data: bytes) -> None:
+        for line in data.split(b"\n"):
+            try:
+                orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # 空行；Viewer 启动时文件末尾正好是半行
+                continue
+            self.seq += 1
+            self.events.append((self.seq, line))
+
+    def since(self, seq: int):
+        """ 序号 seq 之后的事件；中间有缺（缓冲滚掉了 / 不是这个进程的序号）返回 None """
+        with self._lock:
+            if seq > self.seq:
+                return None
+            if seq == self.seq:
+                return []
+            first = self.events[0][0] if self.events else self.seq + 1
+            if seq < first - 1:
+                return None
+            return list(islice(self.events, seq - first + 1, None))
+
+
+    async def wait(self, seq: int, timeout: float) -> None:
+        """ 等到有 seq 之后的事件或超时；第一个等待的连接启动读文件的任务，没人等了它自己退出 """
+        if self._changed is None:
+            self._changed = asyncio.Condition()
+        if self._reader is None or self._reader.done():
+            self._reader = asyncio.ensure_future(self._read_loop())
+        self._waiting += 1
+        try:
+            async with self._changed:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self.seq != seq), timeout)
+        except asyncio.TimeoutError:
+            pass
+        finally:
+            self._waiting -= 1
+
+    async def _read_loop(self) -> None:
+        while True:
+            before = self.seq
+            await anyio.to_thread.run_sync(self.poll)
+            if self.seq != before:
+                async with self._changed:
+                    self._changed.notify_all()
+            await asyncio.sleep(POLL_SECONDS)
+            if not self._waiting:
+                return
+
+
+def stat_or_none(path: Path):
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        return None
+
+
+def parse_event_id(value) -> int:
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return -1
+
+
+async def sse_stream(tail: EventTail, last_event_id=None):
+    """ text/event-stream：事件原样放进 data；客户端断开时 StreamingResponse 会取消这个生成器 """
+    seq = await anyio.to_thread.run_sync(tail.poll)
+    yield b"retry: 3000\n\n"
+    if last_event_id is not None:
+        last = parse_event_id(last_event_id)
+        if tail.since(last) is None:
+            yield b"event: reset\ndata: {}\n\n"
+        else:
+            seq = last
+
+    while True:
+        events = tail.since(seq)
+        if events is None:
+            seq = tail.seq
+            yield b"event: reset\ndata: {}\n\n"
+        elif events:
+            seq = events[-1][0]
+            yield b"".join(b"id: %d\ndata: %s\n\n" % (n, line) for n, line in events)
+        else:
+            await tail.wait(seq, HEARTBEAT_SECONDS)
+            if tail.seq == seq:
+                yield b": ping\n\n"
@@ -0,0 +1,359 @@
+"""
+/api/qa 的过滤、分面计数和按时间排序翻页：内存里的位图 + 有序数组（数据来自 search.py 的 docs 表）。
+
+- 位置 = docs.doc（qa_fts 的 rowid，只增不减，记录改写后换新位置）
+- 每个分面值一个位图（Python int 的位）：过滤 = 按位与，计数 = bit_count()；
+  改写 / 删除的旧位置只从 live 里清掉，其他位图里留着也不会被算进去
+- 每个时间字段一个有序数组，元素是 (时间, doc) 拼成的 int64：时间范围 = 数组里连续的一段，
+  按时间翻页 = 从游标位置往后扫、用过滤位图判断是否命中；命中很稀疏时直接取出命中再排序
+- 分面按“其余条件”计数：选了某个地区时，地区分面仍列出其他地区各有多少条
+"""
+import re
+import threading
+from array import array
+from bisect import bisect_left, bisect_right, insort
+from collections import Counter
+from itertools import chain, islice
+from typing import NamedTuple, Optional
+
+# 过滤参数名 → 列名（docs 表和爬虫 SQLite 的 records 表同名）
+FACETS = {"region": "纳税人所属地", "org": "答复机构"}
+SORTS = {"leave_time": "留言时间", "reply_time": "答复时间"}
+FACET_LIMIT = 100
+
+# 年（减 1900）/ 月 / 日 / 时 / 分 / 秒 各占的位数：按字段拼成 34 位整数，大小顺序与时间一致
+TIME_BITS = (8, 4, 5, 5, 6, 6)
+DOC_BITS = 29
+DOC_MASK = (1 << DOC_BITS) - 1
+# 批量新增超过这么多条时整体重排有序数组，否则逐条插入
+INSORT_LIMIT = 256
+_NUM = re.compile(r"\d+")
+_NONZERO = re.compile(rb"[^\x00]")
+
+
+def time_key(text: str, upper: bool = False) -> int:
+    """
+    "2024-01-31 10:20:00" → 整数。缺的字段取 0；upper=True 时取最大，
+    作为范围上界时 "2024-01-31" 包含当天任意时刻。空字符串 → 0（排在最前）
+    """
+    parts = _NUM.findall(text or "")
+    key = 0
+    for i, bits in enumerate(TIME_BITS):
+        top = (1 << bits) - 1
+        if i < len(parts):
+            v = min(max(int(parts[i]) - (1900 if i == 0 else 0), 0), top)
+        else:
+            v = top if (upper and parts) else 0
+        key = key << bits | v
+    return key
+
+
+def attachment_count(record: dict) -> int:
+    # 列表行（SQLite 模式）直接带 附件数量
+    if "附件数量" in record:
+        return record["附件数量"] or 0
+    return len(record.get("附件") or [])
+
+
+def bits_from(docs, size: int) -> int:
+    """ 位置列表 → 位图 """
+    buf = bytearray((size >> 3) + 1)
+    for d in docs:
+        buf[d >> 3] |= 1 << (d & 7)
+    return int.from_bytes(buf, "little")
+
+
+def bitmap_bytes(bm: int) -> bytes:
+    """ 位图转成 bytes，逐个判断是否命中时用（对 int 做移位每次都是 O(n)） """
+    return bm.to_bytes((bm.bit_length() + 7) >> 3, "little")
+
+
+def has_bit(fb: bytes, d: int) -> bool:
+    i = d >> 3
+    return i < len(fb) and (fb[i] >> (d & 7)) & 1
+
+
+def iter_bits(fb: bytes, start: int = 0):
+    """ 从 start 起按位置升序给出命中的位置（全零字节由正则在 C 里跳过） """
+    for m in _NONZERO.finditer(fb, start >> 3):
+        base = m.start() << 3
+        b = fb[m.start()]
+        while b:
+            low = b & -b
+            d = base + low.bit_length() - 1
+            if d >= start:
+                yield d
+            b ^= low
+
+
+def nth_bit(fb: bytes, n: int, chunk: int = 8192) -> int:
+    """ 第 n 个（从 0 数）命中的位置；整块先用 bit_count 跳过 """
+    for i in range(0, len(fb), chunk):
+        c = int.from_bytes(fb[i:i + chunk], "little").bit_count()
+        if n >= c:
+            n -= c
+            continue
+        for d in iter_bits(fb[:i + chunk], i << 3):
+            if n == 0:
+                return d
+            n -= 1
+    return len(fb) << 3
+
+
+# ===================== 过滤条件 =====================
+class Filters(NamedTuple):
+    """ /api/qa 的过滤条件；时间范围两端都含（leave_to="2024-01-31" 包含当天任意时刻） """
+    status: str = ""
+    region: str = ""
+    org: str = ""
+    leave_from: str = ""
+    leave_to: str = ""
+    reply_from: str = ""
+    reply_to: str = ""
+    has_att: Optional[bool] = None
+
+    def active(self) -> bool:
+        return any(v not in ("", None) for v in self)
+
+    def ranges(self):
+        return (("leave_time", self.leave_from, self.leave_to), ("reply_time", self.reply_from, self.reply_to))
+
+    def match(self, record: dict, skip: str = "") -> bool:
+        """ 与 FacetIndex.select() 相同的条件，逐条判断（索引没建好时的扫描 / 核对索引返回的记录） """
+        if self.status and (record.get("status") or "") != self.status:
+            return False
+        for name, col in FACETS.items():
+            v = getattr(self, name)
+            if v and name != skip and (record.get(col) or "") != v:
+                return False
+        for name, lo, hi in self.ranges():
+            if lo or hi:
+                k = time_key(record.get(SORTS[name]))
+                if (lo and k < time_key(lo)) or (hi and k > time_key(hi, upper=True)):
+                    return False
+        if self.has_att is not None and skip != "has_att" and (attachment_count(record) > 0) != self.has_att:
+            return False
+        return True
+
+
+def decode_cursor(cursor: str, sort: str) -> Optional[int]:
+    """ next_cursor 是 "<sort>:<位置>"；排序方式对不上（或是扫描时给的空游标）返回 None，调用方退回用 offset """
+    tag, _, pos = (cursor or "").partition(":")
+    if tag != sort or not pos.isdigit():
+        return None
+    return int(pos)
+
+
+# ===================== 逐条扫描（索引没建好时） =====================
+def scan_facets(records, filters: Filters) -> dict:
+    """ FacetIndex.facets 的逐条版本（records：已按全文条件筛过的记录） """
+    out = {}
+    for name, col in FACETS.items():
+        counts = Counter(x.get(col) for x in records if x.get(col) and filters.match(x, skip=name))
+        out[col] = dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:FACET_LIMIT])
+    has = [attachment_count(x) > 0 for x in records if filters.match(x, skip="has_att")]
+    out["附件"] = {"有": sum(has), "无": len(has) - sum(has)}
+    return out
+
+
+def scan_query(records, filters: Filters, sort: str, desc: bool, offset: int, limit: int,
+               with_facets: bool = False) -> dict:
+    """
+    records：已按全文条件筛过的记录（入库顺序）。同一时间的按入库顺序，倒序时整体反过来，与索引一致；
+    不给游标（next_cursor=None），翻页用 offset
+    """
+    records = list(records)
+    facets = scan_facets(records, filters) if with_facets else None
+    items = [x for x in records if filters.match(x)]
+    if sort:
+        col = SORTS[sort]
+        items.sort(key=lambda x: time_key(x.get(col)))
+        if desc:
+            items.reverse()
+    return {"total": len(items), "capped": False, "items": items[offset:offset + limit],
+            "next_cursor": None, "facets": facets}
+
+
+# ===================== 内存索引 =====================
+class DocRow(NamedTuple):
+    """ docs 表的一行（search.py 同步时给出） """
+    doc: int
+    status: str
+    region: str
+    org: str
+    leave_time: str
+    reply_time: str
+    attachments: int
+
+
+class FacetIndex:
+    """
+    sync 线程调 load / apply，请求线程调 select / page / facets；都在 self.lock 里做
+    （apply 每次只动新增的几条，锁占用很短）。
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.reset()
+
+    def reset(self) -> None:
+        self.loaded = False
+        self.live = 0
+        self.size = 0
+        self.bitmaps = {name: {} for name in ("status", *FACETS, "has_att")}
+        self.orders = {name: array("q") for name in SORTS}   # (时间, doc) 升序
+        self.keys = {name: array("q") for name in SORTS}     # doc → 时间
+        self._ranges = {}
+
+    def load(self, rows) -> None:
+        """ 从 docs 表整体建立（进程启动后第一次同步完 / 换了数据源） """
+        with self.lock:
+            self.reset()
+            self._add(list(rows), rebuild=True)
+            self.loaded = True
+
+    def apply(self, added: list, removed: list) -> None:
+        """ 同步时新增的行（DocRow）和被改写 / 删除的旧位置 """
+        with self.lock:
+            if added:
+                self._add(added, rebuild=len(added) > INSORT_LIMIT)
+            if removed:
+                self.live &= ~bits_from(removed, self.size)
+            self._ranges = {}
+
+    def _add(self, rows: list, rebuild: bool) -> None:
+        if not rows:
+            return
+        self.size = max(self.size, max(r.doc for r in rows) + 1)
+        for keys in self.keys.values():
+            if len(keys) < self.size:
+                keys.extend(array("q", bytes(8 * (self.size - len(keys)))))
+
+        groups = {name: {} for name in self.bitmaps}
+        for r in rows:
+            for name, v in (("status", r.status or ""), ("region", r.region), ("org", r.org),
+                            ("has_att", r.attachments > 0)):
+                groups[name].setdefault(v, []).append(r.doc)
+        for name, values in groups.items():
+            bms = self.bitmaps[name]
+            for v, docs in values.items():
+                bms[v] = bms.get(v, 0) | bits_from(docs, self.size)
+        self.live |= bits_from((r.doc for r in rows), self.size)
+
+        for name in SORTS:
+            keys, order = self.keys[name], self.orders[name]
+            composites = []
+            for r in rows:
+                k = time_key(getattr(r, name))
+                keys[r.doc] = k
+                composites.append(k << DOC_BITS | r.doc)
+            if rebuild:
+                self.orders[name] = array("q", sorted(chain(order, composites)))
+            else:
+                for c in composites:
+                    insort(order, c)
+
+    # ---------- 查询（调用方持有 self.lock） ----------
+    def _range(self, name: str, lo: str, hi: str) -> int:
+        key = (name, lo, hi)
+        bm = self._ranges.get(key)
+        if bm is None:
+            order = self.orders[name]
+            i = bisect_left(order, time_key(lo) << DOC_BITS) if lo else 0
+            j = bisect_right(order, time_key(hi, upper=True) << DOC_BITS | DOC_MASK) if hi else len(order)
+            if j - i <= len(order) // 2:
+                bm = bits_from((c & DOC_MASK for c in order[i:j]), self.size)
+            else:
+                # 范围比一半还大：数范围外的再取反
+                bm = self.live & ~bits_from((c & DOC_MASK for c in chain(order[:i], order[j:])), self.size)
+            if len(self._ranges) >= 32:
+                self._ranges = {}
+            self._ranges[key] = bm
+        return bm
+
+    def select(self, filters: Filters, extra: Optional[int] = None, skip: str = "") -> int:
+        """ 满足条件的位图；extra：全文命中的位图；skip：算某个分面自己的计数时不按它过滤 """
+        bm = self.live if extra is None else self.live & extra
+        if filters.status:
+            bm &= self.bitmaps["status"].get(filters.status, 0)
+        for name in FACETS:
+            v = getattr(filters, name)
+            if v and name != skip:
+                bm &= self.bitmaps[name].get(v, 0)
+        for name, lo, hi in filters.ranges():
+            if lo or hi:
+                bm &= self._range(name, lo, hi)
+        if filters.has_att is not None and skip != "has_att":
+            att = self.bitmaps["has_att"].get(True, 0)
+            bm = bm & att if filters.has_att else bm & ~att
+        return bm
+
+    def page(self, bm: int, sort: str, desc: bool, offset: int, limit: int, after: Optional[int] = None):
+        """
+        返回 (doc 列表, 下一页游标)。不排序时按入库顺序（doc 升序）；
+        游标是上一页最后一条的位置（排序时是 (时间, doc) 拼成的整数），从它之后接着取；
+        多取一条判断后面还有没有，最后一页正好取满时不给游标
+        """
+        fb = bitmap_bytes(bm)
+        if not sort:
+            start = after + 1 if after is not None else (nth_bit(fb, offset) if offset else 0)
+            positions = list(islice(iter_bits(fb, start), limit + 1))
+        else:
+            positions = self._page_sorted(fb, bm.bit_count(), sort, desc, offset, limit + 1, after)
+        more = len(positions) > limit
+        positions = positions[:limit]
+        docs = positions if not sort else [c & DOC_MASK for c in positions]
+        next_cursor = f"{sort}:{positions[-1]}" if more else None
+        return docs, next_cursor
+
+    def _page_sorted(self, fb: bytes, total: int, sort: str, desc: bool, offset: int, limit: int, after):
+        order = self.orders[sort]
+        skip = offset if after is None else 0
+        # 顺着有序数组扫，平均每 len(order)/total 个才命中一个；比命中总数还多就直接取出命中排序
+        if (skip + limit) * len(order) > 4 * total * max(total, 1):
+            keys = self.keys[sort]
+            hits = sorted(keys[d] << DOC_BITS | d for d in iter_bits(fb))
+            if desc:
+                hits = hits[:len(hits) if after is None else bisect_left(hits, after)][::-1]
+            elif after is not None:
+                hits = hits[bisect_right(hits, after):]
+            return hits[skip:skip + limit]
+
+        out = []
+        if desc:
+            i = (len(order) if after is None else bisect_left(order, after)) - 1
+            step = -1
+        else:
+            i = 0 if after is None else bisect_right(order, after)
+            step = 1
+        while 0 <= i < len(order) and len(out) < limit:
+            c = order[i]
+            if has_bit(fb, c & DOC_MASK):
+                if skip:
+                    skip -= 1
+                else:
+                    out.append(c)
+            i += step
+        return out
+
+    def page_ranked(self, ranked: list, bm: int, offset: int, limit: int) -> list:
+        """ ranked：按相关度排好的 doc（全文命中不多时） """
+        fb = bitmap_bytes(bm)
+        return list(islice((d for d in ranked if has_bit(fb, d)), offset, offset + limit))
+
+    def facets(self, filters: Filters, extra: Optional[int] = None) -> dict:
+        out = {}
+        for name, col in FACETS.items():
+            bm = self.select(filters, extra, skip=name)
+            counts = {}
+            for v, vbm in self.bitmaps[name].items():
+                if v:
+                    n = (vbm & bm).bit_count()
+                    if n:
+                        counts[v] = n
+            out[col] = dict(sorted(counts.items(), key=lambda kv: (-kv[1], kv[0]))[:FACET_LIMIT])
+        bm = self.select(filters, extra, skip="has_att")
+        has = (self.bitmaps["has_att"].get(True, 0) & bm).bit_count()
+        out["附件"] = {"有": has, "无": bm.bit_count() - has}
+        return out
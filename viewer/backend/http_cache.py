@@ -0,0 +1,102 @@
+"""
+/api 的 HTTP 缓存：ETag / Last-Modified / Cache-Control，以及 orjson 序列化。
+
+- ETag（弱：gzip 前后同一个）= 路径 + 查询参数 + 数据版本（来源文件签名、搜索索引版本），
+  在执行接口之前算：If-None-Match 对得上直接 304，不查询、不序列化
+- 数据版本取的是内存里正在用的那份（FileCache 后台重载完成前仍是旧签名），
+  所以返回的内容只会比 ETag 新、不会更旧；客户端最多多下载一次
+- 只按 ETag 判断 304；Last-Modified 只精确到秒，仅供参考（附件文件不会被改写，/api/file 两个都认）
+- 哪个接口用哪些数据来源、Cache-Control 是什么，由 app.py 的 cache_rule 决定
+"""
+import hashlib
+from email.utils import formatdate, parsedate_to_datetime
+
+import anyio.to_thread
+import orjson
+from fastapi.responses import JSONResponse
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.middleware.gzip import GZipMiddleware
+
+
+class OrjsonResponse(JSONResponse):
+    """ 中文多的返回体用 orjson 序列化（直接输出 UTF-8，不转义） """
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content)
+
+
+def not_modified(headers, etag: str, last_modified: str = None) -> bool:
+    """ 条件请求是否可以回 304：有 If-None-Match 只看它（弱比较），否则看 If-Modified-Since """
+    match = headers.get("if-none-match")
+    if match is not None:
+        tags = {t.strip().removeprefix("W/") for t in match.split(",")}
+        return "*" in tags or etag.removeprefix("W/") in tags
+    since = headers.get("if-modified-since")
+    if since and last_modified:
+        try:
+            return parsedate_to_datetime(last_modified) <= parsedate_to_datetime(since)
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+class ApiGZipMiddleware(GZipMiddleware):
+    """ 附件文件（/api/file/）不压缩：PDF / 图片 / Office 本身已压缩，压了还会丢掉 Content-Length """
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and scope["path"].startswith("/api/file/"):
+            await self.app(scope, receive, send)
+            return
+        await super().__call__(scope, receive, send)
+
+
+def data_version(*signatures) -> tuple:
+    """ file_signature() 的结果们 → (版本, 最后修改时间戳或 None) """
+    mtimes = [s[1] for sig in signatures if isinstance(sig, tuple) for s in sig if isinstance(s, tuple)]
+    return signatures, (max(mtimes) / 1e9 if mtimes else None)
+
+
+class ConditionalGetMiddleware:
+    """
+    rules(path, query_string) -> None（不管）或 (Cache-Control, version)；
+    version 是 None（不带 ETag）或 () -> (版本, 最后修改时间戳)，在线程里调用（可能要 stat / 冷启动加载）。
+    """
+
+    def __init__(self, app, rules):
+        self.app = app
+        self.rules = rules
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD"):
+            await self.app(scope, receive, send)
+            return
+        rule = self.rules(scope["path"], scope["query_string"])
+        if rule is None:
+            await self.app(scope, receive, send)
+            return
+
+        cache_control, version = rule
+        extra = {"cache-control": cache_control}
+        if version is not None:
+            v, mtime = await anyio.to_thread.run_sync(version)
+            digest = hashlib.blake2b(repr((scope["path"], scope["query_string"], v)).encode("utf-8"), digest_size=12)
+            extra["etag"] = f'W/"{digest.hexdigest()}"'
+            if mtime is not None:
+                extra["last-modified"] = formatdate(mtime, usegmt=True)
+
+            # 只按 ETag：Last-Modified 只精确到秒，同一秒里的两次写入分不出来
+            match = Headers(scope=scope).get("if-none-match")
+            if match is not None and not_modified({"if-none-match": match}, extra["etag"]):
+                await send({"type": "http.response.start", "status": 304,
+                            "headers": [(k.encode(), value.encode()) for k, value in extra.items()]})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                headers = MutableHeaders(scope=message)
+                for k, value in extra.items():
+                    headers[k] = value
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
@@ -0,0 +1,144 @@
+"""
+附件清单（data/attachments_manifest.jsonl）的内存索引：/api/qa 的 本地附件、/api/attachments 都从这里取，
+不再对每个问答目录 exists() / iterdir() / stat()。
+
+- 清单由爬虫维护（crawler/download.py 每下载完一个文件追加一行；python crawler/manifest.py 整体重建）
+- 只追加：重新加载时从上次读到的偏移往后读新行，前一份的数据共享（改到的问答先复制）；
+  文件变小或换了 inode（重建过）就从头读
+- 没有清单（旧数据目录、还没下载过附件）时退回扫描 attachments/ 一次
+"""
+import json
+import os
+from bisect import bisect_left, bisect_right
+from pathlib import Path
+from typing import Optional
+
+# /api/attachments 的排序键（同值再按 msg_id）
+SUMMARY_SORTS = ("file_count", "total_size", "msg_id")
+
+
+_decode = json.JSONDecoder().decode
+
+
+def is_attachment_name(name: str) -> bool:
+    # 下载中的 <fileId>.<ext>.part、链接中的 .link 临时文件不算（见 crawler/download.py）
+    return not name.endswith((".part", ".link"))
+
+
+class AttachmentManifest:
+    """ msg_id → {文件名: {"filename", "fileId", "size"}}；加载完之后只读 """
+
+    def __init__(self, inode: Optional[int] = None):
+        self.files = {}
+        self.inode = inode
+        self.offset = 0       # 清单里已读到的字节数（只算完整的行）
+        self._orders = {}     # 排序键 → (有序的 (值, msg_id), 聚合行)
+        self._owned = set()   # 这一份里已复制过的问答（其余与上一份共享）
+
+    def extend(self) -> "AttachmentManifest":
+        """ 在这一份的基础上读追加的行：外层 dict 复制，各问答的文件表等改到时再复制 """
+        out = AttachmentManifest(self.inode)
+        out.files = dict(self.files)
+        out.offset = self.offset
+        return out
+
+    def add(self, msg_id: str, filename: str, file_id: str, size: int) -> None:
+        files = self.files.get(msg_id)
+        if msg_id not in self._owned:
+            files = self.files[msg_id] = dict(files or {})
+            self._owned.add(msg_id)
+        files[filename] = {"filename": filename, "fileId": file_id, "size": size}
+
+    def read_lines(self, data: bytes) -> None:
+        for line in data.decode("utf-8", errors="replace").split("\n"):
+            try:
+                entry = _decode(line)
+            except ValueError:
+                continue
+            msg_id, _, filename = (entry.get("path") or "").partition("/")
+            if msg_id and filename and is_attachment_name(filename):
+                self.add(msg_id, filename,
+                         entry.get("fileId") or Path(filename).stem, entry.get("size") or 0)
+
+    def has(self, msg_id: str) -> bool:
+        return bool(msg_id and self.files.get(msg_id))
+
+    def entries(self, msg_id: str) -> list:
+        return list((self.files.get(msg_id) or {}).values())
+
+    def _order(self, sort: str):
+        """ 按问答聚合 file_count / total_size，按 (sort, msg_id) 升序；每种排序第一次用到时算，之后复用 """
+        order = self._orders.get(sort)
+        if order is None:
+            rows = sorted(
+                ({"msg_id": msg_id, "file_count": len(files), "total_size": sum(f["size"] for f in files.values())}
+                 for msg_id, files in self.files.items() if files),
+                key=lambda x: (x[sort], x["msg_id"]),
+            )
+            order = self._orders[sort] = ([(x[sort], x["msg_id"]) for x in rows], rows)
+        return order
+
+    def summary(self, sort: str = "file_count", desc: bool = True, cursor: str = "", limit: Optional[int] = None):
+        """ 返回 (总数, 这一页的聚合行, next_cursor)；游标是上一页最后一行的 (值, msg_id)，limit=None 取到最后 """
+        keys, rows = self._order(sort)
+        after = decode_summary_cursor(cursor, sort)
+        if desc:
+            end = len(rows) if after is None else bisect_left(keys, after)
+            start = 0 if limit is None else max(0, end - limit)
+            page, more = rows[start:end][::-1], start > 0
+        else:
+            start = 0 if after is None else bisect_right(keys, after)
+            end = len(rows) if limit is None else start + limit
+            page, more = rows[start:end], end < len(rows)
+        next_cursor = encode_summary_cursor(page[-1], sort) if page and more else None
+        return len(rows), page, next_cursor
+
+
+def encode_summary_cursor(row: dict, sort: str) -> str:
+    return row["msg_id"] if sort == "msg_id" else f"{row[sort]}:{row['msg_id']}"
+
+
+def decode_summary_cursor(cursor: str, sort: str):
+    """ 与 _order 的键同形；格式不对按没有游标（从头开始） """
+    if not cursor:
+        return None
+    if sort == "msg_id":
+        return cursor, cursor
+    value, _, msg_id = cursor.partition(":")
+    if not value.isdigit():
+        return None
+    return int(value), msg_id
+
+
+def load_manifest(path: Path, att_dir: Path, blob_dir: Path,
+                  prev: Optional[AttachmentManifest] = None) -> AttachmentManifest:
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return scan_attachments(att_dir, blob_dir)
+
+    if prev is None or prev.inode != st.st_ino or st.st_size < prev.offset:
+        m = AttachmentManifest(st.st_ino)
+    else:
+        m = prev.extend()
+    with path.open("rb") as f:
+        f.seek(m.offset)
+        data = f.read()
+    # 爬虫可能正写到一半：只读到最后一个换行，剩下的下次再读
+    end = data.rfind(b"\n") + 1
+    m.read_lines(data[:end])
+    m.offset += end
+    return m
+
+
+def scan_attachments(att_dir: Path, blob_dir: Path) -> AttachmentManifest:
+    m = AttachmentManifest()
+    if not att_dir.exists():
+        return m
+    for d in os.scandir(att_dir):
+        if not d.is_dir() or Path(d.path) == blob_dir:
+            continue
+        for f in os.scandir(d.path):
+            if f.is_file() and is_attachment_name(f.name):
+                m.add(d.name, f.name, Path(f.name).stem, f.stat().st_size)
+    return m
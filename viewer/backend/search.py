@@ -0,0 +1,295 @@
+"""
+/api/qa 的查询索引（data/viewer_search.sqlite3，只有 viewer 读写）。
+
+全文：字符二元组（bigram）倒排，放在 SQLite FTS5 里
+- 中文不分词：每个字和下一个字组成一个词，最后一个字单独成词，词之间用空格分开交给 FTS5 的 ascii 分词器
+  （非 ASCII 字符都算词内字符）；ASCII 字符先映射到私用区，标点、空格、大小写也按原样参与匹配
+- 查询 "增值税" → 短语 "增值 值税"：FTS5 短语要求位置连续，等价于子串匹配，候选不用再逐条比对全文；
+  单字查询用前缀 "增*"（最后一个字单独成词，出现在末尾的也能命中），prefix='1' 的前缀索引让它也是一次查表
+- 命中取成位图（最新的 QUERY_CAP = 20 万条，更多时返回 capped），和 facets.py 的过滤位图做与运算；
+  同一个查询词的位图缓存着，之后只补 rowid 更大的新命中
+- 不按时间排序时：命中不超过 RANK_LIMIT 条按 bm25（标题 > 问题内容 > 答复内容），更多时按入库顺序
+- 只存倒排（contentless：content=''），原文仍在 qa_db / crawl.sqlite3
+
+docs 表：每条记录一行（指纹 + 分面 / 排序用的字段），进程启动后第一次同步完整体读进 facets.FacetIndex，
+之后每次同步把新增 / 改写的行增量交给它
+
+增量：docs 表记着每个 id 的指纹，变了才重新分词；contentless 表删不了旧行，
+同一 id 重新插一行、docs 指向新行，旧行（orphans）只从 FacetIndex.live 里去掉
+"""
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from .facets import FACETS, SORTS, Filters, FacetIndex, DocRow, attachment_count, bits_from
+
+FIELDS = ("标题", "问题内容", "答复内容")
+WEIGHTS = (10.0, 3.0, 1.0)
+RANK_LIMIT = 5000
+# 全文命中最多取最新的这么多条做过滤 / 分面 / 按时间排序；超过时返回 capped
+QUERY_CAP = 200000
+BATCH = 1000
+
+# ASCII → U+F0000 起的私用区：ascii 分词器只把 ASCII 当分隔符 / 做大小写折叠
+ASCII_MAP = {i: 0xF0000 + i for i in range(128)}
+
+# 表结构变了就加 1：旧文件整个重建
+SCHEMA_VERSION = 2
+SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS qa_fts USING fts5(
+    title, question, answer, content='', tokenize='ascii', prefix='1'
+);
+CREATE TABLE IF NOT EXISTS docs (
+    doc          INTEGER PRIMARY KEY,     -- = qa_fts.rowid
+    id           TEXT NOT NULL UNIQUE,
+    fp           INTEGER NOT NULL,        -- 内容指纹，变了才重新索引
+    status       TEXT,
+    纳税人所属地  TEXT NOT NULL,
+    答复机构      TEXT NOT NULL,
+    留言时间      TEXT NOT NULL,
+    答复时间      TEXT NOT NULL,
+    附件数量      INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value);
+"""
+DOC_COLUMNS = "doc, status, 纳税人所属地, 答复机构, 留言时间, 答复时间, 附件数量"
+
+
+def bigram_tokens(text: str) -> str:
+    """ "增值税" → "增值 值税 税" """
+    s = (text or "").translate(ASCII_MAP)
+    if not s:
+        return ""
+    return " ".join(map(str.__add__, s, s[1:])) + " " + s[-1]
+
+
+def match_expr(q: str) -> str:
+    s = q.translate(ASCII_MAP)
+    if len(s) == 1:
+        return f'"{s}" *'
+    return '"' + " ".join(map(str.__add__, s, s[1:])) + '"'
+
+
+def record_hit(record: dict, q: str) -> bool:
+    return any(q in (record.get(k) or "") for k in FIELDS)
+
+
+# ===================== 索引 =====================
+class SearchIndex:
+    """
+    sync() 由后台线程跑（kick），请求线程只读。
+    ready(source) 之前（第一次完整同步还没做完、或数据源换了）调用方应退回逐条扫描。
+    """
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._schema_checked = False
+        self._ready_source = None
+        self._synced_base = None  # 上次完整同步时的快照对象（同一个就只同步增量）
+        self.facet_index = FacetIndex()
+        self.version = 0          # 每次同步有变化就加 1（分面计数缓存按它失效）
+        self._queries = {}        # 查询词 → [命中位图, 已看到的最大 rowid, 命中数, capped, bm25 顺序]
+        self._queries_lock = threading.Lock()
+        self._facet_cache = {}
+        self.metrics = {"syncs": 0, "indexed": 0, "last_sync_seconds": None, "last_error": None,
+                        "searches": 0, "fallbacks": 0, "facet_hits": 0}
+
+    @contextmanager
+    def conn(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            if not self._schema_checked:
+                with self._lock:
+                    if conn.execute("PRAGMA user_version").fetchone()[0] != SCHEMA_VERSION:
+                        conn.executescript("DROP TABLE IF EXISTS qa_fts; DROP TABLE IF EXISTS docs; "
+                                           "DROP TABLE IF EXISTS meta;")
+                        conn.executescript(SCHEMA)
+                        conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+                    self._schema_checked = True
+            yield conn
+        finally:
+            conn.close()
+
+    def _meta(self, conn, key: str, default=None):
+        row = conn.execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else default
+
+    def _set_meta(self, conn, key: str, value) -> None:
+        conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    # ---------- 同步 ----------
+    def ready(self, source: str) -> bool:
+        return self._ready_source == source
+
+    def kick(self, fn) -> None:
+        """ 后台跑 fn(self)（里面调 sync）；已经在跑就什么都不做 """
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(target=self._run, args=(fn,), name="search-sync", daemon=True)
+            self._thread.start()
+
+    def _run(self, fn) -> None:
+        try:
+            fn(self)
+        except Exception as e:
+            self.metrics["last_error"] = f"{type(e).__name__}: {e}"
+
+    def sync(self, source: str, items, cursor=None, base=None) -> int:
+        """
+        items: 可迭代的 (id, 指纹, load)，load() 返回记录；指纹与已索引的相同就跳过（不解码）。
+        source 与索引里记的不同（换了 JSON / SQLite）时清空重建。
+        cursor：数据源自己的增量位置（SQLite 的 rowid），存进 meta；base：完整同步所基于的快照对象。
+        """
+        t0 = time.perf_counter()
+        added, removed = [], []
+        with self.conn() as conn:
+            if self._meta(conn, "source") != source:
+                conn.executescript("DELETE FROM qa_fts; DELETE FROM docs; DELETE FROM meta;")
+                self._set_meta(conn, "source", source)
+                self._ready_source = None
+                self.facet_index.reset()
+                self._queries = {}
+                conn.commit()
+
+            orphans = int(self._meta(conn, "orphans", 0))
+            for rid, fp, load in items:
+                row = conn.execute("SELECT doc, fp FROM docs WHERE id = ?", (rid,)).fetchone()
+                if row is not None and row[1] == fp:
+                    continue
+                record = load()
+                cur = conn.execute(
+                    "INSERT INTO qa_fts (title, question, answer) VALUES (?, ?, ?)",
+                    [bigram_tokens(record.get(k)) for k in FIELDS],
+                )
+                doc = DocRow(cur.lastrowid, record.get("status") or "",
+                             *[record.get(col) or "" for col in (*FACETS.values(), *SORTS.values())],
+                             attachment_count(record))
+                conn.execute(f"INSERT OR REPLACE INTO docs (id, fp, {DOC_COLUMNS}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                             (rid, fp, *doc))
+                added.append(doc)
+                if row is not None:
+                    removed.append(row[0])
+                    orphans += 1
+                if len(added) % BATCH == 0:
+                    self._set_meta(conn, "orphans", orphans)
+                    conn.commit()
+
+            self._set_meta(conn, "orphans", orphans)
+            if cursor is not None:
+                self._set_meta(conn, "cursor", cursor)
+            conn.commit()
+
+            if not self.facet_index.loaded:
+                self.facet_index.load(DocRow(*r) for r in conn.execute(f"SELECT {DOC_COLUMNS} FROM docs"))
+            elif added or removed:
+                self.facet_index.apply(added, removed)
+
+        if base is not None:
+            self._synced_base = base
+        if added or self._ready_source != source:
+            self.version += 1
+        self._ready_source = source
+        self.metrics["syncs"] += 1
+        self.metrics["indexed"] += len(added)
+        self.metrics["last_sync_seconds"] = round(time.perf_counter() - t0, 3)
+        return len(added)
+
+    def synced_base(self):
+        return self._synced_base
+
+    def cursor(self, default=0):
+        with self.conn() as conn:
+            return self._meta(conn, "cursor", default)
+
+    # ---------- 查询 ----------
+    def _query_bits(self, conn, q: str):
+        """ 全文命中 → (位图, bm25 顺序或 None, capped)；按查询词缓存，之后只补 rowid 更大的新命中 """
+        m = match_expr(q)
+        with self._queries_lock:
+            entry = self._queries.pop(q, None)
+            if entry is None:
+                docs = [r[0] for r in conn.execute(
+                    "SELECT rowid FROM qa_fts WHERE qa_fts MATCH ? ORDER BY rowid DESC LIMIT ?", (m, QUERY_CAP + 1)
+                )]
+                capped = len(docs) > QUERY_CAP
+                docs = docs[:QUERY_CAP]
+                entry = [bits_from(docs, docs[0] + 1 if docs else 0), docs[0] if docs else 0, len(docs), capped, None]
+            else:
+                docs = [r[0] for r in conn.execute(
+                    "SELECT rowid FROM qa_fts WHERE qa_fts MATCH ? AND rowid > ?", (m, entry[1])
+                )]
+                if docs:
+                    entry[0] |= bits_from(docs, max(docs) + 1)
+                    entry[1] = max(docs)
+                    entry[2] += len(docs)
+                    entry[4] = None
+
+            if entry[2] <= RANK_LIMIT and entry[4] is None:
+                entry[4] = [r[0] for r in conn.execute(
+                    f"SELECT rowid FROM qa_fts WHERE qa_fts MATCH ? ORDER BY bm25(qa_fts, {', '.join(map(str, WEIGHTS))})",
+                    (m,),
+                )]
+            # 最近用过的放最后，超过 32 个丢最早的
+            self._queries[q] = entry
+            while len(self._queries) > 32:
+                self._queries.pop(next(iter(self._queries)))
+        return entry[0], entry[4], entry[3]
+
+    def query(self, q: str, filters: Filters, sort: str = "", desc: bool = True,
+              offset: int = 0, limit: int = 20, after=None) -> dict:
+        """
+        返回 {"total", "capped", "ids", "next_cursor"}。
+        capped=True：全文命中超过 QUERY_CAP，只在最新的 QUERY_CAP 条里过滤 / 排序，total 是其中的数量
+        """
+        self.metrics["searches"] += 1
+        fi = self.facet_index
+        with self.conn() as conn:
+            qbits, ranked, capped = self._query_bits(conn, q) if q else (None, None, False)
+            with fi.lock:
+                bm = fi.select(filters, qbits)
+                total = bm.bit_count()
+                if ranked is not None and not sort:
+                    docs, next_cursor = fi.page_ranked(ranked, bm, offset, limit), None
+                else:
+                    docs, next_cursor = fi.page(bm, sort, desc, offset, limit, after)
+            ids = dict(conn.execute(f"SELECT doc, id FROM docs WHERE doc IN ({', '.join('?' * len(docs))})", docs))
+        return {"total": total, "capped": capped, "ids": [ids[d] for d in docs if d in ids], "next_cursor": next_cursor}
+
+    def facets(self, q: str, filters: Filters) -> dict:
+        """ 分面计数；结果按 (version, q, filters) 缓存到下次同步有变化 """
+        key = (self.version, q, filters)
+        cached = self._facet_cache.get(key)
+        if cached is not None:
+            self.metrics["facet_hits"] += 1
+            return cached
+
+        qbits = None
+        if q:
+            with self.conn() as conn:
+                qbits = self._query_bits(conn, q)[0]
+        with self.facet_index.lock:
+            out = self.facet_index.facets(filters, qbits)
+
+        if len(self._facet_cache) >= 64 or any(k[0] != self.version for k in self._facet_cache):
+            self._facet_cache = {}
+        self._facet_cache[key] = out
+        return out
+
+    def stats(self) -> dict:
+        fi = self.facet_index
+        out = {**self.metrics, "ready": self._ready_source, "version": self.version,
+               "syncing": self._thread is not None and self._thread.is_alive(),
+               "cached_queries": len(self._queries),
+               "facet_values": {name: len(v) for name, v in fi.bitmaps.items()}}
+        if self.path.exists():
+            with self.conn() as conn:
+                out["docs"] = conn.execute("SELECT COUNT(*) FROM docs").fetchone()[0]
+                out["orphans"] = int(self._meta(conn, "orphans", 0))
+        return out